@@ -0,0 +1,104 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compares parsing CSP and cube text files with loading their memory mapped
+binary sidecars, for 33^3 and 65^3 cubes.
+
+    python benchmarks/bench_lut_io.py [--repeat 5] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lut_io
+
+
+def _synthetic_lut(n):
+    axis = numpy.linspace(0.0, 1.0, n)
+    b, g, r = numpy.meshgrid(axis, axis, axis, indexing="ij")
+    cube = numpy.stack([r, g, b], axis=-1) ** 1.1
+    shaper = numpy.linspace(0.0, 1.0, 1024)
+    return lut_io.Lut3D(cube.astype(numpy.float32), [(shaper, shaper ** 0.9)] * 3)
+
+
+def _write_cube(path, lut):
+    with open(path, "w") as handle:
+        handle.write('TITLE "benchmark"\nLUT_3D_SIZE %d\n' % lut.size)
+        numpy.savetxt(handle, lut.cube.reshape(-1, 3), fmt="%.6f")
+
+
+def _best_of(repeat, func):
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def run(repeat):
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="bench_lut_io")
+    try:
+        for n in (33, 65):
+            lut = _synthetic_lut(n)
+            csp_path = os.path.join(work_dir, "look_%d.csp" % n)
+            cube_path = os.path.join(work_dir, "look_%d.cube" % n)
+            lut_io.write_csp(csp_path, lut)
+            _write_cube(cube_path, lut)
+            for path in (csp_path, cube_path):
+                st = os.stat(path)
+                sidecar = lut_io.sidecar_path(work_dir, path)
+                lut_io.write_sidecar(sidecar, lut_io.read_lut(path), st.st_mtime, st.st_size)
+                parse_time = _best_of(repeat, lambda: lut_io.read_lut(path))
+                # touch the data so that the mapping actually gets paged in
+                mmap_time = _best_of(repeat, lambda: float(lut_io.read_sidecar(sidecar).cube.sum()))
+                results.append({
+                    "format": os.path.splitext(path)[-1].lstrip("."),
+                    "size": n,
+                    "text_bytes": st.st_size,
+                    "sidecar_bytes": os.stat(sidecar).st_size,
+                    "parse_seconds": parse_time,
+                    "mmap_seconds": mmap_time,
+                    "speedup": parse_time / mmap_time if mmap_time else None,
+                })
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark LUT text parsing against binary sidecars.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the best one is kept")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    for result in results:
+        print("%(format)-4s %(size)2d^3  text %(text_bytes)9d bytes %(parse_seconds)8.4fs   "
+              "sidecar %(sidecar_bytes)9d bytes %(mmap_seconds)8.4fs   x%(speedup).0f" % result)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compares several RV sessions of a workstation resolving the look LUTs of the
+same playlist on their own, with all of them going through the shared
+resolver service, on a synthetic show tree with a simulated filer latency.
+
+    python benchmarks/bench_resolver_service.py [--sessions 4] [--shots 200] [--latency 0.002]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import FilesystemLatency
+from show_tree import build_show_tree
+from show_config import ShowConfig
+from lut_resolver_service import ShotLutResolver, LutResolverService, ResolverClient
+
+
+def _run_sessions(sessions, resolve):
+    """
+    Runs resolve(session index) on a thread per session, returns the wall
+    clock time they took together.
+    """
+    threads = [threading.Thread(target=resolve, args=(index,)) for index in range(sessions)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def run(sessions, shots, latency):
+    root = tempfile.mkdtemp(prefix="bench_resolver_service")
+    try:
+        tree = build_show_tree(root, shots)
+        show_config = ShowConfig(tree.cfg_path, "romeo")
+        results = {}
+
+        # every session resolves the playlist on its own, like the plugin without the service
+        resolvers = [ShotLutResolver(show_config) for index in range(sessions)]
+        with FilesystemLatency(root, latency) as filer:
+            seconds = _run_sessions(sessions, lambda index: resolvers[index].resolve_many(tree.media))
+        results["in_process"] = {"seconds": seconds, "filer_calls": filer.total()}
+
+        socket_path = os.path.join(root, "resolver.sock")
+        service = LutResolverService(socket_path)
+        thread = threading.Thread(target=service.serve_forever)
+        thread.start()
+        try:
+            clients = [ResolverClient(socket_path) for index in range(sessions)]
+            with FilesystemLatency(root, latency) as filer:
+                seconds = _run_sessions(sessions, lambda index: clients[index].resolve_many(
+                    tree.cfg_path, "romeo", tree.media))
+            results["service"] = {"seconds": seconds, "filer_calls": filer.total()}
+            for client in clients:
+                client.close()
+        finally:
+            service.shutdown()
+            thread.join()
+            service.close()
+    finally:
+        shutil.rmtree(root)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the shared LUT resolver service.")
+    parser.add_argument("--sessions", type=int, default=4, help="number of RV sessions resolving the playlist")
+    parser.add_argument("--shots", type=int, default=200, help="number of shots in the playlist")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds added to each filer call")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run(args.sessions, args.shots, args.latency)
+    for name in ("in_process", "service"):
+        print("%-10s %8.3fs  %6d filer calls" % (name, results[name]["seconds"], results[name]["filer_calls"]))
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
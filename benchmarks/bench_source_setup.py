@@ -0,0 +1,122 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Times the source setup outside of RV, against the fake rv package and a
+synthetic show tree, for sessions of increasing size and optional injected
+file system latency.
+
+    python benchmarks/bench_source_setup.py --sizes 10 100 1000 5000 --latency 0 0.001 --output results.json
+
+Each result records the wall time, the number of file system calls under the
+show tree and the number of calls made into RV.
+"""
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import harness
+from show_tree import build_show_tree
+
+
+def _measure(name, size, latency, tree, func):
+    """
+    Runs func under injected latency and returns its result record.
+    """
+    calls_before = harness.rv_calls()
+    luts_before = harness.commands.session.luts_read
+    with harness.FilesystemLatency(tree.root, latency) as filesystem:
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+    return {
+        "scenario": name,
+        "sources": size,
+        "latency_seconds": latency,
+        "wall_seconds": elapsed,
+        "ms_per_source": elapsed * 1000.0 / size if size else None,
+        "filesystem_calls": filesystem.total(),
+        "rv_calls": harness.rv_calls() - calls_before,
+        "luts_read": harness.commands.session.luts_read - luts_before,
+    }
+
+
+def run(tree, sizes, latencies):
+    results = []
+    for latency in latencies:
+        for size in sizes:
+            media = [tree.media[index % len(tree.media)] for index in range(size)]
+
+            # cold: a freshly created mode loading the session
+            harness.reset_session()
+            mode = harness.create_mode(tree.cfg_path)
+            results.append(_measure("source_setup_cold", size, latency, tree,
+                                    lambda: harness.load_sources(mode, media)))
+
+            # reload: the same session read again by the same mode
+            harness.clear_session(mode)
+            results.append(_measure("source_setup_reload", size, latency, tree,
+                                    lambda: harness.load_sources(mode, media)))
+
+            results.append(_measure("toggle_slate", size, latency, tree,
+                                    lambda: (mode.toggle_slate(None), mode.toggle_slate(None))))
+            results.append(_measure("toggle_handles", size, latency, tree,
+                                    lambda: (mode.toggle_handles(None), mode.toggle_handles(None))))
+
+            # LUT resolution on its own, with a cold mode
+            harness.reset_session()
+            mode = harness.create_mode(tree.cfg_path)
+            results.append(_measure("retrieve_csp_path_cold", size, latency, tree,
+                                    lambda: [mode._retrieve_csp_path(path) for path in media]))
+            results.append(_measure("retrieve_csp_path_warm", size, latency, tree,
+                                    lambda: [mode._retrieve_csp_path(path) for path in media]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Romeo source setup outside of RV.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000],
+                        help="number of sources in each session")
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0],
+                        help="seconds of latency added to each file system call")
+    parser.add_argument("--shots", type=int, default=2000, help="number of shots in the synthetic show")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--keep-tree", action="store_true", help="don't delete the synthetic show afterwards")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="romeo_show")
+    try:
+        tree = build_show_tree(root, args.shots)
+        results = run(tree, args.sizes, args.latency)
+    finally:
+        if not args.keep_tree:
+            shutil.rmtree(root)
+
+    for result in results:
+        print("%(scenario)-24s %(sources)5d sources  latency %(latency_seconds).4fs  "
+              "%(wall_seconds)8.3fs  fs %(filesystem_calls)7d  rv %(rv_calls)8d  luts %(luts_read)5d" % result)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": sys.platform,
+                "results": results,
+            }, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,168 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Times the startup of the mode in fresh interpreters, against the fake rv
+package and a synthetic show: importing the module, creating the mode,
+loading a session without any EXR, and setting up the first EXR source,
+with a cold and a warm show profile cache.
+
+    python benchmarks/bench_startup.py --runs 10 --output startup.json
+    python benchmarks/bench_startup.py --baseline startup.json --tolerance 0.25
+
+With --baseline, the run fails if the median of any measurement is slower
+than the baseline's by more than the tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from show_tree import build_show_tree
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# measurements below this many seconds are too noisy to fail a run on
+_NOISE_FLOOR = 0.002
+
+
+def child(cfg_path, support_dir, media):
+    """
+    Runs in the fresh interpreter, prints the timings as JSON.
+    """
+    import harness
+    start = time.time()
+    import romeo_source_setup
+    imported = time.time()
+    harness.reset_session()
+    mode = harness.create_mode(cfg_path, support_dir)
+    created = time.time()
+    harness.load_sources(mode, [os.path.splitext(path)[0] + ".mov" for path in media[:-1]])
+    movies_loaded = time.time()
+    # the show config must not have been touched by a session without EXRs
+    show_loaded_early = mode._show_config is not None
+    harness.load_sources(mode, media[-1:])
+    first_exr = time.time()
+    json.dump({
+        "import_seconds": imported - start,
+        "create_mode_seconds": created - imported,
+        "non_exr_session_seconds": movies_loaded - created,
+        "first_exr_seconds": first_exr - movies_loaded,
+        "show_loaded_early": show_loaded_early,
+    }, sys.stdout)
+
+
+def _run_child(cfg_path, support_dir, media_file):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--child",
+                                      cfg_path, support_dir, media_file], cwd=BENCHMARK_DIR)
+    # the mode prints its own banner before the results
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run(tree, runs, sources):
+    media_file = os.path.join(tree.root, "media.json")
+    with open(media_file, "w") as handle:
+        json.dump(tree.media[:sources], handle)
+
+    samples = {}
+    for index in range(runs):
+        # a new support directory means a cold profile cache, the second run with it is warm
+        support_dir = tempfile.mkdtemp(prefix="romeo_support")
+        try:
+            for cache in ("cold", "warm"):
+                result = _run_child(tree.cfg_path, support_dir, media_file)
+                if result.pop("show_loaded_early"):
+                    raise RuntimeError("The show config was loaded before the first EXR source")
+                for name, seconds in result.items():
+                    if name == "first_exr_seconds":
+                        name = "first_exr_%s_profile_seconds" % cache
+                    samples.setdefault(name, []).append(seconds)
+        finally:
+            shutil.rmtree(support_dir)
+    return dict((name, _median(values)) for name, values in samples.items())
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the names of the measurements slower than the baseline by more
+    than the tolerance.
+    """
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None or seconds < _NOISE_FLOOR:
+            continue
+        if seconds > reference * (1.0 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "--child":
+        cfg_path, support_dir, media_file = argv[1:4]
+        with open(media_file) as handle:
+            child(cfg_path, support_dir, json.load(handle))
+        return 0
+
+    parser = argparse.ArgumentParser(description="Benchmark the startup of the Romeo source setup outside of RV.")
+    parser.add_argument("--runs", type=int, default=10, help="number of fresh interpreters to time")
+    parser.add_argument("--sources", type=int, default=20,
+                        help="number of sources in the session, the last one being the only EXR")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file written by --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fraction a measurement may be slower than the baseline by")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="romeo_show")
+    try:
+        tree = build_show_tree(root, max(args.sources, 1))
+        results = run(tree, args.runs, max(args.sources, 1))
+    finally:
+        shutil.rmtree(root)
+
+    for name, seconds in sorted(results.items()):
+        print("%-40s %8.2fms" % (name, seconds * 1000.0))
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": sys.platform,
+                "results": results,
+            }, handle, indent=2)
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name in regressions:
+            print("REGRESSION %s: %.2fms, baseline %.2fms" % (name, results[name] * 1000.0, baseline[name] * 1000.0))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
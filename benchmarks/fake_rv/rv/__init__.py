@@ -0,0 +1,18 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+In-process stand in for RV's python modules, so the source setup can be
+driven and timed outside of a live RV session. It keeps a minimal node
+graph and property store, and counts every call made into it.
+
+Put the fake_rv directory at the front of sys.path before importing the
+mode, then build a session with rv.commands.session.
+"""
@@ -0,0 +1,415 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import bisect
+import functools
+import collections
+
+
+StringType = 8
+IntType = 1
+FloatType = 2
+
+UncheckedMenuState = 0
+CheckedMenuState = 2
+
+# number of calls made into the fake, per command name
+calls = collections.Counter()
+
+
+def _recorded(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        calls[func.__name__] += 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class _PropertyTable(dict):
+    """
+    Property values by full property name, indexed by node so that deleting
+    a node doesn't scan every property of the session.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.by_node = collections.defaultdict(set)
+
+    def __setitem__(self, prop, values):
+        self.by_node[prop.split(".", 1)[0]].add(prop)
+        dict.__setitem__(self, prop, values)
+
+    def setdefault(self, prop, default=None):
+        if prop not in self:
+            self[prop] = default
+        return self[prop]
+
+    def delete_node(self, node):
+        for prop in self.by_node.pop(node, ()):
+            self.pop(prop, None)
+
+
+class FakeSession(object):
+    """
+    The node graph and properties of a fake RV session. Source groups are
+    laid out like RV does it, with a file source, a linearize pipeline and a
+    look pipeline whose members follow its pipeline.nodes property. The
+    default sequence keeps an EDL playing each source from its cut in to its
+    cut out, starting at frame 1.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.node_types = {}
+        self.nodes_by_type = collections.defaultdict(collections.OrderedDict)
+        self.members = collections.defaultdict(list)
+        self.groups = {}
+        self.properties = _PropertyTable()
+        self.source_groups = []
+        self.bindings = {}
+        self.frame = 1
+        self.view_node = "defaultSequence"
+        self.fps = 24.0
+        self.luts_read = 0
+        self._counter = 0
+        self.edl_dirty = True
+        self.add_node("defaultSequence", "RVSequenceGroup")
+        self.add_node("defaultSequence_sequence", "RVSequence", "defaultSequence")
+        self.add_node("defaultStack", "RVStackGroup")
+        for display in ("defaultOutputGroup_displayColor", "displayGroup0_displayColor"):
+            self.add_node(display, "RVDisplayColor")
+            self.properties["%s.color.sRGB" % display] = [1]
+            self.properties["%s.color.Rec709" % display] = [0]
+        self.update_edl()
+
+    def add_node(self, name, node_type, group=None):
+        self.node_types[name] = node_type
+        self.nodes_by_type[node_type][name] = True
+        if group is not None:
+            self.groups[name] = group
+            self.members[group].append(name)
+        return name
+
+    def delete_node(self, name):
+        for member in list(self.members.pop(name, [])):
+            self.delete_node(member)
+        group = self.groups.pop(name, None)
+        if group is not None and name in self.members.get(group, []):
+            self.members[group].remove(name)
+        node_type = self.node_types.pop(name, None)
+        self.nodes_by_type[node_type].pop(name, None)
+        self.properties.delete_node(name)
+        if name in self.source_groups:
+            self.source_groups.remove(name)
+            self.edl_dirty = True
+
+    def add_source(self, media, start, end, media_type=None):
+        """
+        Adds a source group for the given media and returns the group name.
+
+        :param media: list of media paths, as in the media.movie property
+        :param start: first frame of the media
+        :param end: last frame of the media
+        :param media_type: optional Shotgun tracking.mediaType value
+        """
+        group = "sourceGroup%06d" % self._counter
+        self._counter += 1
+        self.add_node(group, "RVSourceGroup")
+        source = self.add_node("%s_source" % group, "RVFileSource", group)
+        lin_pipe = self.add_node("%s_tolinPipeline" % group, "RVLinearizePipelineGroup", group)
+        self.add_node("%s_tolinPipeline_0" % group, "RVLinearize", lin_pipe)
+        self.add_node("%s_lookPipeline" % group, "RVLookPipelineGroup", group)
+        self.properties["%s.media.movie" % source] = list(media)
+        self.properties["%s.cut.in" % source] = [start]
+        self.properties["%s.cut.out" % source] = [end]
+        self.properties["%s.range" % source] = [start, end]
+        if media_type:
+            self.properties["%s.tracking.mediaType" % source] = [media_type]
+        self.source_groups.append(group)
+        self.edl_dirty = True
+        return group
+
+    def source_node(self, group):
+        for member in self.members[group]:
+            if self.node_types[member] == "RVFileSource":
+                return member
+
+    def set_pipeline(self, pipe_node, node_types):
+        for member in list(self.members[pipe_node]):
+            self.delete_node(member)
+        for index, node_type in enumerate(node_types):
+            node = self.add_node("%s_%d" % (pipe_node, index), node_type, pipe_node)
+            if node_type == "RVLookLUT":
+                self.properties["%s.lut.active" % node] = [0]
+            else:
+                self.properties["%s.node.active" % node] = [1]
+
+    def update_edl(self):
+        """
+        Lays the sources out in the EDL of the default sequence, like RV does
+        whenever its inputs or their cuts change. The last edit only marks the
+        end of the sequence.
+        """
+        frames, inputs, ins, outs = [], [], [], []
+        position = 1
+        for index, group in enumerate(self.source_groups):
+            start, end = self.cut_range(self.source_node(group))
+            frames.append(position)
+            inputs.append(index)
+            ins.append(start)
+            outs.append(end)
+            position += max(end - start + 1, 1)
+        frames.append(position)
+        inputs.append(0)
+        ins.append(0)
+        outs.append(0)
+        for name, values in (("frame", frames), ("source", inputs), ("in", ins), ("out", outs)):
+            self.properties["defaultSequence_sequence.edl.%s" % name] = values
+        self.edl_dirty = False
+
+    def cut_range(self, source):
+        """
+        Returns the first and last frame of a source's media RV plays.
+        """
+        start, end = self.properties["%s.range" % source]
+        return max(start, self.properties["%s.cut.in" % source][0]), \
+            min(end, self.properties["%s.cut.out" % source][0])
+
+    def sources_at_frame(self, frame):
+        """
+        Returns the file sources shown at a frame of the view: the one the EDL
+        of the default sequence has there, or the sources of any other view
+        whose media has that frame between its cut in and cut out.
+        """
+        if self.node_types.get(self.view_node) == "RVSequenceGroup":
+            source = self.source_at_frame(frame)
+            return [source] if source else []
+        if self.node_types.get(self.view_node) == "RVSourceGroup":
+            groups = [self.view_node]
+        else:
+            groups = self.source_groups
+        sources = []
+        for group in groups:
+            start, end = self.cut_range(self.source_node(group))
+            if start <= frame <= end:
+                sources.append(self.source_node(group))
+        return sources
+
+    def source_at_frame(self, frame):
+        """
+        Returns the file source shown at a frame of the default sequence.
+        """
+        if self.edl_dirty:
+            self.update_edl()
+        frames = self.properties["defaultSequence_sequence.edl.frame"]
+        index = bisect.bisect_right(frames, frame) - 1
+        if index < 0 or index >= len(frames) - 1:
+            return None
+        group = self.source_groups[self.properties["defaultSequence_sequence.edl.source"][index]]
+        return self.source_node(group)
+
+
+session = FakeSession()
+
+
+def _lookup(prop):
+    if session.edl_dirty and prop.startswith("defaultSequence_sequence."):
+        session.update_edl()
+    if prop not in session.properties:
+        raise Exception("invalid property name %s" % prop)
+    return session.properties[prop]
+
+
+def _expand(prop):
+    # "#Type.component.property" addresses that property on every node of the type
+    if prop.startswith("#"):
+        node_type, rest = prop[1:].split(".", 1)
+        return ["%s.%s" % (node, rest) for node in session.nodes_by_type[node_type]]
+    return [prop]
+
+
+def _set(prop, values):
+    for name in _expand(prop):
+        if name.endswith(".pipeline.nodes"):
+            session.set_pipeline(name[:-len(".pipeline.nodes")], values)
+        session.properties[name] = list(values)
+        if name.endswith(".cut.in") or name.endswith(".cut.out"):
+            session.edl_dirty = True
+
+
+@_recorded
+def nodesInGroup(node):
+    return list(session.members.get(node, []))
+
+
+@_recorded
+def nodeType(node):
+    return session.node_types[node]
+
+
+@_recorded
+def nodeGroup(node):
+    # like RV, a node's group is the top level group it belongs to
+    group = session.groups.get(node)
+    while group in session.groups:
+        group = session.groups[group]
+    return group
+
+
+@_recorded
+def nodeConnections(node, traverseGroups=False):
+    # every source group feeds the default views, in the order it was added
+    if session.node_types.get(node) in ("RVSequenceGroup", "RVStackGroup"):
+        return (list(session.source_groups), [])
+    return ([], [])
+
+
+@_recorded
+def nodeExists(node):
+    return node in session.node_types
+
+
+@_recorded
+def nodesOfType(node_type):
+    return list(session.nodes_by_type[node_type])
+
+
+@_recorded
+def closestNodesOfType(node_type, depth=0):
+    return [node for node in (session.source_node(group) for group in session.source_groups)
+            if session.node_types.get(node) == node_type]
+
+
+@_recorded
+def propertyExists(prop):
+    return prop in session.properties
+
+
+@_recorded
+def newProperty(prop, prop_type, width):
+    session.properties.setdefault(prop, [])
+
+
+@_recorded
+def getStringProperty(prop, start=0, num=2147483647):
+    return list(_lookup(prop))
+
+
+@_recorded
+def getIntProperty(prop, start=0, num=2147483647):
+    return list(_lookup(prop))
+
+
+@_recorded
+def getFloatProperty(prop, start=0, num=2147483647):
+    return list(_lookup(prop))
+
+
+@_recorded
+def setStringProperty(prop, values, allowResize=False):
+    _set(prop, values)
+
+
+@_recorded
+def setIntProperty(prop, values, allowResize=False):
+    _set(prop, values)
+
+
+@_recorded
+def setFloatProperty(prop, values, allowResize=False):
+    _set(prop, values)
+
+
+@_recorded
+def readLUT(path, node, activate=False):
+    # read the whole file, like RV does, so file system latency shows up
+    with open(path, "rb") as handle:
+        data = handle.read()
+    session.luts_read += 1
+    session.properties["%s.lut.file" % node] = [path]
+    session.properties["%s.lut.lut" % node] = [float(len(data))]
+
+
+@_recorded
+def updateLUT():
+    pass
+
+
+@_recorded
+def bind(mode, table, event, func, description=""):
+    session.bindings[(table, event)] = func
+
+
+@_recorded
+def unbind(mode, table, event):
+    session.bindings.pop((table, event), None)
+
+
+@_recorded
+def openFileDialog(associated, multiple, directory, filter, default):
+    return [os.environ["IH_SHOW_CFG_PATH"]]
+
+
+@_recorded
+def frame():
+    return session.frame
+
+
+@_recorded
+def setFrame(frame):
+    session.frame = frame
+
+
+@_recorded
+def fps():
+    return session.fps
+
+
+@_recorded
+def viewNode():
+    return session.view_node
+
+
+@_recorded
+def setViewNode(node):
+    session.view_node = node
+
+
+@_recorded
+def sources():
+    result = []
+    for group in session.source_groups:
+        source = session.source_node(group)
+        start, end = session.properties["%s.range" % source]
+        result.append((session.properties["%s.media.movie" % source][0], start, end, 1, session.fps, False, True))
+    return result
+
+
+@_recorded
+def sourceMediaInfo(source, media=None):
+    start, end = _lookup("%s.range" % source)
+    return {"file": _lookup("%s.media.movie" % source)[0], "startFrame": start, "endFrame": end}
+
+
+@_recorded
+def sourcesAtFrame(frame):
+    return session.sources_at_frame(frame)
+
+
+# -flags name=value pairs RV was started with
+command_line_flags = {}
+
+
+@_recorded
+def commandLineFlag(name, defaultValue=None):
+    return command_line_flags.get(name, defaultValue)
@@ -0,0 +1,27 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+from rv.commands import _recorded, session
+
+# feedback messages shown with displayFeedback, most recent last
+feedback = []
+
+
+@_recorded
+def nodesInEvalPath(frame, node_type, node=None):
+    source = session.source_at_frame(frame)
+    if source is None or session.node_types.get(source) != node_type:
+        return []
+    return [source]
+
+
+@_recorded
+def displayFeedback(message, duration=2.0):
+    feedback.append(message)
@@ -0,0 +1,25 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import re
+
+from rv.commands import _recorded, session
+
+_SWAP_MEDIA = re.compile(r'swapMediaFromInfo\("([^"]*)", "([^"]*)"\)')
+
+
+@_recorded
+def eval(code, modules=None):
+    # shotgun_mode media swaps only change the tracked media type
+    for media_type, source_node in _SWAP_MEDIA.findall(code):
+        prop = "%s.tracking.mediaType" % source_node
+        if prop in session.properties:
+            session.properties[prop] = [media_type]
+    return "0"
@@ -0,0 +1,50 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+
+class MinorMode(object):
+    """
+    Records what a mode registers with init(), so the harness can send it
+    events.
+    """
+
+    def __init__(self):
+        self._name = None
+        self._event_handlers = {}
+        self._menu = None
+
+    def init(self, name, global_bindings, override_bindings, menu=None, sortKey=None, ordering=0):
+        self._name = name
+        for event, func, description in (global_bindings or []) + (override_bindings or []):
+            self._event_handlers[event] = func
+        self._menu = menu
+
+    def handler(self, event_name):
+        """
+        Returns the function the mode bound to an event, or None.
+        """
+        return self._event_handlers.get(event_name)
+
+
+class Event(object):
+    """
+    Event passed to the mode's handlers.
+    """
+
+    def __init__(self, name, contents=""):
+        self.name = name
+        self._contents = contents
+        self.rejected = False
+
+    def contents(self):
+        return self._contents
+
+    def reject(self):
+        self.rejected = True
@@ -0,0 +1,154 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Helpers shared by the benchmarks: loading the mode against the fake rv
+package, feeding it sources, and injecting file system latency.
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+import collections
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+FAKE_RV_DIR = os.path.join(BENCHMARK_DIR, "fake_rv")
+
+for path in (REPO_DIR, FAKE_RV_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from rv import commands, extra_commands
+from rv.rvtypes import Event
+
+_STRING_TYPES = (str, type(u""))
+
+
+class FilesystemLatency(object):
+    """
+    Context manager adding a fixed delay to every stat and directory listing
+    under a root directory, to mimic a slow NFS filer. It also counts those
+    calls. Reads of the LUT files by the fake readLUT go through os.stat
+    first, so they are delayed too.
+    """
+
+    _PATCHED = ("stat", "lstat", "listdir", "scandir")
+
+    def __init__(self, root, latency=0.0):
+        """
+        :param root: only paths under this directory are affected
+        :param latency: seconds added to each call
+        """
+        self.root = root
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._originals = {}
+
+    def __enter__(self):
+        for name in self._PATCHED:
+            original = getattr(os, name, None)
+            if original is None:
+                continue
+            self._originals[name] = original
+            setattr(os, name, self._wrap(name, original))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        self._originals.clear()
+
+    def _wrap(self, name, original):
+        def wrapper(path=".", *args, **kwargs):
+            if isinstance(path, _STRING_TYPES) and path.startswith(self.root):
+                self.calls[name] += 1
+                if self.latency:
+                    time.sleep(self.latency)
+            return original(path, *args, **kwargs)
+        return wrapper
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+def reset_session():
+    """
+    Empties the fake session and the call counters.
+    """
+    commands.session.clear()
+    commands.calls.clear()
+    del extra_commands.feedback[:]
+
+
+def clear_session(mode):
+    """
+    Clears the fake session the way RV does, letting the mode know about it.
+    """
+    send_event(mode, "after-clear-session")
+    reset_session()
+
+
+def create_mode(cfg_path, support_dir=None):
+    """
+    Creates the mode the way RV does, against a show config. The mode logs
+    to a null stream, so the cost of formatting log records is measured but
+    the terminal isn't flooded.
+
+    :param cfg_path: show config file
+    :param support_dir: TWK_APP_SUPPORT_PATH to use, a new temporary one if None
+    """
+    os.environ["TWK_APP_SUPPORT_PATH"] = support_dir or tempfile.mkdtemp(prefix="romeo_support")
+    os.environ["IH_SHOW_CFG_PATH"] = cfg_path
+    os.environ["IH_SHOW_CODE"] = "romeo"
+    # every mode adds a handler to the root logger, don't let them pile up
+    # across benchmark runs
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, "w")
+    try:
+        import romeo_source_setup
+        return romeo_source_setup.createMode()
+    finally:
+        sys.stderr = stderr
+
+
+def send_event(mode, event_name, contents=""):
+    """
+    Sends an event to the handler the mode bound to it.
+    """
+    handler = mode.handler(event_name)
+    if handler is None:
+        return None
+    event = Event(event_name, contents)
+    handler(event)
+    return event
+
+
+def load_sources(mode, media, start=1001, end=1100, media_type="Frames"):
+    """
+    Adds a source per media path to the fake session, sending the mode a
+    source-group-complete event for each, like RV does when loading media.
+    Returns the source groups.
+    """
+    groups = []
+    for path in media:
+        group = commands.session.add_source([path], start, end, media_type)
+        send_event(mode, "source-group-complete", "%s;;new" % group)
+        groups.append(group)
+    return groups
+
+
+def rv_calls():
+    return sum(commands.calls.values())
@@ -0,0 +1,127 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Builds synthetic Romeo show trees, laid out with the show config's
+shot_dir_format and cdl_dir_format, for the benchmarks to run against.
+"""
+
+import os
+import sys
+
+
+SHOW_CODE = "romeo"
+
+_CONFIG = """[production_root]
+{platform} = {production_root}
+
+[show_root]
+{platform} = {inhouse_root}
+
+[{show_code}]
+shot_regexp = (?P<sequence>[a-z]{{2}}[0-9]{{3}})_(?P<shot>[0-9]{{4}})
+sequence_regexp = (?P<sequence>[a-z]{{2}}[0-9]{{3}})_
+shot_dir_format = {{show_root}}{{pathsep}}{{sequence}}{{pathsep}}{{sequence}}_{{shot}}
+seq_dir_format = {{show_root}}{{pathsep}}{{sequence}}
+mainplate_regexp = mainplate
+cdl_dir_format = data{{pathsep}}color
+{extra}
+"""
+
+# a tiny but valid CSP, the benchmarks only care about file system traffic
+_CSP = """CSPLUTV100
+3D
+
+2
+0.0 1.0
+0.0 1.0
+2
+0.0 1.0
+0.0 1.0
+2
+0.0 1.0
+0.0 1.0
+
+2 2 2
+0.0 0.0 0.0
+1.0 0.0 0.0
+0.0 1.0 0.0
+1.0 1.0 0.0
+0.0 0.0 1.0
+1.0 0.0 1.0
+0.0 1.0 1.0
+1.0 1.0 1.0
+"""
+
+_CUBE = """LUT_3D_SIZE 2
+0.0 0.0 0.0
+1.0 0.0 0.0
+0.0 1.0 0.0
+1.0 1.0 0.0
+0.0 0.0 1.0
+1.0 0.0 1.0
+0.0 1.0 1.0
+1.0 1.0 1.0
+"""
+
+
+class ShowTree(object):
+    """
+    A generated show: its config file and the media of every shot.
+    """
+
+    def __init__(self, root, cfg_path, media):
+        self.root = root
+        self.cfg_path = cfg_path
+        # one media path (an image sequence) per shot, in shot order
+        self.media = media
+
+
+def build_show_tree(root, shots=1000, shots_per_sequence=50, csp_files=2, cube_files=2, extra_options=None):
+    """
+    Writes a show tree with the given number of shots under root, each shot
+    having a plate directory and a color directory holding several CSP and
+    cube files. Returns the ShowTree.
+
+    :param root: directory to build the show in, production and in-house trees go under it
+    :param shots: total number of shots
+    :param shots_per_sequence: number of shots in each sequence
+    :param csp_files: number of CSP files in each shot color directory
+    :param cube_files: number of cube files in each shot color directory
+    :param extra_options: dict of additional options for the show section
+    """
+    production_root = os.path.join(root, "production")
+    inhouse_root = os.path.join(root, "inhouse")
+    extra = "\n".join("%s = %s" % item for item in sorted((extra_options or {}).items()))
+    cfg_path = os.path.join(root, "show.cfg")
+    if not os.path.exists(root):
+        os.makedirs(root)
+    with open(cfg_path, "w") as handle:
+        handle.write(_CONFIG.format(platform=sys.platform, production_root=production_root,
+                                    inhouse_root=inhouse_root, show_code=SHOW_CODE, extra=extra))
+
+    media = []
+    for index in range(shots):
+        sequence = "ab%03d" % (index // shots_per_sequence)
+        shot = "%04d" % ((index % shots_per_sequence + 1) * 10)
+        shot_dir = os.path.join(production_root, sequence, "%s_%s" % (sequence, shot))
+        color_dir = os.path.join(shot_dir, "data", "color")
+        plate_dir = os.path.join(shot_dir, "plates")
+        os.makedirs(color_dir)
+        os.makedirs(plate_dir)
+        for lut_index in range(csp_files):
+            with open(os.path.join(color_dir, "%s_%s_look_v%03d.csp" % (sequence, shot, lut_index + 1)), "w") as handle:
+                handle.write(_CSP)
+        for lut_index in range(cube_files):
+            name = "%s_%s_%s_v%03d.cube" % (sequence, shot, "mainplate" if lut_index == 0 else "look", lut_index + 1)
+            with open(os.path.join(color_dir, name), "w") as handle:
+                handle.write(_CUBE)
+        media.append(os.path.join(plate_dir, "%s_%s_mainplate_v001.1001-1100#.exr" % (sequence, shot)))
+    return ShowTree(root, cfg_path, media)
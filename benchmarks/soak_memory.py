@@ -0,0 +1,188 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Soak test of the Romeo source setup for review rooms keeping RV open for
+days: loads playlist after playlist of synthetic sources into the fake RV,
+deletes half of their sources one by one and clears the session, and checks
+that memory stays flat once the caches are full.
+
+    python benchmarks/soak_memory.py [--sources 100000] [--playlist 500] [--max-entries 2000]
+
+Half of the sources show one of more shots than the caches may hold, the
+other half shots that only come up once and have no color directory, so
+every cache of the mode sees far more keys than it may hold. The cache
+bounds are lowered to --max-entries, so that they are reached early in the
+run. Exits with 1 if memory grew by more than --tolerance-kb after the warm
+up, or if per-source state is left behind after a session is cleared.
+
+Runs under RV's Python 2.7 like the plugin, so memory is measured as the
+size of the objects the garbage collector tracks rather than with
+tracemalloc. That covers the dicts, lists and tuples every cache entry
+lives in, along with their instances.
+"""
+
+import os
+import gc
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness
+from show_tree import build_show_tree
+from rv import commands
+
+import romeo_source_setup
+from dir_snapshot import DirectorySnapshotCache
+from show_config import FilenameClassifier
+from lut_fingerprint import LutFingerprints
+
+
+# cache_stats entries holding per-source state, which a cleared session must not leave behind
+_PER_SOURCE = ("pipeline_nodes", "current_nodes", "source_ranges", "pending_looks", "baked_looks",
+               "watched_looks", "deferred_looks", "queued_looks", "prefetch_sources")
+
+
+def _synthetic_media(tree, index, real_every):
+    """
+    Returns the media of the index-th source: one of the shots of the tree
+    every real_every sources, a shot without a color directory otherwise.
+    """
+    real_media = tree.media[(index // real_every) % len(tree.media)]
+    if index % real_every == 0:
+        return real_media
+    # in a plate directory that exists, so that the source gets as far as the classifier
+    return os.path.join(os.path.dirname(real_media), "zz%03d_%04d_mainplate_v001.1001-1100#.exr" % (
+        index // 10000 % 1000, index % 10000))
+
+
+def _live_objects():
+    """
+    Returns the number of objects of each type tracked by the garbage
+    collector, and their total size in bytes.
+    """
+    gc.collect()
+    counts = collections.Counter()
+    size = 0
+    for obj in gc.get_objects():
+        counts[type(obj).__name__] += 1
+        size += sys.getsizeof(obj)
+    return counts, size
+
+
+def run(sources, playlist, max_entries, shots, real_every):
+    romeo_source_setup.RomeoSourceSetup.max_cached_sources = max_entries
+    for cache in (DirectorySnapshotCache, FilenameClassifier, LutFingerprints):
+        cache.max_entries = max_entries
+
+    root = tempfile.mkdtemp(prefix="soak_memory")
+    try:
+        # without the LUT mirror, whose copies of the identical synthetic LUTs are all
+        # the same file
+        tree = build_show_tree(root, shots, csp_files=1, cube_files=0,
+                               extra_options={"lut_mirror_max_bytes": "0"})
+        harness.reset_session()
+        mode = harness.create_mode(tree.cfg_path)
+
+        # fill the caches up to their bounds before taking the baseline
+        warmup = max(4 * max_entries, playlist)
+        baseline = None
+        baseline_counts = None
+        counts = None
+        samples = []
+        leftovers = []
+        loaded = 0
+        while loaded < sources:
+            media = [_synthetic_media(tree, index, real_every)
+                     for index in range(loaded, min(loaded + playlist, sources))]
+            groups = harness.load_sources(mode, media)
+            for group in groups[::2]:
+                harness.send_event(mode, "before-source-delete", commands.session.source_node(group))
+                commands.session.delete_node(group)
+            harness.clear_session(mode)
+            loaded += len(media)
+
+            stats = mode.cache_stats()
+            left = dict((name, stats[name]["entries"]) for name in _PER_SOURCE
+                        if name in stats and stats[name]["entries"])
+            if left:
+                leftovers.append({"sources": loaded, "state": left})
+            if loaded >= warmup:
+                counts, size = _live_objects()
+                if baseline is None:
+                    baseline = size
+                    baseline_counts = counts
+                samples.append((loaded, size))
+
+        growth = samples[-1][1] - baseline if samples else 0
+        top = []
+        if baseline_counts is not None:
+            counts.subtract(baseline_counts)
+            for name, count in counts.most_common(5):
+                if count > 0:
+                    top.append("%s: %+d" % (name, count))
+        return {
+            "sources": loaded,
+            "baseline_bytes": baseline,
+            "growth_bytes": growth,
+            "peak_growth_bytes": max(size for loaded, size in samples) - baseline if samples else 0,
+            "samples": samples,
+            "leftovers": leftovers,
+            "cache_stats": mode.cache_stats(),
+            "top_growth": top,
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the memory of the Romeo source setup stays flat.")
+    parser.add_argument("--sources", type=int, default=100000, help="total number of sources loaded")
+    parser.add_argument("--playlist", type=int, default=500, help="number of sources loaded per session")
+    parser.add_argument("--max-entries", type=int, default=2000, help="bound given to every cache")
+    parser.add_argument("--shots", type=int, default=3000, help="number of shots of the show tree")
+    parser.add_argument("--real-every", type=int, default=2, help="one source in this many shows a real shot")
+    parser.add_argument("--tolerance-kb", type=int, default=512, help="memory growth allowed after the warm up")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    result = run(args.sources, args.playlist, args.max_entries, args.shots, args.real_every)
+    print("%d sources, %.1f KB of objects after the warm up, %+.1f KB at the end, %+.1f KB at most" % (
+        result["sources"], (result["baseline_bytes"] or 0) / 1024.0, result["growth_bytes"] / 1024.0,
+        result["peak_growth_bytes"] / 1024.0))
+    for name, stats in sorted(result["cache_stats"].items()):
+        print("  %-22s %s" % (name, ", ".join("%s %s" % item for item in sorted(stats.items()))))
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(result, handle, indent=2)
+
+    failed = False
+    if result["growth_bytes"] > args.tolerance_kb * 1024:
+        failed = True
+        print("FAIL: memory grew by %.1f KB, more than %d KB. Most added objects:" % (
+            result["growth_bytes"] / 1024.0, args.tolerance_kb))
+        for line in result["top_growth"]:
+            print("  %s" % line)
+    if result["leftovers"]:
+        failed = True
+        print("FAIL: per-source state left after clearing the session: %s" % result["leftovers"][0])
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,522 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Tests of the Romeo source setup against the fake rv, asserting results
+rather than timing them like the benchmarks do.
+
+    python -m pytest benchmarks/test_source_setup.py
+
+pytest isn't available in RV's Python, so running the file directly runs
+the tests too, all of them or the ones named:
+
+    python benchmarks/test_source_setup.py [name ...]
+"""
+
+import os
+import re
+import sys
+import time
+import fcntl
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# also puts the repo and the fake rv package on sys.path
+import harness
+from rv import commands
+from show_tree import build_show_tree
+
+import lut_watcher
+from lut_mirror import LutMirror
+from lut_index import LutIndex, IndexEntry
+from property_batch import PropertyBatch
+from show_config import FilenameClassifier
+from lut_fingerprint import LutFingerprints
+from lut_resolver_service import LutResolverService
+
+
+def _mode(root, shots, extra_options=None):
+    """
+    Returns a show tree and the mode created against it.
+    """
+    tree = build_show_tree(root, shots, extra_options=extra_options)
+    harness.reset_session()
+    return tree, harness.create_mode(tree.cfg_path)
+
+
+def test_mirror_shared(tmpdir):
+    """
+    Two processes sharing the LUT mirror keep its size right, and one
+    doesn't evict a copy the other just handed to readLUT.
+    """
+    root = str(tmpdir)
+    luts = []
+    for index in range(7):
+        luts.append(os.path.join(root, "look_v%03d.csp" % index))
+        with open(luts[-1], "w") as handle:
+            handle.write(str(index) * 100)
+    cache_dir = os.path.join(root, "lut_cache")
+    first = LutMirror(cache_dir, 250)
+    second = LutMirror(cache_dir, 250)
+    in_use = first.local_path(luts[0])
+    for lut in luts[1:-1]:
+        second.local_path(lut)
+    assert os.path.exists(in_use), "a copy in use was evicted"
+    assert second.stats()["bytes"] == 100 * len(second._entries), second.stats()
+    # once nothing is in use, the next copy brings the mirror back within its budget
+    first.in_use_seconds = second.in_use_seconds = 0
+    second.local_path(luts[-1])
+    assert second.stats()["bytes"] <= 250, second.stats()
+    copies = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".csp")]
+    assert second.stats()["bytes"] == sum(os.path.getsize(path) for path in copies), second.stats()
+
+
+def test_handles_hotkey(tmpdir):
+    """
+    The handles hotkey doesn't set up the show before an EXR or DPX source
+    needs it.
+    """
+    tree, mode = _mode(str(tmpdir), 1)
+    mode.toggle_handles(None)
+    assert mode._show_config is None, "toggle_handles set up the show"
+
+
+class _StubShowConfig(object):
+    shot_dir_format = "{show_root}{pathsep}{sequence}{pathsep}{shot}"
+
+    def __init__(self, shot_regexp, sequence_regexp):
+        self._options = {"shot_regexp": shot_regexp, "sequence_regexp": sequence_regexp}
+        self.shot_regexp = re.compile(shot_regexp)
+        self.sequence_regexp = re.compile(sequence_regexp)
+
+    def option(self, option, default, convert=str):
+        return self._options.get(option, default)
+
+    def show_root_for(self, file_name):
+        return "/show"
+
+
+def test_classifier_frame_field(tmpdir):
+    """
+    A shot token in the last numeric field of a name is matched, and not
+    confused with the frame numbers of a sequence.
+    """
+    classifier = FilenameClassifier(_StubShowConfig(r"(?P<sequence>[A-Z]+)\.(?P<shot>\d{4})\.",
+                                                    r"(?P<sequence>[A-Z]+)_"))
+    assert classifier.classify("/plates/ABC.0010.exr")[:3] == ("shot", "ABC", "0010")
+    assert classifier.classify("/plates/ABC.0020.exr")[:3] == ("shot", "ABC", "0020")
+    classifier = FilenameClassifier(_StubShowConfig(r"(?P<sequence>[a-z]+)(?P<shot>\d{3})_",
+                                                    r"(?P<sequence>[a-z]+)_"))
+    for frame in range(1001, 1011):
+        assert classifier.classify("/plates/ab010_plate.%d.exr" % frame)[:3] == ("shot", "ab", "010")
+    assert len(classifier) == 1, "the frames of a sequence were memoized one by one"
+
+
+class _ThreadPool(object):
+    """
+    Stands in for ResolverPool: runs each lookup on a thread of its own, and
+    the callbacks once drain() is called. Like ResolverPool, a lookup for a
+    key already in flight gets the callback attached to it.
+    """
+
+    def __init__(self):
+        self._threads = []
+        self._results = []
+        self._callbacks = {}
+
+    def submit(self, key, func, callback):
+        if key in self._callbacks:
+            self._callbacks[key].append(callback)
+            return
+        self._callbacks[key] = [callback]
+        thread = threading.Thread(target=lambda: self._results.append((key, func())))
+        thread.start()
+        self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def drain(self):
+        self.join()
+        results, self._results = self._results, []
+        for key, result in results:
+            for callback in self._callbacks.pop(key):
+                callback(result)
+
+
+def test_watcher_polls_off_main_thread(tmpdir):
+    """
+    Polled color directories are stat'ed on the pool, and changes still get
+    reported on the main thread.
+    """
+    root = str(tmpdir)
+    main_thread = threading.current_thread()
+    stats_on_main_thread = []
+    os_stat = lut_watcher.os.stat
+
+    def stat(path):
+        if threading.current_thread() is main_thread and path.startswith(root):
+            stats_on_main_thread.append(path)
+        return os_stat(path)
+
+    changed = []
+    pool = _ThreadPool()
+    watcher = lut_watcher.LutWatcher(changed.append, poll_interval=0.0, pool=pool)
+    # as on macOS, or on NFS
+    watcher.inotify = None
+    lut_path = os.path.join(root, "look_v001.csp")
+    with open(lut_path, "w") as handle:
+        handle.write("1")
+    lut_watcher.os.stat = stat
+    try:
+        watcher.watch(root, [lut_path])
+        pool.drain()
+        watcher.poll()
+        pool.drain()
+        watcher.poll()
+        pool.drain()
+        assert changed == [], changed
+        with open(lut_path, "w") as handle:
+            handle.write("22")
+        watcher.poll()
+        pool.drain()
+        watcher.poll()
+        assert changed == [root], changed
+    finally:
+        lut_watcher.os.stat = os_stat
+    assert not stats_on_main_thread, "stat'ed on the main thread: %s" % stats_on_main_thread
+
+
+def test_prefetch_timeline(tmpdir):
+    """
+    Prefetch positions follow the frames RV plays once the slate and
+    handles are trimmed, up to the last source of a long sequence, in the
+    order of the sequence's EDL, and at the media frames of the sources in
+    a stack or a single source view.
+    """
+    tree, mode = _mode(str(tmpdir), 60, {"lut_prefetch": "1"})
+    groups = harness.load_sources(mode, tree.media)
+    sources = dict((mode._pipeline_nodes[group]["RVLookLUT"], commands.session.source_node(group))
+                   for group in groups)
+
+    def check(view_node, count):
+        commands.setViewNode(view_node)
+        harness.send_event(mode, "after-graph-view-change")
+        entries = mode._lut_prefetcher._entries
+        assert len(entries) == count, "%d entries in %s" % (len(entries), view_node)
+        for first, last, look_node in entries:
+            for frame in (first, last):
+                shown = commands.session.sources_at_frame(frame)
+                assert sources[look_node] in shown, "frame %d of %s shows %s, not %s" % (
+                    frame, view_node, shown, sources[look_node])
+
+    for toggle in (mode.toggle_slate, mode.toggle_handles):
+        toggle(None)
+        harness.send_event(mode, "frame-changed")
+        check("defaultSequence", len(groups))
+        check("defaultStack", len(groups))
+        check(groups[7], 1)
+        assert mode._lut_prefetcher._entries[0][0] > 1000, mode._lut_prefetcher._entries[0]
+
+    # the sequence is edited to play the first two sources the other way around
+    commands.setViewNode("defaultSequence")
+    edl = "defaultSequence_sequence.edl"
+    commands.session.update_edl()
+    edl_sources = commands.getIntProperty("%s.source" % edl)
+    commands.setIntProperty("%s.source" % edl, [1, 0] + edl_sources[2:])
+    harness.send_event(mode, "graph-state-change", "%s.frame" % edl)
+    harness.send_event(mode, "frame-changed")
+    entries = mode._lut_prefetcher._entries
+    assert sources[entries[0][2]] == commands.session.source_node(groups[1]), entries[0]
+
+
+def test_toggle_media_evicted(tmpdir):
+    """
+    A baked look keeps its LogC node off when toggle_media swaps back to
+    frames, even once its source was evicted from the node cache.
+    """
+    tree, mode = _mode(str(tmpdir), 10)
+    groups = harness.load_sources(mode, tree.media)
+    alexa_nodes = [mode._pipeline_nodes[group]["LinearToAlexaLogC"] for group in groups]
+    mode._baked_looks.add(mode._pipeline_nodes[groups[3]]["RVLookLUT"])
+    mode._pipeline_nodes.clear()
+    mode.toggle_media(None)
+    mode.toggle_media(None)
+    active = [commands.getIntProperty("%s.node.active" % alexa_node)[0] for alexa_node in alexa_nodes]
+    assert active == [1, 1, 1, 0] + [1] * 6, active
+
+
+def test_service_config_reload(tmpdir):
+    """
+    The resolver service picks up a show config edited while it runs.
+    """
+    root = str(tmpdir)
+    tree = build_show_tree(root, 1)
+    service = LutResolverService(os.path.join(root, "resolver.sock"), revalidate_interval=0.0)
+    try:
+        resolver = service.resolver(tree.cfg_path, "romeo")
+        assert service.resolver(tree.cfg_path, "romeo") is resolver
+        mtime = os.stat(tree.cfg_path).st_mtime
+        with open(tree.cfg_path, "a") as handle:
+            handle.write("\n# edited\n")
+        os.utime(tree.cfg_path, (mtime + 1, mtime + 1))
+        assert service.resolver(tree.cfg_path, "romeo") is not resolver, "the old config is still served"
+    finally:
+        service.close()
+
+
+def test_fingerprints(tmpdir):
+    """
+    A LUT renamed into place is hashed again, even with the same size and
+    mtime, and the mirror's fingerprints match the hashed ones.
+    """
+    root = str(tmpdir)
+    lut_path = os.path.join(root, "look.csp")
+    with open(lut_path, "w") as handle:
+        handle.write("a" * 64)
+    fingerprints = LutFingerprints()
+    first = fingerprints.fingerprint(lut_path)
+    mtime = os.stat(lut_path).st_mtime
+    tmp_path = lut_path + ".tmp"
+    with open(tmp_path, "w") as handle:
+        handle.write("b" * 64)
+    os.utime(tmp_path, (mtime, mtime))
+    os.rename(tmp_path, lut_path)
+    second = fingerprints.fingerprint(lut_path)
+    assert second != first, "a republished LUT kept its old fingerprint"
+    mirror = LutMirror(os.path.join(root, "lut_cache"), 1024)
+    assert mirror.fingerprint(mirror.local_path(lut_path)) == second
+
+
+def test_empty_batch(tmpdir):
+    """
+    Writes handed an empty PropertyBatch end up in it, rather than in a
+    batch of their own nobody flushes.
+    """
+    tree, mode = _mode(str(tmpdir), 1)
+    group = harness.load_sources(mode, tree.media)[0]
+    nodes = mode._pipeline_nodes[group]
+    look_node = nodes["RVLookLUT"]
+    commands.setIntProperty("%s.lut.active" % look_node, [0])
+    batch = PropertyBatch()
+    mode._apply_look(look_node, nodes["LinearToAlexaLogC"], mode._retrieve_look_luts(tree.media[0]), batch)
+    assert len(batch), "_apply_look didn't write into the batch"
+    batch.flush()
+    assert commands.getIntProperty("%s.lut.active" % look_node) == [1]
+
+    lin_node = "%s_tolinPipeline_0" % group
+    commands.setIntProperty("%s.color.logtype" % lin_node, [3])
+    batch = PropertyBatch()
+    mode.do_exr_linearization(lin_node, batch)
+    batch.flush()
+    assert commands.getIntProperty("%s.color.logtype" % lin_node) == [0]
+
+
+def test_lut_index_read_only(tmpdir):
+    """
+    Readers open the index without writing to it, and an index nothing was
+    written into isn't opened at all.
+    """
+    index_path = os.path.join(str(tmpdir), "lut_index.db")
+    index = LutIndex(index_path)
+    entry = IndexEntry("/show/seq/shot/color", "seq", "shot", 1.0, "/show/seq/shot/color/look.csp", 1.0, "csp")
+    index.update([entry])
+    index.close()
+    mtime = os.stat(index_path).st_mtime
+    index = LutIndex.open_existing(index_path)
+    assert index.lookup(entry.color_dir) == entry
+    try:
+        index.update([entry])
+    except sqlite3.Error:
+        pass
+    else:
+        raise AssertionError("wrote to an index opened read only")
+    index.close()
+    assert os.stat(index_path).st_mtime == mtime
+    empty_path = os.path.join(str(tmpdir), "empty.db")
+    open(empty_path, "w").close()
+    assert LutIndex.open_existing(empty_path) is None
+    assert os.path.getsize(empty_path) == 0, "the schema was created by a reader"
+
+
+def test_mirror_copies_off_main_thread(tmpdir):
+    """
+    With the resolver pool, look LUTs are copied into the mirror on the pool
+    and then read from their copy, and no copy holds the mirror's locks.
+    """
+    tree, mode = _mode(str(tmpdir), 4)
+    mode._setup_show()
+    mode._resolver_pool = pool = _ThreadPool()
+    mirror = mode._lut_mirror
+    main_thread = threading.current_thread()
+    calls_on_main_thread = []
+    locked_copies = []
+    local_path, copy = mirror.local_path, mirror._copy
+
+    def traced_local_path(source_path):
+        if threading.current_thread() is main_thread:
+            calls_on_main_thread.append(source_path)
+        return local_path(source_path)
+
+    def traced_copy(source_path, st):
+        with open(mirror._lock_path, "a") as handle:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                locked_copies.append(source_path)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        if mirror._lock.acquire(False):
+            mirror._lock.release()
+        else:
+            locked_copies.append(source_path)
+        return copy(source_path, st)
+
+    mirror.local_path = traced_local_path
+    mirror._copy = traced_copy
+    groups = harness.load_sources(mode, tree.media)
+    pool.drain()
+    assert not calls_on_main_thread, "mirrored on the main thread: %s" % calls_on_main_thread
+    assert not locked_copies, "copied under a lock: %s" % locked_copies
+    assert mirror.stats()["misses"] == len(groups)
+    for group in groups:
+        look_node = mode._pipeline_nodes[group]["RVLookLUT"]
+        assert commands.getIntProperty("%s.lut.active" % look_node) == [1]
+        lut_file = commands.getStringProperty("%s.lut.file" % look_node)[0]
+        assert os.path.dirname(lut_file) == os.path.normpath(mirror._cache_dir), lut_file
+
+
+def test_current_node_cache(tmpdir):
+    """
+    Once every source was shown, the look menu state is read without
+    walking the graph at any frame, and follows a look turned off.
+    """
+    tree, mode = _mode(str(tmpdir), 3)
+    groups = harness.load_sources(mode, tree.media)
+    look_nodes = [mode._pipeline_nodes[group]["RVLookLUT"] for group in groups]
+    # each source plays 100 frames
+    frames = range(1, 301)
+    for frame in frames:
+        commands.setFrame(frame)
+        harness.send_event(mode, "frame-changed")
+        assert mode.look_menu_state() == commands.CheckedMenuState
+    commands.setIntProperty("%s.lut.active" % look_nodes[1], [0])
+    harness.send_event(mode, "graph-state-change", "%s.lut.active" % look_nodes[1])
+    commands.calls.clear()
+    states = []
+    for frame in frames:
+        commands.setFrame(frame)
+        harness.send_event(mode, "frame-changed")
+        states.append(mode.look_menu_state())
+    walks = commands.calls["nodesInEvalPath"] + commands.calls["nodesInGroup"]
+    assert walks == 0, "walked the graph %d times" % walks
+    assert states == [commands.CheckedMenuState] * 100 + [commands.UncheckedMenuState] * 100 + \
+        [commands.CheckedMenuState] * 100
+
+
+def test_reload_after_publish(tmpdir):
+    """
+    A LUT published while a setup lookup of the same color directory is in
+    flight is picked up by the reload, and the look is turned off once the
+    directory has no LUT left.
+    """
+    # without the mirror, so the look nodes read the published paths
+    tree, mode = _mode(str(tmpdir), 1, {"lut_mirror_max_bytes": "0"})
+    mode._setup_show()
+    mode._resolver_pool = pool = _ThreadPool()
+    mode._lut_watcher = lut_watcher.LutWatcher(mode._color_dir_changed, poll_interval=3600.0, pool=pool)
+    mode._lut_watcher.inotify = None
+    media = tree.media[0]
+    first = harness.load_sources(mode, [media])[0]
+    pool.drain()
+    # a second source of the shot, whose lookup is done before the publish
+    second = harness.load_sources(mode, [media])[0]
+    pool.join()
+
+    color_dir = list(mode._watched_looks)[0]
+    old_lut = mode._retrieve_look_luts(media)[0]
+    new_lut = os.path.join(color_dir, os.path.basename(old_lut).replace("_v0", "_v9"))
+    # a LUT of its own, one with the same contents isn't read again
+    with open(old_lut) as old_handle, open(new_lut, "w") as new_handle:
+        new_handle.write(old_handle.read() + "\n")
+    os.utime(new_lut, (time.time() + 10, time.time() + 10))
+    mode._color_dir_changed(color_dir)
+    pool.drain()
+    looks = [mode._pipeline_nodes[group]["RVLookLUT"] for group in (first, second)]
+    for look_node in looks:
+        lut_file = commands.getStringProperty("%s.lut.file" % look_node)[0]
+        assert lut_file == new_lut, "kept %s" % lut_file
+
+    for name in os.listdir(color_dir):
+        os.remove(os.path.join(color_dir, name))
+    mode._color_dir_changed(color_dir)
+    pool.drain()
+    for look_node in looks:
+        assert commands.getIntProperty("%s.lut.active" % look_node) == [0], "LUT left on"
+
+
+def test_stuck_service_main_thread(tmpdir):
+    """
+    Without the resolver pool, the main thread gives up on a resolver
+    service that doesn't answer within a fraction of a second and resolves
+    the look LUTs itself.
+    """
+    root = str(tmpdir)
+    socket_path = os.path.join(root, "resolver.sock")
+    # takes connections, never answers
+    stuck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stuck.bind(socket_path)
+    stuck.listen(4)
+    try:
+        tree, mode = _mode(root, 2, {"lut_resolver_daemon": "1", "lut_resolver_socket": socket_path})
+        started = time.time()
+        groups = harness.load_sources(mode, tree.media)
+        elapsed = time.time() - started
+        assert elapsed < 2.0, "the main thread waited %.1f seconds for the service" % elapsed
+        for group in groups:
+            look_node = mode._pipeline_nodes[group]["RVLookLUT"]
+            assert commands.getIntProperty("%s.lut.active" % look_node) == [1], "no LUT for %s" % group
+    finally:
+        stuck.close()
+
+
+def main(argv=None):
+    names = sys.argv[1:] if argv is None else argv
+    tests = sorted((func.__code__.co_firstlineno, name, func) for name, func in globals().items()
+                   if name.startswith("test_"))
+    failed = 0
+    for line, name, test in tests:
+        if names and name not in names:
+            continue
+        root = tempfile.mkdtemp(prefix="test_source_setup")
+        start = time.time()
+        try:
+            test(root)
+        except Exception:
+            failed += 1
+            print("FAIL %s" % name)
+            traceback.print_exc()
+        else:
+            print("ok   %s (%.2fs)" % (name, time.time() - start))
+        finally:
+            shutil.rmtree(root)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import threading
+import collections
+
+
+class LruDict(object):
+    """
+    Mapping holding at most max_entries items, the least recently used ones
+    being evicted first, so that caches don't grow for as long as RV stays
+    open. Reading an item through get() or [] counts as a use, testing
+    for it with in doesn't. Safe to use from several threads.
+    """
+
+    def __init__(self, max_entries, on_evict=None):
+        """
+        :param max_entries: number of items kept at most
+        :param on_evict: optional callable taking the key and value of each
+                         evicted item, called once the cache is consistent
+        """
+        self.max_entries = max_entries
+        self._on_evict = on_evict
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            # move to the most recently used end
+            self._items[key] = value
+            return value
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        evicted = []
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_entries:
+                evicted.append(self._items.popitem(last=False))
+            self.evictions += len(evicted)
+        if self._on_evict is not None:
+            for evicted_key, evicted_value in evicted:
+                self._on_evict(evicted_key, evicted_value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._items[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    __nonzero__ = __bool__
+
+    def values(self):
+        with self._lock:
+            return list(self._items.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._items.items())
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        """
+        Returns the number of items, the bound and the number of evictions.
+        """
+        return {"entries": len(self._items), "max_entries": self.max_entries, "evictions": self.evictions}
@@ -0,0 +1,190 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import stat
+
+from bounded_cache import LruDict
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = getattr(os, "scandir", None)
+
+
+# marker for a snapshot whose choice hasn't been computed yet, since None is a
+# perfectly valid (negative) choice
+_UNSET = object()
+
+
+class DirectoryEntry(object):
+    """
+    A single file in a directory snapshot, along with the stat results we
+    need so that nobody has to go back to the file system for them.
+    """
+    __slots__ = ("name", "path", "mtime", "size")
+
+    def __init__(self, name, path, mtime, size):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+
+
+class DirectorySnapshot(object):
+    """
+    The contents of a directory as of a given directory mtime, plus whatever
+    the cache's chooser picked out of it. Snapshots seeded from an index only
+    carry the choice, their entries are None.
+    """
+
+    def __init__(self, path, mtime, entries):
+        """
+        :param path: directory that was listed
+        :param mtime: st_mtime of the directory at listing time
+        :param entries: list of DirectoryEntry objects for the regular files
+        """
+        self.path = path
+        self.mtime = mtime
+        self.entries = entries
+        self.choice = _UNSET
+
+
+def _list_directory(path):
+    """
+    Lists the regular files in a directory, stat'ing each of them exactly once.
+    Hidden files are skipped to match what glob.glob('*') used to return.
+
+    :param path: directory to list
+    """
+    entries = []
+    if scandir is not None:
+        for dir_entry in scandir(path):
+            if dir_entry.name.startswith("."):
+                continue
+            try:
+                st = dir_entry.stat()
+            except OSError:
+                # file went away between listing and stat'ing it
+                continue
+            if stat.S_ISREG(st.st_mode):
+                entries.append(DirectoryEntry(dir_entry.name, dir_entry.path, st.st_mtime, st.st_size))
+    else:
+        for name in os.listdir(path):
+            if name.startswith("."):
+                continue
+            file_path = os.path.join(path, name)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                entries.append(DirectoryEntry(name, file_path, st.st_mtime, st.st_size))
+    return entries
+
+
+class DirectorySnapshotCache(object):
+    """
+    Caches one snapshot per directory and revalidates it with a single stat of
+    the directory itself. The directory is only listed again when its mtime
+    changes, i.e. when a file is published, renamed or removed in it.
+
+    Note that rewriting an existing file in place does not change the mtime of
+    the directory, so it won't trigger a new listing. The path chosen out of
+    the snapshot is still valid in that case.
+
+    An index (see lut_index.LutIndex) can be given to seed the cache. When the
+    index has an entry built from the current directory mtime, its choice is
+    used without listing the directory at all.
+
+    At most max_entries snapshots are kept, the least recently used
+    directories being listed again if they come back.
+    """
+
+    # snapshots kept at most
+    max_entries = 5000
+
+    def __init__(self, chooser, index=None):
+        """
+        :param chooser: callable taking a DirectorySnapshot and returning the
+                        value to cache alongside it (None is a valid result)
+        :param index: optional object with a lookup(path) method returning
+                      entries with dir_mtime and lut_path attributes
+        """
+        self._chooser = chooser
+        self._index = index
+        self._snapshots = LruDict(self.max_entries)
+
+    def get(self, path):
+        """
+        Returns the up to date snapshot of the given directory, or None if the
+        directory doesn't exist or isn't a directory.
+
+        :param path: directory to look up
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._snapshots.pop(path, None)
+            return None
+        if not stat.S_ISDIR(st.st_mode):
+            self._snapshots.pop(path, None)
+            return None
+
+        snapshot = self._snapshots.get(path)
+        if (snapshot is None or snapshot.mtime != st.st_mtime) and self._index is not None:
+            entry = self._index.lookup(path)
+            if entry is not None and entry.dir_mtime == st.st_mtime:
+                snapshot = DirectorySnapshot(path, st.st_mtime, None)
+                snapshot.choice = entry.lut_path
+                self._snapshots[path] = snapshot
+        if snapshot is None or snapshot.mtime != st.st_mtime:
+            try:
+                entries = _list_directory(path)
+            except OSError:
+                self._snapshots.pop(path, None)
+                return None
+            snapshot = DirectorySnapshot(path, st.st_mtime, entries)
+            self._snapshots[path] = snapshot
+        if snapshot.choice is _UNSET:
+            snapshot.choice = self._chooser(snapshot)
+        return snapshot
+
+    def choice(self, path):
+        """
+        Convenience wrapper returning only the chooser's result for the given
+        directory, None if there isn't one or the directory is missing.
+
+        :param path: directory to look up
+        """
+        snapshot = self.get(path)
+        if snapshot is None:
+            return None
+        return snapshot.choice
+
+    def invalidate(self, path=None):
+        """
+        Drops the snapshot of the given directory, or all of them.
+
+        :param path: directory to forget, None to clear the whole cache
+        """
+        if path is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(path, None)
+
+    def stats(self):
+        """
+        Returns the number of snapshots, the bound and the number of evictions.
+        """
+        return self._snapshots.stats()
+
+    def __len__(self):
+        return len(self._snapshots)
@@ -5,7 +5,7 @@ PACKAGE=`cat PACKAGE | grep file | awk -F': ' '{print $2}' | sed -e 's/\.py//g'`
 
 PKGNAME="${PACKAGE}-${VERSION}.rvpkg"
 RVDIR="${HOME}/Library/Application Support/RV"
-zip ../$PKGNAME PACKAGE romeo_source_setup.py preferences.py
+zip ../$PKGNAME PACKAGE romeo_source_setup.py preferences.py dir_snapshot.py resolver_pool.py show_config.py lut_index.py lut_mirror.py property_batch.py perf_trace.py source_ranges.py lut_watcher.py lut_prefetch.py romeo_logging.py lut_resolver_service.py lut_fingerprint.py bounded_cache.py
 cp -vf ../$PKGNAME /Volumes/romeo_inhouse/romeo/SHARED/sw_installs
 if [ -e "${RVDIR}/Packages" ]; then
     cp -vf ../$PKGNAME "${RVDIR}/Packages"
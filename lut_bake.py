@@ -0,0 +1,220 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Bakes the per pixel look chain of EXR/DPX sources (LinearToAlexaLogC followed
+by the shot's look LUT) into a single CSP per shot, so that RV only has to
+evaluate one LUT node on playback.
+
+The baked CSP uses its 1D prelut to do the LogC encode, and its 3D cube holds
+the shot look sampled on the LogC grid. The source setup disables the
+LinearToRec709 node for EXR/DPX files, so it isn't part of the bake unless
+--rec709 is given.
+
+Bake every shot in the LUT index that doesn't have an up to date bake with:
+
+    python lut_bake.py --config /path/to/show.cfg --show romeo
+
+Baked LUTs are written to a "baked" directory next to the index, and
+registered in the index so that the plugin can find them.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import argparse
+
+import numpy
+
+from show_config import ShowConfig
+from lut_index import LutIndex, BakedEntry
+from lut_io import Lut3D, load_lut, write_csp
+
+
+logger = logging.getLogger("romeo.lut_bake")
+
+# ALEXA LogC (v3, EI 800) encoding parameters, as used by LinearToAlexaLogC
+_LOGC_CUT = 0.010591
+_LOGC_A = 5.555556
+_LOGC_B = 0.052272
+_LOGC_C = 0.247190
+_LOGC_D = 0.385537
+_LOGC_E = 5.367655
+_LOGC_F = 0.092809
+
+
+def logc_encode(x):
+    x = numpy.asarray(x, dtype=numpy.float64)
+    return numpy.where(
+        x > _LOGC_CUT,
+        _LOGC_C * numpy.log10(numpy.maximum(_LOGC_A * x + _LOGC_B, 1e-10)) + _LOGC_D,
+        _LOGC_E * x + _LOGC_F,
+    )
+
+
+def logc_decode(t):
+    t = numpy.asarray(t, dtype=numpy.float64)
+    return numpy.where(
+        t > _LOGC_E * _LOGC_CUT + _LOGC_F,
+        (numpy.power(10.0, (t - _LOGC_D) / _LOGC_C) - _LOGC_B) / _LOGC_A,
+        (t - _LOGC_F) / _LOGC_E,
+    )
+
+
+def rec709_encode(x):
+    x = numpy.asarray(x, dtype=numpy.float64)
+    return numpy.where(x < 0.018, 4.5 * x, 1.099 * numpy.power(numpy.maximum(x, 0.0), 0.45) - 0.099)
+
+
+def _grid(n):
+    """
+    Every point of an n^3 grid over [0, 1], red fastest.
+    """
+    axis = numpy.linspace(0.0, 1.0, n)
+    b, g, r = numpy.meshgrid(axis, axis, axis, indexing="ij")
+    return numpy.stack([r.ravel(), g.ravel(), b.ravel()], axis=-1)
+
+
+def unbaked_chain(look, rec709=False):
+    """
+    Returns a function evaluating the node chain the bake replaces, on an
+    (M, 3) array of linear colors.
+    """
+    def evaluate(rgb):
+        result = look.apply(logc_encode(rgb))
+        if rec709:
+            result = rec709_encode(result)
+        return result
+    return evaluate
+
+
+def bake(look, cube_size=33, prelut_size=1024, rec709=False):
+    """
+    Composes the LogC encode, the look LUT and optionally the Rec709 encode
+    into a single Lut3D.
+
+    :param look: Lut3D of the shot look
+    :param cube_size: edge length of the baked cube
+    :param prelut_size: number of points in the baked LogC prelut
+    :param rec709: whether to include the LinearToRec709 stage
+    """
+    # the prelut maps linear input to its LogC value, which is where the cube is sampled
+    logc_points = numpy.linspace(0.0, 1.0, prelut_size)
+    linear_points = logc_decode(logc_points)
+    prelut = [(linear_points, logc_points)] * 3
+    cube = look.apply(_grid(cube_size))
+    if rec709:
+        cube = rec709_encode(cube)
+    return Lut3D(cube.reshape(cube_size, cube_size, cube_size, 3).astype(numpy.float32), prelut)
+
+
+def measure_error(baked, chain, samples=100000, seed=0):
+    """
+    Compares the baked LUT against the chain it replaces, on random linear
+    colors spread evenly in LogC. Returns max, mean and 99th percentile of
+    the absolute error.
+    """
+    random = numpy.random.RandomState(seed)
+    linear = logc_decode(random.uniform(0.0, 1.0, (samples, 3)))
+    error = numpy.abs(baked.apply(linear) - chain(linear))
+    return {
+        "max": float(error.max()),
+        "mean": float(error.mean()),
+        "p99": float(numpy.percentile(error, 99)),
+    }
+
+
+def baked_path_for(bake_dir, entry, cube_size, rec709):
+    """
+    Returns where the bake of an index entry goes. The name depends on the
+    source LUT and its mtime, so a republished LUT never reuses an old bake.
+    """
+    digest = hashlib.sha1(("%s:%r:%d:%d" % (entry.lut_path, entry.lut_mtime, cube_size, rec709)).encode("utf-8"))
+    return os.path.join(bake_dir, "%s_%s_%s.csp" % (entry.sequence, entry.shot, digest.hexdigest()[:12]))
+
+
+def bake_entry(entry, bake_dir, cube_size, prelut_size, rec709, samples, cache_dir=None):
+    """
+    Bakes the LUT of a single index entry. Returns the BakedEntry.
+    """
+    look = load_lut(entry.lut_path, cache_dir)
+    baked = bake(look, cube_size, prelut_size, rec709)
+    error = measure_error(baked, unbaked_chain(look, rec709), samples)
+    baked_path = baked_path_for(bake_dir, entry, cube_size, rec709)
+    tmp_path = baked_path + ".tmp"
+    write_csp(tmp_path, baked, [
+        "baked from %s" % entry.lut_path,
+        "LinearToAlexaLogC + look%s" % (" + LinearToRec709" if rec709 else ""),
+    ])
+    os.rename(tmp_path, baked_path)
+    return BakedEntry(entry.lut_path, entry.lut_mtime, baked_path, cube_size, error["max"], error["mean"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bake the Romeo look chain into one LUT per shot.")
+    parser.add_argument("--config", default=os.environ.get("IH_SHOW_CFG_PATH"),
+                        help="show config file, defaults to $IH_SHOW_CFG_PATH")
+    parser.add_argument("--show", default=os.environ.get("IH_SHOW_CODE", "romeo"),
+                        help="show code, defaults to $IH_SHOW_CODE")
+    parser.add_argument("--index", help="index database, defaults to lut_index_path from the show config")
+    parser.add_argument("--size", type=int, default=33, help="edge length of the baked cube")
+    parser.add_argument("--prelut-size", type=int, default=1024, help="number of points in the LogC prelut")
+    parser.add_argument("--rec709", action="store_true", help="include the LinearToRec709 stage")
+    parser.add_argument("--samples", type=int, default=100000, help="number of colors used to measure the error")
+    parser.add_argument("--force", action="store_true", help="rebake shots that already have an up to date bake")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.config:
+        parser.error("no show config given and IH_SHOW_CFG_PATH is not defined")
+    show_config = ShowConfig(args.config, args.show)
+    index_path = args.index or show_config.option("lut_index_path", None)
+    if not index_path or not os.path.isfile(index_path):
+        parser.error("no LUT index found, build one with lut_index.py first")
+
+    bake_dir = os.path.join(os.path.dirname(os.path.abspath(index_path)), "baked")
+    # binary sidecars of the parsed look LUTs, so rebakes don't parse the text files again
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(index_path)), "parsed")
+    if not os.path.exists(bake_dir):
+        os.makedirs(bake_dir)
+
+    index = LutIndex(index_path)
+    baked_count = 0
+    worst = 0.0
+    start = time.time()
+    try:
+        for entry in sorted(index.entries().values()):
+            if not entry.lut_path:
+                continue
+            current = index.lookup_baked(entry.lut_path)
+            if (not args.force and current is not None and current.lut_mtime == entry.lut_mtime
+                    and current.cube_size == args.size and os.path.exists(current.baked_path)):
+                continue
+            try:
+                baked = bake_entry(entry, bake_dir, args.size, args.prelut_size, args.rec709, args.samples, cache_dir)
+            except (IOError, ValueError) as e:
+                logger.warning("Unable to bake %s: %s", entry.lut_path, e)
+                continue
+            index.update_baked([baked])
+            if current is not None and current.baked_path != baked.baked_path and os.path.exists(current.baked_path):
+                os.remove(current.baked_path)
+            baked_count += 1
+            worst = max(worst, baked.max_error)
+            logger.info("Baked %s_%s: max error %.6f, mean error %.6f",
+                        entry.sequence, entry.shot, baked.max_error, baked.mean_error)
+    finally:
+        index.close()
+    logger.info("Baked %d LUTs in %.2f seconds, worst max error %.6f.", baked_count, time.time() - start, worst)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,118 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import hashlib
+import threading
+
+from bounded_cache import LruDict
+
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def format_fingerprint(digest, size):
+    """
+    Returns the fingerprint of a file from the hex sha1 of its contents and
+    its size, eg. for a LUT the mirror already hashed while copying it.
+    """
+    return "%s:%d" % (digest, size)
+
+
+class LutFingerprints(object):
+    """
+    Fingerprints of LUT files, identifying their contents whatever their
+    path or mtime, so that a LUT republished byte for byte, or a session
+    read again, isn't read into a look node already holding it.
+
+    A fingerprint is the sha1 of the file along with its size. Files are
+    only hashed again once their mtime, size, ctime or inode changes, or once
+    they are among the least recently used past max_entries files. A file
+    rewritten in place with the same size within the timestamp resolution of
+    its file system, eg. one second on some NFS servers, keeps its old
+    fingerprint until it changes again. LUTs published by renaming a new
+    file into place always get a new inode.
+    """
+
+    # fingerprints kept at most
+    max_entries = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> (stamp, fingerprint)
+        self._fingerprints = LruDict(self.max_entries)
+        self.hashed = 0
+
+    def fingerprint(self, path):
+        """
+        Returns the fingerprint of a LUT file, None if it can't be read.
+        Reads the whole file unless it is cached, so best called off the
+        main thread.
+
+        :param path: LUT file
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        fingerprint = self.cached(path, st)
+        if fingerprint is not None:
+            return fingerprint
+        digest = hashlib.sha1()
+        try:
+            with open(path, "rb") as handle:
+                while True:
+                    chunk = handle.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+        except (IOError, OSError):
+            return None
+        fingerprint = format_fingerprint(digest.hexdigest(), st.st_size)
+        with self._lock:
+            self._fingerprints[path] = (_stamp(st), fingerprint)
+            self.hashed += 1
+        return fingerprint
+
+    def cached(self, path, st):
+        """
+        Returns the fingerprint of a LUT file if it is cached and up to date,
+        None otherwise. Doesn't read the file.
+
+        :param path: LUT file
+        :param st: os.stat() result of the file
+        """
+        cached = self._fingerprints.get(path)
+        if cached is not None and cached[0] == _stamp(st):
+            return cached[1]
+        return None
+
+    def forget(self, path):
+        """
+        Drops the cached fingerprint of a file.
+
+        :param path: LUT file
+        """
+        self._fingerprints.pop(path, None)
+
+    def stats(self):
+        """
+        Returns the number of fingerprints, the bound and the number of evictions.
+        """
+        stats = self._fingerprints.stats()
+        stats["hashed"] = self.hashed
+        return stats
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+
+def _stamp(st):
+    return (st.st_mtime, st.st_size, st.st_ctime, st.st_ino)
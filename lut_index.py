@@ -0,0 +1,343 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Prebuilt index mapping shot color directories to their look LUT, so that RV
+doesn't have to crawl the show tree at view time.
+
+Build or refresh the index with:
+
+    python lut_index.py --config /path/to/show.cfg --show romeo --index /path/to/lut_index.db
+
+Refreshing is incremental, only color directories whose mtime changed since
+the last crawl are listed again. Pass --full to rescan everything.
+"""
+
+import os
+import sys
+import glob
+import time
+import logging
+import threading
+import collections
+
+import sqlite3
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+from show_config import ShowConfig
+from dir_snapshot import DirectorySnapshotCache
+
+
+logger = logging.getLogger("romeo.lut_index")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS luts (
+    color_dir TEXT PRIMARY KEY,
+    sequence TEXT,
+    shot TEXT,
+    dir_mtime REAL,
+    lut_path TEXT,
+    lut_mtime REAL,
+    lut_format TEXT
+);
+CREATE TABLE IF NOT EXISTS baked (
+    lut_path TEXT PRIMARY KEY,
+    lut_mtime REAL,
+    baked_path TEXT,
+    cube_size INTEGER,
+    max_error REAL,
+    mean_error REAL
+);
+"""
+
+IndexEntry = collections.namedtuple(
+    "IndexEntry", ["color_dir", "sequence", "shot", "dir_mtime", "lut_path", "lut_mtime", "lut_format"]
+)
+
+BakedEntry = collections.namedtuple(
+    "BakedEntry", ["lut_path", "lut_mtime", "baked_path", "cube_size", "max_error", "mean_error"]
+)
+
+
+class LutIndex(object):
+    """
+    SQLite backed shot to LUT index. Entries are keyed by the shot color
+    directory, and carry the directory mtime they were built from so that
+    readers can tell whether they are stale. A NULL lut_path records that the
+    directory had no LUT in it.
+
+    The index also records the baked LUTs written by lut_bake.py, keyed by
+    the look LUT they were baked from.
+
+    Only the crawler, lut_bake.py and lut_prewarm.py create and write the
+    index. RV and the resolver service open it read only, so that they never
+    take a write lock on it: it usually sits on NFS, where SQLite's locking
+    can't be relied on.
+    """
+
+    def __init__(self, path, read_only=False):
+        """
+        :param path: path to the index database, created if it doesn't exist
+                     and isn't opened read only
+        :param read_only: open the index for lookups only
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if read_only:
+            self._connection = _connect_read_only(path)
+        else:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.executescript(_SCHEMA)
+            self._connection.commit()
+
+    @classmethod
+    def open_existing(cls, path):
+        """
+        Opens an index read only for lookups, returns None if there isn't one
+        at the given path, rather than creating an empty one.
+
+        :param path: path to the index database
+        """
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            index = cls(path, read_only=True)
+            # the tables only exist once the crawler or lut_bake.py wrote the index
+            index._connection.execute("SELECT 1 FROM luts, baked LIMIT 1").fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Unable to open LUT index %s: %s", path, e)
+            return None
+        return index
+
+    def lookup(self, color_dir):
+        """
+        Returns the IndexEntry for a color directory, or None.
+
+        :param color_dir: shot color directory
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM luts WHERE color_dir = ?", (color_dir,)
+            ).fetchone()
+        if row is None:
+            return None
+        return IndexEntry(*row)
+
+    def entries(self):
+        """
+        Returns every entry in the index, keyed by color directory.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT * FROM luts").fetchall()
+        return dict((row[0], IndexEntry(*row)) for row in rows)
+
+    def update(self, entries):
+        """
+        Adds or replaces the given entries in a single transaction.
+
+        :param entries: iterable of IndexEntry
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO luts VALUES (?, ?, ?, ?, ?, ?, ?)", list(entries)
+                )
+
+    def remove(self, color_dirs):
+        """
+        Removes the entries for the given color directories.
+
+        :param color_dirs: iterable of shot color directories
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "DELETE FROM luts WHERE color_dir = ?", [(color_dir,) for color_dir in color_dirs]
+                )
+
+    def lookup_baked(self, lut_path):
+        """
+        Returns the BakedEntry of a look LUT, or None if it wasn't baked.
+
+        :param lut_path: path of the look LUT the bake was made from
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM baked WHERE lut_path = ?", (lut_path,)
+            ).fetchone()
+        if row is None:
+            return None
+        return BakedEntry(*row)
+
+    def update_baked(self, entries):
+        """
+        Adds or replaces the given baked entries in a single transaction.
+
+        :param entries: iterable of BakedEntry
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO baked VALUES (?, ?, ?, ?, ?, ?)", list(entries)
+                )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _connect_read_only(path):
+    """
+    Opens a database for reading only. Python 2's sqlite3 can't open URIs, so
+    the connection is made query only there, which doesn't write either.
+    """
+    if sys.version_info[0] >= 3:
+        uri = "file:%s?mode=ro" % quote(os.path.abspath(path))
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA query_only = 1")
+    return connection
+
+
+def _lut_format(lut_path):
+    if not lut_path:
+        return None
+    return os.path.splitext(lut_path)[-1].lower().lstrip(".")
+
+
+def _scan_color_dir(show_config, color_dir, sequence, shot):
+    """
+    Lists a single color directory and returns its IndexEntry, or None if it
+    went away in the meantime.
+    """
+    cache = DirectorySnapshotCache(show_config.choose_lut)
+    snapshot = cache.get(color_dir)
+    if snapshot is None:
+        return None
+    lut_mtime = None
+    for entry in snapshot.entries:
+        if entry.path == snapshot.choice:
+            lut_mtime = entry.mtime
+            break
+    return IndexEntry(color_dir, sequence, shot, snapshot.mtime, snapshot.choice,
+                      lut_mtime, _lut_format(snapshot.choice))
+
+
+def _discover_color_dirs(show_config, show_root):
+    """
+    Returns (color_dir, sequence, shot) for every shot and sequence color
+    directory under a show root.
+    """
+    regexp = show_config.color_dir_regexp(show_root)
+    found = []
+    for color_dir in glob.glob(show_config.color_dir_glob(show_root)):
+        match = regexp.match(color_dir)
+        if match and os.path.isdir(color_dir):
+            found.append((color_dir, match.group("sequence"), match.group("shot")))
+    return found
+
+
+def crawl(show_config, index, roots=None, workers=8, full=False):
+    """
+    Crawls the show roots in parallel and brings the index up to date.
+    Returns a dict of counters describing what was done.
+
+    :param show_config: ShowConfig of the show to crawl
+    :param index: LutIndex to update
+    :param roots: show roots to crawl, defaults to production and in-house
+    :param workers: number of threads used to stat and list directories
+    :param full: rescan every directory, even when its mtime didn't change
+    """
+    roots = [root for root in (roots or show_config.roots()) if root]
+    # production and in-house may well be the same tree
+    roots = sorted(set(roots))
+    # only the crawler needs it, and the plugin imports this module at startup
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    try:
+        discovered = []
+        for found in pool.map(lambda root: _discover_color_dirs(show_config, root), roots):
+            discovered.extend(found)
+
+        known = index.entries()
+
+        def refresh(item):
+            color_dir, sequence, shot = item
+            entry = known.get(color_dir)
+            if entry is not None and not full:
+                try:
+                    dir_mtime = os.stat(color_dir).st_mtime
+                except OSError:
+                    return color_dir, None, False
+                if dir_mtime == entry.dir_mtime:
+                    return color_dir, entry, False
+            return color_dir, _scan_color_dir(show_config, color_dir, sequence, shot), True
+
+        results = pool.map(refresh, discovered)
+    finally:
+        pool.close()
+        pool.join()
+
+    updated = [entry for color_dir, entry, scanned in results if scanned and entry is not None]
+    seen = set(color_dir for color_dir, entry, scanned in results if entry is not None)
+    # forget directories that disappeared from the roots we just crawled
+    removed = [color_dir for color_dir in known
+               if color_dir not in seen and any(color_dir.startswith(root) for root in roots)]
+    index.update(updated)
+    index.remove(removed)
+    return {
+        "directories": len(discovered),
+        "rescanned": len([result for result in results if result[2]]),
+        "updated": len(updated),
+        "removed": len(removed),
+        "with_lut": len([entry for entry in updated if entry.lut_path]),
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Build or refresh the Romeo shot LUT index.")
+    parser.add_argument("--config", default=os.environ.get("IH_SHOW_CFG_PATH"),
+                        help="show config file, defaults to $IH_SHOW_CFG_PATH")
+    parser.add_argument("--show", default=os.environ.get("IH_SHOW_CODE", "romeo"),
+                        help="show code, defaults to $IH_SHOW_CODE")
+    parser.add_argument("--index", help="index database, defaults to lut_index_path from the show config")
+    parser.add_argument("--root", action="append", dest="roots",
+                        help="only crawl the given show root, can be repeated")
+    parser.add_argument("--workers", type=int, default=8, help="number of crawler threads")
+    parser.add_argument("--full", action="store_true", help="rescan every directory")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.config:
+        parser.error("no show config given and IH_SHOW_CFG_PATH is not defined")
+    show_config = ShowConfig(args.config, args.show)
+    index_path = args.index or show_config.option("lut_index_path", None)
+    if not index_path:
+        parser.error("no index path given and lut_index_path is not set in the show config")
+
+    start = time.time()
+    index = LutIndex(index_path)
+    try:
+        stats = crawl(show_config, index, args.roots, args.workers, args.full)
+    finally:
+        index.close()
+    logger.info("Crawled %(directories)d color directories, rescanned %(rescanned)d, "
+                "updated %(updated)d (%(with_lut)d with a LUT), removed %(removed)d.", stats)
+    logger.info("Index %s refreshed in %.2f seconds.", index_path, time.time() - start)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
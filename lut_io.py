@@ -0,0 +1,310 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Reading and writing of CSP and cube LUT files into NumPy arrays, along with
+a compact binary sidecar format that can be memory mapped instead of parsing
+the text files again.
+
+A sidecar (.lutb) is laid out as a fixed size little endian header followed
+by float32 arrays: the three prelut input/output pairs, then the cube. The
+header records the size and mtime of the text file it was made from, so a
+republished LUT never gets an outdated sidecar.
+
+This module is for the offline tools (lut_bake.py) and isn't packaged with
+the plugin. RV only loads LUTs into look nodes through readLUT, which parses
+the files itself, and writing the arrays into the lut properties instead
+would need NumPy in RV's Python. The plugin rather avoids parsing a LUT
+again by skipping readLUT for a node already holding it
+(lut_fingerprint.py).
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+
+import numpy
+
+
+SIDECAR_EXTENSION = ".lutb"
+SIDECAR_VERSION = 1
+
+_MAGIC = b"RLUTBIN\0"
+# magic, version, source mtime, source size, cube size, prelut sizes
+_HEADER = struct.Struct("<8sIdQIIII")
+# arrays start on a 64 byte boundary so they can be mapped without copying
+_DATA_OFFSET = 64
+
+
+class Lut3D(object):
+    """
+    A 3D LUT with an optional per channel 1D prelut, as found in CSP files.
+    Cube files are loaded with an identity prelut spanning their domain.
+    """
+
+    def __init__(self, cube, prelut=None):
+        """
+        :param cube: array of shape (N, N, N, 3), indexed [blue, green, red]
+        :param prelut: list of three (inputs, outputs) array pairs, or None
+        """
+        self.cube = cube
+        self.prelut = prelut
+
+    @property
+    def size(self):
+        return self.cube.shape[0]
+
+    def apply(self, rgb):
+        """
+        Runs an (M, 3) array of colors through the LUT.
+
+        :param rgb: array of shape (M, 3)
+        """
+        rgb = numpy.asarray(rgb, dtype=numpy.float64)
+        if self.prelut is not None:
+            rgb = numpy.stack([numpy.interp(rgb[:, c], self.prelut[c][0], self.prelut[c][1])
+                               for c in range(3)], axis=-1)
+        return trilinear(self.cube, rgb)
+
+
+def trilinear(cube, rgb):
+    """
+    Trilinear interpolation of an (M, 3) array of colors in [0, 1] through a
+    cube indexed [blue, green, red].
+    """
+    n = cube.shape[0]
+    x = numpy.clip(rgb, 0.0, 1.0) * (n - 1)
+    i0 = numpy.minimum(numpy.floor(x).astype(numpy.intp), n - 2)
+    f = x - i0
+    r0, g0, b0 = i0[:, 0], i0[:, 1], i0[:, 2]
+    r1, g1, b1 = r0 + 1, g0 + 1, b0 + 1
+    fr, fg, fb = f[:, 0:1], f[:, 1:2], f[:, 2:3]
+    c00 = cube[b0, g0, r0] * (1 - fr) + cube[b0, g0, r1] * fr
+    c01 = cube[b1, g0, r0] * (1 - fr) + cube[b1, g0, r1] * fr
+    c10 = cube[b0, g1, r0] * (1 - fr) + cube[b0, g1, r1] * fr
+    c11 = cube[b1, g1, r0] * (1 - fr) + cube[b1, g1, r1] * fr
+    c0 = c00 * (1 - fg) + c10 * fg
+    c1 = c01 * (1 - fg) + c11 * fg
+    return c0 * (1 - fb) + c1 * fb
+
+
+def _floats(text):
+    # converting the whole token list in one go is a lot faster than going
+    # line by line through float()
+    return numpy.array(text.split(), dtype=numpy.float32)
+
+
+def read_csp(path):
+    """
+    Reads a 3D CSP file (1D prelut plus 3D cube).
+
+    :param path: path to the .csp file
+    """
+    with open(path, "r") as handle:
+        text = handle.read()
+    lines = text.split("\n", 2)
+    if len(lines) < 3 or lines[0].strip() != "CSPLUTV100":
+        raise ValueError("%s is not a CSP file" % path)
+    if lines[1].strip() != "3D":
+        raise ValueError("%s is not a 3D CSP file" % path)
+    body = lines[2]
+    if "BEGIN_METADATA" in body:
+        start = body.index("BEGIN_METADATA")
+        end = body.index("END_METADATA", start) + len("END_METADATA")
+        body = body[:start] + body[end:]
+
+    # the preluts are the first nine non empty lines, everything after the
+    # cube size line is cube data
+    rest = body
+    header = []
+    while len(header) < 10:
+        line, rest = rest.split("\n", 1) if "\n" in rest else (rest, "")
+        if line.strip():
+            header.append(line)
+        elif not rest:
+            raise ValueError("%s is truncated" % path)
+    prelut = []
+    for channel in range(3):
+        count = int(header[channel * 3])
+        inputs = _floats(header[channel * 3 + 1])
+        outputs = _floats(header[channel * 3 + 2])
+        if len(inputs) != count or len(outputs) != count:
+            raise ValueError("%s has a malformed prelut" % path)
+        prelut.append((inputs, outputs))
+    size = [int(value) for value in header[9].split()]
+    if size[0] != size[1] or size[0] != size[2]:
+        raise ValueError("%s has a non uniform cube" % path)
+    n = size[0]
+    data = _floats(rest)
+    if len(data) < n ** 3 * 3:
+        raise ValueError("%s has a truncated cube" % path)
+    return Lut3D(data[:n ** 3 * 3].reshape(n, n, n, 3), prelut)
+
+
+def read_cube(path):
+    """
+    Reads a 3D .cube file.
+
+    :param path: path to the .cube file
+    """
+    n = None
+    domain_min = [0.0, 0.0, 0.0]
+    domain_max = [1.0, 1.0, 1.0]
+    with open(path, "r") as handle:
+        lines = handle.read().splitlines()
+    data_lines = []
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped[0] == "#":
+            continue
+        if not stripped[0].isalpha():
+            data_lines.append(stripped)
+            continue
+        keyword = stripped.split()[0]
+        if keyword == "LUT_3D_SIZE":
+            n = int(stripped.split()[1])
+        elif keyword == "LUT_1D_SIZE":
+            raise ValueError("%s is a 1D cube file" % path)
+        elif keyword == "DOMAIN_MIN":
+            domain_min = [float(value) for value in stripped.split()[1:4]]
+        elif keyword == "DOMAIN_MAX":
+            domain_max = [float(value) for value in stripped.split()[1:4]]
+    data = _floats(" ".join(data_lines))
+    if n is None or len(data) != n ** 3 * 3:
+        raise ValueError("%s has a malformed cube" % path)
+    prelut = [(numpy.array([domain_min[c], domain_max[c]], dtype=numpy.float32),
+               numpy.array([0.0, 1.0], dtype=numpy.float32)) for c in range(3)]
+    return Lut3D(data.reshape(n, n, n, 3), prelut)
+
+
+def read_lut(path):
+    """
+    Reads a CSP or cube file, depending on its extension.
+
+    :param path: path to the LUT file
+    """
+    if os.path.splitext(path)[-1].lower() == ".cube":
+        return read_cube(path)
+    return read_csp(path)
+
+
+def write_csp(path, lut, metadata=None):
+    """
+    Writes a Lut3D out as a 3D CSP file.
+
+    :param path: path to the .csp file
+    :param lut: Lut3D with a prelut
+    :param metadata: optional list of lines for the metadata block
+    """
+    n = lut.size
+    with open(path, "w") as handle:
+        handle.write("CSPLUTV100\n3D\n\n")
+        if metadata:
+            handle.write("BEGIN_METADATA\n%s\nEND_METADATA\n\n" % "\n".join(metadata))
+        for inputs, outputs in lut.prelut:
+            handle.write("%d\n" % len(inputs))
+            handle.write(" ".join("%.8g" % value for value in inputs) + "\n")
+            handle.write(" ".join("%.8g" % value for value in outputs) + "\n")
+        handle.write("\n%d %d %d\n" % (n, n, n))
+        numpy.savetxt(handle, lut.cube.reshape(-1, 3), fmt="%.6f")
+
+
+def write_sidecar(path, lut, source_mtime, source_size):
+    """
+    Writes a Lut3D to a binary sidecar, atomically.
+
+    :param path: path to the sidecar
+    :param lut: Lut3D with a prelut
+    :param source_mtime: mtime of the text file the LUT was read from
+    :param source_size: size of the text file the LUT was read from
+    """
+    prelut_sizes = [len(inputs) for inputs, outputs in lut.prelut]
+    header = _HEADER.pack(_MAGIC, SIDECAR_VERSION, source_mtime, source_size, lut.size, *prelut_sizes)
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as sidecar:
+            sidecar.write(header.ljust(_DATA_OFFSET, b"\0"))
+            for inputs, outputs in lut.prelut:
+                sidecar.write(numpy.ascontiguousarray(inputs, dtype="<f4").tobytes())
+                sidecar.write(numpy.ascontiguousarray(outputs, dtype="<f4").tobytes())
+            sidecar.write(numpy.ascontiguousarray(lut.cube, dtype="<f4").tobytes())
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_sidecar(path, source_mtime=None, source_size=None):
+    """
+    Maps a binary sidecar into memory. Returns None if it's missing, of
+    another version, or was made from a different version of the text file.
+
+    :param path: path to the sidecar
+    :param source_mtime: expected mtime of the text file, None to skip the check
+    :param source_size: expected size of the text file, None to skip the check
+    """
+    try:
+        with open(path, "rb") as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    if len(mapped) < _DATA_OFFSET:
+        return None
+    magic, version, mtime, size, n, r_size, g_size, b_size = _HEADER.unpack_from(mapped, 0)
+    if magic != _MAGIC or version != SIDECAR_VERSION:
+        return None
+    if (source_mtime is not None and mtime != source_mtime) or (source_size is not None and size != source_size):
+        return None
+    offset = _DATA_OFFSET
+    prelut = []
+    for count in (r_size, g_size, b_size):
+        inputs = numpy.frombuffer(mapped, dtype="<f4", count=count, offset=offset)
+        offset += count * 4
+        outputs = numpy.frombuffer(mapped, dtype="<f4", count=count, offset=offset)
+        offset += count * 4
+        prelut.append((inputs, outputs))
+    cube = numpy.frombuffer(mapped, dtype="<f4", count=n ** 3 * 3, offset=offset)
+    return Lut3D(cube.reshape(n, n, n, 3), prelut)
+
+
+def sidecar_path(cache_dir, source_path):
+    """
+    Returns where the sidecar of a LUT file goes in a cache directory.
+
+    :param cache_dir: directory holding the sidecars
+    :param source_path: path of the text LUT file
+    """
+    digest = hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest + SIDECAR_EXTENSION)
+
+
+def load_lut(source_path, cache_dir=None):
+    """
+    Loads a CSP or cube file, going through its binary sidecar in cache_dir
+    when there is an up to date one, and writing one when there isn't.
+
+    :param source_path: path of the text LUT file
+    :param cache_dir: directory holding the sidecars, None to always parse
+    """
+    if cache_dir is None:
+        return read_lut(source_path)
+    st = os.stat(source_path)
+    cached_path = sidecar_path(cache_dir, source_path)
+    lut = read_sidecar(cached_path, st.st_mtime, st.st_size)
+    if lut is not None:
+        return lut
+    lut = read_lut(source_path)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    write_sidecar(cached_path, lut, st.st_mtime, st.st_size)
+    return lut
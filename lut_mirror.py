@@ -0,0 +1,328 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import json
+import hashlib
+import logging
+import time
+import tempfile
+import threading
+import collections
+
+from preferences import FileLock
+from lut_fingerprint import format_fingerprint
+
+
+logger = logging.getLogger("romeo.lut_mirror")
+
+_MANIFEST_NAME = "manifest.json"
+_CHUNK_SIZE = 1024 * 1024
+
+
+class LutMirror(object):
+    """
+    Local on-disk copy of the look LUT files living on the filer, so that
+    session reloads read them from the workstation disk instead of NFS.
+
+    Copies are content-addressed (named after the sha1 of their contents), so
+    LUTs published under several paths with the same contents are only stored
+    once. Each source path is revalidated against its size and mtime, and the
+    least recently used copies are evicted once the byte budget is exceeded.
+
+    The mirror is shared by every RV process of the user. A missing LUT is
+    copied to a temporary file without any lock held, then the manifest is
+    read, merged and written back, the copy renamed into place and copies
+    evicted under a file lock. Copies any process used in the last
+    in_use_seconds aren't evicted, since it may be about to read them.
+
+    A miss reads the whole LUT off the filer, so RV calls local_path on the
+    resolver pool when there is one.
+    """
+
+    # seconds a copy is kept after its last use, whatever the budget
+    in_use_seconds = 60
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        :param cache_dir: local directory the copies are stored in
+        :param max_bytes: byte budget for the stored copies
+        """
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._manifest_path = os.path.join(cache_dir, _MANIFEST_NAME)
+        self._lock_path = self._manifest_path + ".lock"
+        self._lock = threading.Lock()
+        # source path -> dict(size, mtime, digest, ext, used), least recently used first
+        self._entries = collections.OrderedDict()
+        # copy path -> number of entries referring to it
+        self._blob_refs = {}
+        # bytes of the distinct copies
+        self._bytes = 0
+        # stamp of the manifest as we last wrote or merged it, so it is only read
+        # again once another RV process wrote it
+        self._manifest_stamp = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._set_entries(self._read_manifest())
+
+    def local_path(self, source_path):
+        """
+        Returns the path of an up to date local copy of the given LUT file,
+        copying it over first if needed. Returns the source path itself if
+        the copy can't be made, and None if the source doesn't exist.
+
+        :param source_path: path of the LUT file on the filer
+        """
+        try:
+            st = os.stat(source_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(source_path)
+            if entry is not None and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                blob_path = self._blob_path(entry)
+                if self._touch(blob_path):
+                    self.hits += 1
+                    entry["used"] = time.time()
+                    # move to the most recently used end
+                    del self._entries[source_path]
+                    self._entries[source_path] = entry
+                    return blob_path
+
+            self.misses += 1
+        # the LUT is read off the filer without holding either lock, so that neither the
+        # other threads nor the other RV processes wait on a slow filer
+        try:
+            entry, tmp_path = self._copy(source_path, st)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to mirror LUT %s locally: %s", source_path, e)
+            return source_path
+        try:
+            with self._lock:
+                with FileLock(self._lock_path):
+                    # other RV processes may have mirrored or evicted LUTs since we last read the manifest
+                    self._merge_manifest()
+                    os.rename(tmp_path, self._blob_path(entry))
+                    entry["used"] = time.time()
+                    self._add(source_path, entry)
+                    self._evict()
+                    self._write_manifest()
+        except (IOError, OSError) as e:
+            logger.warning("Unable to mirror LUT %s locally: %s", source_path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return source_path
+        return self._blob_path(entry)
+
+    def fingerprint(self, local_path):
+        """
+        Returns the fingerprint of a copy returned by local_path, taken from
+        the sha1 it is named after, in the format of lut_fingerprint. None if
+        local_path isn't one of the copies.
+
+        :param local_path: path returned by local_path
+        """
+        if os.path.dirname(local_path) != os.path.normpath(self._cache_dir):
+            return None
+        try:
+            size = os.path.getsize(local_path)
+        except OSError:
+            return None
+        return format_fingerprint(os.path.splitext(os.path.basename(local_path))[0], size)
+
+    def stats(self):
+        """
+        Returns the hit, miss and eviction counters along with the current
+        size of the mirror.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+            }
+
+    def _blob_path(self, entry):
+        return os.path.join(self._cache_dir, entry["digest"] + entry["ext"])
+
+    def _copy(self, source_path, st):
+        """
+        Copies the source file to a temporary file of the mirror, hashing it
+        on the way so that it's only read once. Returns the entry of the copy
+        along with the temporary file, to be renamed to the copy's path under
+        the file lock.
+        """
+        digest = hashlib.sha1()
+        handle, tmp_path = tempfile.mkstemp(dir=self._cache_dir, prefix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as tmp_handle:
+                with open(source_path, "rb") as source_handle:
+                    while True:
+                        chunk = source_handle.read(_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        digest.update(chunk)
+                        tmp_handle.write(chunk)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        entry = {
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "digest": digest.hexdigest(),
+            # readLUT picks the LUT format from the extension, so keep it
+            "ext": os.path.splitext(source_path)[-1].lower(),
+        }
+        return entry, tmp_path
+
+    def _touch(self, blob_path):
+        """
+        Marks a copy as used, for the other RV processes not to evict it.
+        Returns False if it no longer exists.
+        """
+        try:
+            os.utime(blob_path, None)
+        except OSError:
+            return False
+        return True
+
+    def _add(self, source_path, entry):
+        """
+        Records the entry of a source path as its most recently used one.
+        """
+        old_entry = self._entries.pop(source_path, None)
+        stale_path = self._release(old_entry) if old_entry is not None else None
+        self._entries[source_path] = entry
+        blob_path = self._blob_path(entry)
+        refs = self._blob_refs.get(blob_path, 0)
+        if refs == 0:
+            self._bytes += entry["size"]
+        self._blob_refs[blob_path] = refs + 1
+        # the copy of what the source path used to hold
+        if stale_path is not None and stale_path != blob_path and not self._in_use(stale_path):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+
+    def _release(self, entry):
+        """
+        Drops a reference to the copy of an entry, returning the path of the
+        copy if no entry refers to it any longer, None otherwise.
+        """
+        blob_path = self._blob_path(entry)
+        refs = self._blob_refs.pop(blob_path, 0) - 1
+        if refs > 0:
+            self._blob_refs[blob_path] = refs
+            return None
+        self._bytes -= entry["size"]
+        return blob_path
+
+    def _set_entries(self, entries):
+        self._entries = collections.OrderedDict()
+        self._blob_refs = {}
+        self._bytes = 0
+        for source_path, entry in entries:
+            self._add(source_path, entry)
+
+    def _in_use(self, blob_path):
+        try:
+            return time.time() - os.stat(blob_path).st_mtime < self.in_use_seconds
+        except OSError:
+            return False
+
+    def _evict(self):
+        """
+        Drops least recently used entries until the mirror fits its budget.
+        A copy is only deleted once no remaining entry refers to it, and
+        isn't while it's in use. Must be called under the file lock.
+        """
+        for source_path, entry in list(self._entries.items())[:-1]:
+            if self._bytes <= self._max_bytes:
+                break
+            blob_path = self._blob_path(entry)
+            if self._blob_refs.get(blob_path) == 1 and self._in_use(blob_path):
+                continue
+            del self._entries[source_path]
+            if self._release(entry) is None:
+                continue
+            try:
+                os.remove(blob_path)
+            except OSError:
+                pass
+            self.evictions += 1
+            logger.debug("Evicted local copy of %s.", source_path)
+
+    def _read_manifest(self):
+        """
+        Returns the (source path, entry) items of the manifest, least recently
+        used first.
+        """
+        if not os.path.exists(self._manifest_path):
+            return []
+        try:
+            with open(self._manifest_path, "r") as manifest_handle:
+                return json.load(manifest_handle)
+        except (IOError, ValueError) as e:
+            logger.warning("Ignoring unreadable LUT mirror manifest %s: %s", self._manifest_path, e)
+            return []
+
+    def _merge_manifest(self):
+        """
+        Merges the manifest written by the other RV processes into ours, the
+        most recent use of each source path winning. Must be called under the
+        file lock.
+        """
+        stamp = _file_stamp(self._manifest_path)
+        if stamp is not None and stamp == self._manifest_stamp:
+            return
+        merged = dict(self._read_manifest())
+        for source_path, entry in self._entries.items():
+            other = merged.get(source_path)
+            if other is None:
+                # evicted by another process, unless its copy is still around
+                if os.path.exists(self._blob_path(entry)):
+                    merged[source_path] = entry
+            elif entry.get("used", 0) > other.get("used", 0):
+                merged[source_path] = entry
+        self._set_entries(sorted(merged.items(), key=lambda item: item[1].get("used", 0)))
+        self._manifest_stamp = stamp
+
+    def _write_manifest(self):
+        # write to a temporary file and rename it over the old manifest, so
+        # that other RV processes never read a partial one
+        handle, tmp_path = tempfile.mkstemp(dir=self._cache_dir, prefix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as manifest_handle:
+                # dumps, unlike dump, goes through the C encoder
+                manifest_handle.write(json.dumps(list(self._entries.items())))
+            os.rename(tmp_path, self._manifest_path)
+            self._manifest_stamp = _file_stamp(self._manifest_path)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to write LUT mirror manifest %s: %s", self._manifest_path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ctime, st.st_ino)
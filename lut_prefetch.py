@@ -0,0 +1,196 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import bisect
+
+
+# what the prefetcher knows about a source waiting for its LUT
+_PENDING = 0
+_IN_FLIGHT = 1
+_STAGED = 2
+
+
+class LutPrefetcher(object):
+    """
+    Works out which sources the playhead is about to reach, so their look
+    LUTs can be resolved and read before it gets there.
+
+    The timeline is a list of (first frame, last frame, key) entries, the
+    keys being whatever identifies a source to the caller. Keys handed to
+    add() are pending until the caller stages them. Every time the frame
+    changes, next_batch() returns the pending keys coming up within the
+    lookahead, at most concurrency of them being in flight at once, and
+    arrive() reports the ones the playhead reached before they were staged.
+    A source reached after being staged counts as a hit, one reached while
+    still pending or in flight as a miss.
+    """
+
+    def __init__(self, lookahead_seconds=10.0, concurrency=2):
+        """
+        :param lookahead_seconds: how far ahead of the playhead sources are staged
+        :param concurrency: number of sources being staged at most at once
+        """
+        self.lookahead_seconds = lookahead_seconds
+        self.concurrency = concurrency
+        self._entries = []
+        self._starts = []
+        # running maximum of the last frames, to find the first entry still
+        # visible at a frame with a bisect even if entries overlap
+        self._max_ends = []
+        # key -> _PENDING, _IN_FLIGHT or _STAGED
+        self._states = {}
+        # number of keys in each state
+        self._counts = [0, 0, 0]
+        # keys visible at the last frame, and the frames that set is valid for
+        self._visible = frozenset()
+        self._visible_range = (1, 0)
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def set_timeline(self, entries):
+        """
+        :param entries: iterable of (first frame, last frame, key) tuples
+        """
+        self._entries = sorted(entries, key=lambda entry: entry[0])
+        self._starts = [entry[0] for entry in self._entries]
+        self._max_ends = []
+        max_end = None
+        for entry in self._entries:
+            max_end = entry[1] if max_end is None else max(max_end, entry[1])
+            self._max_ends.append(max_end)
+        # keep the visible set, the sources still visible haven't just arrived
+        self._visible_range = (1, 0)
+
+    def _set_state(self, key, state):
+        previous = self._states.pop(key, None)
+        if previous is not None:
+            self._counts[previous] -= 1
+        if state is not None:
+            self._states[key] = state
+            self._counts[state] += 1
+
+    def add(self, key):
+        """
+        Marks a source as waiting for its LUT.
+        """
+        self._set_state(key, _PENDING)
+
+    def discard(self, key):
+        """
+        Forgets a source, eg. one being deleted or set up without a LUT.
+        """
+        self._set_state(key, None)
+
+    def staged(self, key):
+        """
+        Marks a source's LUT as resolved and read.
+        """
+        if key in self._states:
+            self._set_state(key, _STAGED)
+
+    def is_pending(self, key):
+        return self._states.get(key) in (_PENDING, _IN_FLIGHT)
+
+    def clear(self):
+        self.set_timeline([])
+        self._states.clear()
+        self._counts = [0, 0, 0]
+
+    def _scan(self, first, last):
+        """
+        Yields the entries overlapping [first, last], in timeline order.
+        """
+        index = bisect.bisect_left(self._max_ends, first)
+        while index < len(self._entries) and self._entries[index][0] <= last:
+            if self._entries[index][1] >= first:
+                yield self._entries[index]
+            index += 1
+
+    def arrive(self, frame, count_misses=True):
+        """
+        Records the sources the playhead reached at a frame, and returns the
+        keys of the ones still waiting for their LUT, which should be staged
+        right away.
+
+        :param frame: current frame
+        :param count_misses: False when the sources didn't get a chance to be
+                             staged, eg. the ones loaded under the playhead
+        """
+        if self._visible_range[0] <= frame <= self._visible_range[1]:
+            return []
+        entries = list(self._scan(frame, frame))
+        visible = frozenset(entry[2] for entry in entries)
+        # the visible set can't change before the next entry starts or a visible one ends
+        next_start = bisect.bisect_right(self._starts, frame)
+        until = self._starts[next_start] - 1 if next_start < len(self._starts) else None
+        for start, end, key in entries:
+            until = end if until is None else min(until, end)
+        self._visible_range = (frame, until if until is not None else frame)
+        arrivals = visible - self._visible
+        self._visible = visible
+        missed = []
+        for key in arrivals:
+            state = self._states.get(key)
+            if state is None:
+                continue
+            if state == _STAGED:
+                self.hits += 1
+                self._set_state(key, None)
+            else:
+                if count_misses:
+                    self.misses += 1
+                missed.append(key)
+        return missed
+
+    def next_batch(self, frame, fps):
+        """
+        Returns the pending keys within the lookahead of a frame that should
+        be staged now, and marks them in flight.
+
+        :param frame: current frame
+        :param fps: playback rate, to turn the lookahead into frames
+        """
+        available = self.concurrency - self._counts[_IN_FLIGHT]
+        if available <= 0 or not self._counts[_PENDING]:
+            return []
+        last = frame + int(self.lookahead_seconds * (fps or 24.0))
+        batch = []
+        for start, end, key in self._scan(frame, last):
+            if self._states.get(key) == _PENDING:
+                self._set_state(key, _IN_FLIGHT)
+                self.prefetched += 1
+                batch.append(key)
+                if len(batch) >= available:
+                    break
+        return batch
+
+    def start(self, key):
+        """
+        Marks a pending key in flight outside of next_batch, eg. a miss
+        being staged right away.
+        """
+        if self._states.get(key) == _PENDING:
+            self._set_state(key, _IN_FLIGHT)
+
+    def __len__(self):
+        return len(self._states)
+
+    def stats(self):
+        """
+        Returns the hit, miss and prefetch counters, and the number of
+        sources still waiting for their LUT.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefetched": self.prefetched,
+            "pending": self._counts[_PENDING] + self._counts[_IN_FLIGHT],
+        }
@@ -0,0 +1,308 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Warms the caches of the source setup for a playlist ahead of a review, so RV
+doesn't have to go to the filer for the shot LUTs when the session is opened.
+
+    python lut_prewarm.py --config /path/to/show.cfg --show romeo review.rv
+    python lut_prewarm.py cut_v012.edl --report prewarm.json
+    python lut_prewarm.py media_list.txt --workers 16 --strict
+
+Playlists are RV sessions saved as text (.rv), CMX 3600 EDLs (.edl) using
+SOURCE FILE or FROM CLIP NAME comments, or plain lists with one media path
+per line. The LUT of every clip is picked exactly like the plugin does, the
+shot color directories being listed on a pool of processes. The results go
+into the LUT index (lut_index_path) and the local LUT mirror and show profile
+cache of the RV support directory, and the clips without a LUT or with more
+than one candidate LUT are reported.
+
+Run it as the user RV runs as, with the same TWK_APP_SUPPORT_PATH, or point
+--support-dir at the plugin's support directory.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+
+from show_config import ShowConfig
+from dir_snapshot import DirectorySnapshotCache
+from lut_index import LutIndex, IndexEntry
+from lut_mirror import LutMirror
+from preferences import app_support_dir
+
+
+logger = logging.getLogger("romeo.lut_prewarm")
+
+# media paths of the sources of a text .rv session, a single string or a list of them
+_RV_MOVIE = re.compile(r'\bstring\s+movie\s*=\s*(\[[^\]]*\]|"(?:[^"\\]|\\.)*")')
+_RV_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_EDL_EVENT = re.compile(r'^\d+\s')
+_EDL_COMMENT = re.compile(r'^\*\s*(SOURCE FILE|FROM CLIP NAME)\s*:\s*(.+?)\s*$', re.IGNORECASE)
+
+# show config of the worker processes, set by _init_worker
+_worker_config = None
+
+
+def read_rv_session(path):
+    """
+    Returns the media paths of the sources of an RV session saved as text.
+
+    :param path: .rv session file
+    """
+    with open(path, "rb") as handle:
+        data = handle.read()
+    if b"\0" in data[:1024]:
+        raise ValueError("%s is a binary session, save it as text from RV first" % path)
+    text = data.decode("utf-8", "replace")
+    media = []
+    for match in _RV_MOVIE.finditer(text):
+        for value in _RV_STRING.findall(match.group(1)):
+            media.append(value.replace('\\"', '"').replace("\\\\", "\\"))
+    return media
+
+
+def read_edl(path):
+    """
+    Returns the media of the events of a CMX 3600 EDL, from their SOURCE FILE
+    comment, or their FROM CLIP NAME comment when they don't have one.
+
+    :param path: .edl file
+    """
+    media = []
+    event = {}
+
+    def flush():
+        name = event.get("source file") or event.get("from clip name")
+        if name:
+            media.append(name)
+        event.clear()
+
+    with open(path, "r") as handle:
+        for line in handle:
+            line = line.strip()
+            if _EDL_EVENT.match(line):
+                flush()
+                continue
+            match = _EDL_COMMENT.match(line)
+            if match:
+                event.setdefault(match.group(1).lower(), match.group(2))
+    flush()
+    return media
+
+
+def read_media_list(path):
+    """
+    Returns the media paths of a plain list, one per line, skipping blank
+    lines and # comments.
+
+    :param path: text file
+    """
+    media = []
+    with open(path, "r") as handle:
+        for line in handle:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                media.append(line)
+    return media
+
+
+def read_playlist(path):
+    """
+    Returns the media of a playlist, read according to its extension.
+
+    :param path: .rv session, .edl or plain list
+    """
+    ext = os.path.splitext(path)[-1].lower()
+    if ext == ".rv":
+        return read_rv_session(path)
+    if ext == ".edl":
+        return read_edl(path)
+    return read_media_list(path)
+
+
+def _init_worker(cfg_path, show_code):
+    global _worker_config
+    _worker_config = ShowConfig(cfg_path, show_code)
+
+
+def _resolve_color_dir(color_dir):
+    """
+    Picks the LUT of a shot color directory like the plugin does, in a worker
+    process. Returns (color_dir, dir_mtime, lut_path, lut_mtime, candidates),
+    dir_mtime being None if the directory doesn't exist, and candidates the
+    LUT files the choice was made between on modification time alone.
+    """
+    snapshot = DirectorySnapshotCache(_worker_config.choose_lut).get(color_dir)
+    if snapshot is None:
+        return color_dir, None, None, None, []
+    choice = snapshot.choice
+    if not choice:
+        return color_dir, snapshot.mtime, None, None, []
+    ext = os.path.splitext(choice)[-1].lower()
+    candidates = [entry for entry in snapshot.entries if os.path.splitext(entry.name)[-1].lower() == ext]
+    if ext == ".cube" and _worker_config.mainplate_regexp.search(choice):
+        # a mainplate cube wins over the other cubes
+        candidates = [entry for entry in candidates if _worker_config.mainplate_regexp.search(entry.path)]
+    lut_mtime = None
+    for entry in snapshot.entries:
+        if entry.path == choice:
+            lut_mtime = entry.mtime
+    return color_dir, snapshot.mtime, choice, lut_mtime, sorted(entry.path for entry in candidates)
+
+
+def prewarm(show_config, media, workers=8, index=None, mirror=None, use_baked=True):
+    """
+    Resolves the LUT of every clip and stores the results in the index and
+    the mirror. Returns a report dict: counters, and the clips without a LUT
+    or with an ambiguous one.
+
+    :param show_config: ShowConfig of the show
+    :param media: list of media paths
+    :param workers: number of processes listing the color directories
+    :param index: LutIndex to record the color directories in, or None
+    :param mirror: LutMirror to copy the LUTs into, or None
+    :param use_baked: mirror the up to date baked LUT of a look LUT instead, like the plugin
+    """
+    # every frame of a sequence and every clip of a shot resolve to the same directory
+    color_dirs = {}
+    unmatched = []
+    for file_name, entity in zip(media, show_config.classify_many(media)):
+        if entity is None:
+            unmatched.append(file_name)
+            continue
+        kind, sequence, shot, entity_dir = entity
+        color_dir = show_config.color_dir_for(entity_dir)
+        color_dirs.setdefault(color_dir, (sequence, shot, []))[2].append(file_name)
+
+    pool = multiprocessing.Pool(max(workers, 1), _init_worker, (show_config.cfg_path, show_config.show_code))
+    try:
+        results = pool.map(_resolve_color_dir, sorted(color_dirs), chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
+
+    entries = []
+    missing = []
+    ambiguous = []
+    mirrored = 0
+    for color_dir, dir_mtime, lut_path, lut_mtime, candidates in results:
+        sequence, shot, clips = color_dirs[color_dir]
+        if dir_mtime is None:
+            missing.extend({"clip": clip, "color_dir": color_dir, "reason": "no color directory"}
+                           for clip in clips)
+            continue
+        lut_format = os.path.splitext(lut_path)[-1].lower().lstrip(".") if lut_path else None
+        entries.append(IndexEntry(color_dir, sequence, shot, dir_mtime, lut_path, lut_mtime, lut_format))
+        if not lut_path:
+            missing.extend({"clip": clip, "color_dir": color_dir, "reason": "no LUT"} for clip in clips)
+            continue
+        if len(candidates) > 1:
+            ambiguous.extend({"clip": clip, "color_dir": color_dir, "lut": lut_path, "candidates": candidates}
+                             for clip in clips)
+        if mirror is not None:
+            read_path = lut_path
+            if use_baked and index is not None:
+                baked = index.lookup_baked(lut_path)
+                if baked is not None and baked.lut_mtime == lut_mtime:
+                    read_path = baked.baked_path
+            if mirror.local_path(read_path):
+                mirrored += 1
+    if index is not None:
+        index.update(entries)
+
+    return {
+        "clips": len(media),
+        "color_dirs": len(color_dirs),
+        "with_lut": len([entry for entry in entries if entry.lut_path]),
+        "mirrored": mirrored,
+        "unmatched": unmatched,
+        "missing": missing,
+        "ambiguous": ambiguous,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm the Romeo LUT caches for a review playlist.")
+    parser.add_argument("playlists", nargs="+", help=".rv session saved as text, .edl, or list of media paths")
+    parser.add_argument("--config", default=os.environ.get("IH_SHOW_CFG_PATH"),
+                        help="show config file, defaults to $IH_SHOW_CFG_PATH")
+    parser.add_argument("--show", default=os.environ.get("IH_SHOW_CODE", "romeo"),
+                        help="show code, defaults to $IH_SHOW_CODE")
+    parser.add_argument("--index", help="index database, defaults to lut_index_path from the show config")
+    parser.add_argument("--support-dir", help="support directory of the plugin, defaults to the one under "
+                                              "$TWK_APP_SUPPORT_PATH")
+    parser.add_argument("--workers", type=int, default=8, help="number of processes listing color directories")
+    parser.add_argument("--report", help="write the clips without a LUT or with an ambiguous one to this JSON file")
+    parser.add_argument("--strict", action="store_true", help="exit with 1 if a clip has no LUT or an ambiguous one")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.config:
+        parser.error("no show config given and IH_SHOW_CFG_PATH is not defined")
+    if not args.support_dir and not os.environ.get("TWK_APP_SUPPORT_PATH"):
+        parser.error("no support directory given and TWK_APP_SUPPORT_PATH is not defined")
+    support_dir = args.support_dir or app_support_dir("romeo")
+
+    media = []
+    seen = set()
+    for playlist in args.playlists:
+        try:
+            clips = read_playlist(playlist)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+        for clip in clips:
+            if clip not in seen:
+                seen.add(clip)
+                media.append(clip)
+
+    start = time.time()
+    # cache the profile where the plugin looks for it, so it doesn't parse the config either
+    show_config = ShowConfig.load(args.config, args.show, os.path.join(support_dir, "profiles"))
+    index_path = args.index or show_config.option("lut_index_path", None)
+    index = LutIndex(index_path) if index_path else None
+    if index is None:
+        logger.warning("lut_index_path is not set in the show config, RV will list the color directories again.")
+    mirror = None
+    mirror_max_bytes = show_config.option("lut_mirror_max_bytes", 256 * 1024 * 1024, int)
+    if mirror_max_bytes > 0:
+        mirror = LutMirror(os.path.join(support_dir, "lut_cache"), mirror_max_bytes)
+    try:
+        report = prewarm(show_config, media, args.workers, index, mirror,
+                         show_config.option("use_baked_luts", 1, int))
+    finally:
+        if index is not None:
+            index.close()
+
+    for clip in report["unmatched"]:
+        logger.warning("No shot or sequence for %s", clip)
+    for problem in report["missing"]:
+        logger.warning("No LUT for %s: %s in %s", problem["clip"], problem["reason"], problem["color_dir"])
+    for problem in report["ambiguous"]:
+        logger.warning("Ambiguous LUT for %s: picked %s out of %s", problem["clip"], problem["lut"],
+                       ", ".join(os.path.basename(path) for path in problem["candidates"]))
+    logger.info("Warmed %d clips in %d color directories in %.2f seconds: %d with a LUT, %d LUTs mirrored, "
+                "%d clips unmatched, %d without a LUT, %d ambiguous.",
+                report["clips"], report["color_dirs"], time.time() - start, report["with_lut"],
+                report["mirrored"], len(report["unmatched"]), len(report["missing"]), len(report["ambiguous"]))
+    if args.report:
+        with open(args.report, "w") as handle:
+            json.dump(report, handle, indent=2)
+    if args.strict and (report["unmatched"] or report["missing"] or report["ambiguous"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
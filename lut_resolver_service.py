@@ -0,0 +1,478 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Per workstation service resolving media paths to their shot look LUT, shared
+by every RV and rvio process of the machine over a Unix domain socket, so
+the filer is only asked once per shot color directory, not once per process.
+
+    python lut_resolver_service.py --socket /tmp/romeo_lut_resolver.sock
+
+The plugin uses it when the show sets lut_resolver_daemon to 1, and falls
+back to resolving LUTs itself when the service isn't running.
+
+The protocol is one JSON object per line each way. A request carries an op
+and an id echoed in the response:
+
+    {"id": 1, "op": "resolve", "config": "/path/to/show.cfg", "show": "romeo", "paths": [...]}
+    {"id": 1, "results": [["/shot/color/look.csp", null], ...]}
+
+Other ops are invalidate (with a color_dir), stats and ping. Failures are
+answered with an error member instead of the results.
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import logging
+import tempfile
+import threading
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+from bounded_cache import LruDict
+from show_config import ShowConfig
+from dir_snapshot import DirectorySnapshotCache
+from lut_index import LutIndex
+
+
+logger = logging.getLogger("romeo.lut_resolver_service")
+
+
+def default_socket_path():
+    """
+    Returns the socket of the service of the workstation, unless
+    $IH_ROMEO_RESOLVER_SOCKET says otherwise. It is in /tmp rather than the
+    temporary directory, which is one per user on macOS.
+    """
+    path = os.environ.get("IH_ROMEO_RESOLVER_SOCKET")
+    if path:
+        return path
+    tmp_dir = "/tmp" if os.path.isdir("/tmp") else tempfile.gettempdir()
+    return os.path.join(tmp_dir, "romeo_lut_resolver.sock")
+
+
+class ShotLutResolver(object):
+    """
+    Resolves media paths of a show to (look LUT, baked LUT) tuples like the
+    plugin's _retrieve_look_luts does, for any number of threads at once.
+
+    A color directory checked less than revalidate_interval seconds ago is
+    trusted without going back to the filer, and concurrent requests for
+    the same directory wait for a single check. At most max_entries color
+    and media directories are remembered.
+    """
+
+    # directories remembered at most, of each kind
+    max_entries = 20000
+    # number of locks the directory checks are spread over
+    lock_stripes = 64
+
+    def __init__(self, show_config, revalidate_interval=2.0):
+        """
+        :param show_config: ShowConfig of the show
+        :param revalidate_interval: seconds a checked directory is trusted for
+        """
+        self.show_config = show_config
+        self._revalidate_interval = revalidate_interval
+        self._index = LutIndex.open_existing(show_config.option('lut_index_path', None))
+        self._use_baked = show_config.option('use_baked_luts', 1, int)
+        self._snapshots = DirectorySnapshotCache(show_config.choose_lut, self._index)
+        # locks serializing the checks of a directory, picked by hashing its
+        # path so there's a fixed number of them however many directories come by
+        self._dir_locks = [threading.Lock() for i in range(self.lock_stripes)]
+        # color directory -> (time checked, look LUTs)
+        self._look_luts = LruDict(self.max_entries)
+        # media directory -> (time checked, whether it exists)
+        self._media_dirs = LruDict(self.max_entries)
+        self.checks = 0
+
+    def resolve_many(self, file_names):
+        """
+        Returns the (look LUT path, baked LUT path) tuple of each media path,
+        (None, None) for the ones without a LUT.
+
+        :param file_names: list of media paths
+        """
+        return [self.resolve(file_name) for file_name in file_names]
+
+    def resolve(self, file_name):
+        if file_name and not self._media_dir_exists(os.path.dirname(file_name)):
+            return None, None
+        entity = self.show_config.classify(file_name) if file_name else None
+        if entity is None:
+            return None, None
+        color_dir = self.show_config.color_dir_for(entity[3])
+        now = time.time()
+        cached = self._look_luts.get(color_dir)
+        if cached is not None and now - cached[0] < self._revalidate_interval:
+            return cached[1]
+        with self._dir_lock(color_dir):
+            # another thread may have checked it while we were waiting
+            cached = self._look_luts.get(color_dir)
+            if cached is not None and time.time() - cached[0] < self._revalidate_interval:
+                return cached[1]
+            checked = time.time()
+            self.checks += 1
+            snapshot = self._snapshots.get(color_dir)
+            look_path = snapshot.choice if snapshot is not None else None
+            look_luts = (look_path, self._baked_lut(look_path))
+            self._look_luts[color_dir] = (checked, look_luts)
+            return look_luts
+
+    def invalidate(self, color_dir=None):
+        """
+        Forgets what was resolved for a color directory, or for all of them.
+
+        :param color_dir: shot color directory, None for all of them
+        """
+        if color_dir is None:
+            self._look_luts.clear()
+            self._media_dirs.clear()
+        else:
+            self._look_luts.pop(color_dir, None)
+        self._snapshots.invalidate(color_dir)
+
+    def _media_dir_exists(self, media_dir):
+        cached = self._media_dirs.get(media_dir)
+        if cached is not None and time.time() - cached[0] < self._revalidate_interval:
+            return cached[1]
+        with self._dir_lock(media_dir):
+            cached = self._media_dirs.get(media_dir)
+            if cached is not None and time.time() - cached[0] < self._revalidate_interval:
+                return cached[1]
+            checked = time.time()
+            exists = os.path.exists(media_dir)
+            self._media_dirs[media_dir] = (checked, exists)
+            return exists
+
+    def _baked_lut(self, look_path):
+        if not look_path or self._index is None or not self._use_baked:
+            return None
+        baked = self._index.lookup_baked(look_path)
+        if baked is None:
+            return None
+        try:
+            look_mtime = os.stat(look_path).st_mtime
+        except OSError:
+            return None
+        if baked.lut_mtime != look_mtime:
+            return None
+        return baked.baked_path
+
+    def _dir_lock(self, path):
+        return self._dir_locks[hash(path) % len(self._dir_locks)]
+
+    def stats(self):
+        """
+        Returns the number of directories checked, and the number of color and
+        media directories cached.
+        """
+        return {
+            "checks": self.checks,
+            "color_dirs": len(self._look_luts),
+            "media_dirs": len(self._media_dirs),
+        }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Serves the requests of one client connection, one JSON line each.
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            request = None
+            try:
+                request = json.loads(line.decode("utf-8"))
+                response = self.server.service.handle(request)
+            except Exception as e:
+                logger.exception("Unable to handle request %r", line[:200])
+                response = {"error": str(e)}
+            if isinstance(request, dict):
+                response["id"] = request.get("id")
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class LutResolverService(object):
+    """
+    Serves ShotLutResolvers over a Unix domain socket, one per show config
+    and show code, each client connection on a thread of its own.
+    """
+
+    def __init__(self, socket_path, revalidate_interval=2.0):
+        """
+        :param socket_path: path of the Unix domain socket to listen on
+        :param revalidate_interval: seconds a checked directory is trusted for
+        """
+        self.socket_path = socket_path
+        self._revalidate_interval = revalidate_interval
+        self._lock = threading.Lock()
+        # (config path, show code) -> ShotLutResolver
+        self._resolvers = {}
+        # (config path, show code) -> (time checked, (mtime, size) of the config file)
+        self._config_stamps = {}
+        self.requests = 0
+        self.paths = 0
+        _remove_stale_socket(socket_path)
+        self._server = _Server(socket_path, _RequestHandler)
+        self._server.service = self
+        # the RV and rvio processes of every user of the workstation talk to it
+        os.chmod(socket_path, 0o666)
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def close(self):
+        self._server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def resolver(self, cfg_path, show_code):
+        """
+        Returns the resolver of a show. The config file is checked again once
+        every revalidate interval, and the resolver replaced if it changed.
+        """
+        key = (cfg_path, show_code)
+        now = time.time()
+        with self._lock:
+            resolver = self._resolvers.get(key)
+            checked = self._config_stamps.get(key, (0.0, None))[0]
+            if resolver is not None and now - checked < self._revalidate_interval:
+                return resolver
+        new_stamp = _file_stamp(cfg_path)
+        with self._lock:
+            # another request may have reloaded it in the meantime
+            resolver = self._resolvers.get(key)
+            stamp = self._config_stamps.get(key, (0.0, None))[1]
+            if resolver is None or new_stamp != stamp:
+                if resolver is not None:
+                    logger.info("%s changed, reloading the %s show config", cfg_path, show_code)
+                resolver = ShotLutResolver(ShowConfig(cfg_path, show_code), self._revalidate_interval)
+                self._resolvers[key] = resolver
+            self._config_stamps[key] = (now, new_stamp)
+            return resolver
+
+    def handle(self, request):
+        """
+        Returns the response to a request.
+        """
+        op = request.get("op")
+        with self._lock:
+            self.requests += 1
+        if op == "ping":
+            return {}
+        if op == "stats":
+            stats = {"requests": self.requests, "paths": self.paths, "checks": 0, "color_dirs": 0, "media_dirs": 0}
+            for resolver in list(self._resolvers.values()):
+                for name, value in resolver.stats().items():
+                    stats[name] += value
+            return stats
+        resolver = self.resolver(request["config"], request["show"])
+        if op == "resolve":
+            paths = request["paths"]
+            with self._lock:
+                self.paths += len(paths)
+            return {"results": resolver.resolve_many(paths)}
+        if op == "invalidate":
+            resolver.invalidate(request.get("color_dir"))
+            return {}
+        return {"error": "unknown op %r" % op}
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def _remove_stale_socket(socket_path):
+    """
+    Removes the socket left behind by a service that died, refusing to start
+    if one is still listening on it.
+    """
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except socket.error:
+        os.remove(socket_path)
+    else:
+        raise RuntimeError("A resolver service is already listening on %s" % socket_path)
+    finally:
+        probe.close()
+
+
+class ResolverUnavailable(IOError):
+    """
+    Raised by the client when the service can't be reached.
+    """
+
+
+class ResolverClient(object):
+    """
+    Client of the resolver service, keeping a connection open. Safe to use
+    from several threads, requests are serialized over the connection.
+
+    Once the service failed to answer, the client doesn't try again for
+    retry_interval seconds, so callers falling back to resolving LUTs
+    themselves don't pay for a connection attempt each time.
+    """
+
+    def __init__(self, socket_path, timeout=10.0, retry_interval=30.0):
+        """
+        :param socket_path: path of the Unix domain socket of the service
+        :param timeout: seconds to wait for a response
+        :param retry_interval: seconds to wait before connecting again after a failure
+        """
+        self.socket_path = socket_path
+        self._timeout = timeout
+        self._retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._socket = None
+        self._reader = None
+        self._retry_at = 0.0
+        self._next_id = 0
+
+    @staticmethod
+    def available():
+        """
+        Whether the platform has Unix domain sockets at all.
+        """
+        return hasattr(socket, "AF_UNIX")
+
+    def resolve_many(self, cfg_path, show_code, file_names, timeout=None):
+        """
+        Returns the (look LUT path, baked LUT path) tuple of each media path,
+        in a single round trip. Raises ResolverUnavailable.
+
+        :param cfg_path: path to the show config file
+        :param show_code: name of the show section
+        :param file_names: list of media paths
+        :param timeout: seconds to wait for the response, None for the client's timeout
+        """
+        response = self._call({"op": "resolve", "config": cfg_path, "show": show_code,
+                               "paths": list(file_names)}, timeout)
+        return [tuple(look_luts) for look_luts in response["results"]]
+
+    def invalidate(self, cfg_path, show_code, color_dir=None, timeout=None):
+        """
+        Makes the service check a color directory again, eg. once the LUT
+        watcher saw something published into it. Raises ResolverUnavailable.
+        """
+        self._call({"op": "invalidate", "config": cfg_path, "show": show_code, "color_dir": color_dir},
+                   timeout)
+
+    def stats(self):
+        return self._call({"op": "stats"})
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _call(self, request, timeout=None):
+        with self._lock:
+            if self._socket is None:
+                if time.time() < self._retry_at:
+                    raise ResolverUnavailable(errno.ECONNREFUSED, "LUT resolver service is down", self.socket_path)
+                self._connect()
+            # the main thread waits less than the resolver pool, a timeout drops the
+            # connection like any other failure
+            self._socket.settimeout(self._timeout if timeout is None else timeout)
+            self._next_id += 1
+            request["id"] = self._next_id
+            try:
+                self._socket.sendall(json.dumps(request).encode("utf-8") + b"\n")
+                line = self._reader.readline()
+                if not line:
+                    raise socket.error(errno.ECONNRESET, "connection closed by the service")
+                response = json.loads(line.decode("utf-8"))
+            except (socket.error, socket.timeout, ValueError) as e:
+                self._fail(e)
+            if response.get("id") != request["id"]:
+                self._fail(ValueError("response out of sequence"))
+        if "error" in response:
+            raise ResolverUnavailable(errno.EIO, "LUT resolver service failed: %s" % response["error"],
+                                      self.socket_path)
+        return response
+
+    def _connect(self):
+        if not self.available():
+            self._fail(socket.error(errno.ENOSYS, "no Unix domain sockets on this platform"))
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self._timeout)
+        try:
+            connection.connect(self.socket_path)
+        except socket.error as e:
+            connection.close()
+            self._fail(e)
+        self._socket = connection
+        self._reader = connection.makefile("rb")
+
+    def _fail(self, error):
+        self._disconnect()
+        self._retry_at = time.time() + self._retry_interval
+        logger.info("LUT resolver service at %s is unavailable: %s", self.socket_path, error)
+        raise ResolverUnavailable(errno.ECONNREFUSED, str(error), self.socket_path)
+
+    def _disconnect(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve Romeo shot LUT lookups to the RV processes of this machine.")
+    parser.add_argument("--socket", default=default_socket_path(),
+                        help="Unix domain socket to listen on, defaults to $IH_ROMEO_RESOLVER_SOCKET or "
+                             "/tmp/romeo_lut_resolver.sock")
+    parser.add_argument("--revalidate", type=float, default=2.0,
+                        help="seconds a checked color directory is trusted without going back to the filer")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    service = LutResolverService(args.socket, args.revalidate)
+    logger.info("Serving LUT lookups on %s.", args.socket)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    logger.info("Served %d requests for %d paths.", service.requests, service.paths)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
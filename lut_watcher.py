@@ -0,0 +1,367 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import sys
+import time
+import errno
+import struct
+import logging
+import collections
+
+from resolver_pool import QtCore
+
+
+logger = logging.getLogger("romeo.lut_watcher")
+
+# inotify(7) constants
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+# a LUT counts as published once it is closed after writing or renamed into place
+_WATCH_MASK = (_IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE |
+               _IN_DELETE_SELF | _IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# file systems inotify doesn't see remote changes on
+_REMOTE_FILE_SYSTEMS = ("nfs", "nfs4", "cifs", "smbfs", "smb3", "afs", "fuse.sshfs", "lustre", "gpfs")
+
+
+class _Inotify(object):
+    """
+    Minimal ctypes binding to inotify. Raises OSError if it isn't available.
+    """
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding() or "utf-8")
+        wd = self._libc.inotify_add_watch(self.fd, path, _WATCH_MASK)
+        if wd < 0:
+            raise OSError(self._get_errno(), "inotify_add_watch failed")
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, max_bytes=65536):
+        """
+        Returns the (wd, mask) of the pending events, without blocking.
+        """
+        try:
+            data = os.read(self.fd, max_bytes)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            events.append((wd, mask))
+            offset += _EVENT_HEADER.size + length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _stamp(path, files):
+    """
+    Returns the mtime and size of a directory and of the given files in it,
+    None for the ones that don't exist.
+    """
+    stamp = []
+    for stat_path in (path,) + files:
+        try:
+            st = os.stat(stat_path)
+        except OSError:
+            stamp.append(None)
+        else:
+            stamp.append((st.st_mtime, st.st_size))
+    return tuple(stamp)
+
+
+def _stamp_all(watches):
+    """
+    Returns the (path, files, stamp) of each of the (path, files) pairs.
+    """
+    return [(path, files, _stamp(path, files)) for path, files in watches]
+
+
+def _mount_types():
+    """
+    Returns (mount point, file system type) pairs, longest mount point first.
+    """
+    mounts = []
+    try:
+        with open("/proc/mounts") as handle:
+            for line in handle:
+                fields = line.split()
+                if len(fields) >= 3:
+                    # spaces in mount points are escaped as \040
+                    mounts.append((fields[1].replace("\\040", " "), fields[2]))
+    except (IOError, OSError):
+        pass
+    mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+    return mounts
+
+
+class _Watch(object):
+    __slots__ = ("path", "files", "wd", "stamp", "next_poll")
+
+    def __init__(self, path, files):
+        self.path = path
+        self.files = files
+        self.wd = None
+        self.stamp = None
+        self.next_poll = 0.0
+
+
+class LutWatcher(object):
+    """
+    Watches the color directories of the shots in the session, and reports
+    the ones something was published into.
+
+    Directories on local file systems are watched with inotify. The ones on
+    NFS and other remote file systems, where inotify doesn't see changes made
+    from other hosts, and every directory on other platforms, are polled for
+    their mtime and the mtime of the LUT files picked out of them, at a low
+    frequency. Polling is spread over the timer ticks, and each tick looks at
+    a bounded number of directories, so the cost per tick doesn't depend on
+    the size of the session.
+
+    Given a ResolverPool, the directories are stat'ed on its workers and only
+    the changed ones come back to the main thread, so a stalled filer never
+    blocks the UI. Without one they are stat'ed by poll() itself.
+    """
+
+    def __init__(self, callback, poll_interval=30.0, tick_interval=1.0, max_polls_per_tick=25,
+                 max_changes_per_tick=10, pool=None):
+        """
+        :param callback: called with the path of each directory that changed, on the main thread
+        :param poll_interval: seconds between two polls of the same directory
+        :param tick_interval: seconds between two timer ticks
+        :param max_polls_per_tick: number of directories polled at most on each tick
+        :param max_changes_per_tick: number of changed directories reported at most on each tick
+        :param pool: optional ResolverPool the directories are stat'ed on
+        """
+        self._callback = callback
+        self._pool = pool
+        # whether a batch of polls is out on the pool, only one is at a time
+        self._polling = False
+        self._poll_batches = 0
+        self._poll_interval = poll_interval
+        self._tick_interval = tick_interval
+        self._max_polls_per_tick = max_polls_per_tick
+        self._max_changes_per_tick = max_changes_per_tick
+        # path -> _Watch
+        self._watches = {}
+        self._by_wd = {}
+        # polled directories, in round robin order
+        self._polled = collections.deque()
+        # changed directories waiting to be reported, in the order they changed
+        self._changed = collections.OrderedDict()
+        self._mounts = _mount_types()
+        self._timer = None
+        self.inotify = None
+        try:
+            self.inotify = _Inotify()
+        except (OSError, AttributeError):
+            # AttributeError when libc has no inotify functions
+            logger.info("inotify is not available, polling the color directories")
+
+    @staticmethod
+    def available():
+        """
+        Whether the watcher can run at all, its timer needs Qt.
+        """
+        return QtCore is not None
+
+    def watch(self, path, files=()):
+        """
+        Starts watching a directory, or updates the files watched in it.
+
+        :param path: color directory
+        :param files: files in the directory whose mtime is polled along with it,
+                      eg. the LUT currently picked out of it
+        """
+        files = tuple(files)
+        watch = self._watches.get(path)
+        if watch is not None:
+            if watch.files != files:
+                watch.files = files
+                self._take_baseline(watch)
+            return
+        watch = self._watches[path] = _Watch(path, files)
+        self._take_baseline(watch)
+        if self.inotify is not None and not self._is_remote(path):
+            try:
+                watch.wd = self.inotify.add_watch(path)
+            except OSError as e:
+                # eg. the directory doesn't exist yet, or we're out of watches
+                logger.debug("Polling %s, can't watch it: %s", path, e)
+            else:
+                self._by_wd[watch.wd] = watch
+        if watch.wd is None:
+            watch.next_poll = time.time() + self._poll_interval
+            self._polled.append(watch)
+        self._start()
+
+    def unwatch(self, path):
+        """
+        Stops watching a directory.
+
+        :param path: color directory
+        """
+        watch = self._watches.pop(path, None)
+        if watch is None:
+            return
+        self._changed.pop(path, None)
+        if watch.wd is not None:
+            self._by_wd.pop(watch.wd, None)
+            self.inotify.rm_watch(watch.wd)
+        else:
+            self._polled.remove(watch)
+        if not self._watches:
+            self._stop()
+
+    def clear(self):
+        for path in list(self._watches):
+            self.unwatch(path)
+
+    def poll(self):
+        """
+        Looks for changes and reports them, within the per tick bounds. Run
+        by the timer, can be called directly when Qt isn't around.
+        """
+        now = time.time()
+        if self.inotify is not None and self._by_wd:
+            for wd, mask in self.inotify.read_events():
+                if mask & _IN_Q_OVERFLOW:
+                    # events were lost, every watched directory may have changed
+                    for watch in self._by_wd.values():
+                        self._changed[watch.path] = True
+                    continue
+                watch = self._by_wd.get(wd)
+                if watch is None:
+                    continue
+                if mask & (_IN_IGNORED | _IN_DELETE_SELF | _IN_MOVE_SELF):
+                    # the directory itself went away, fall back to polling for it
+                    self._by_wd.pop(wd, None)
+                    watch.wd = None
+                    watch.next_poll = now + self._poll_interval
+                    self._polled.append(watch)
+                self._changed[watch.path] = True
+
+        due = []
+        # while a batch is out on the pool, eg. on a stalled filer, nothing more is polled
+        for i in range(0 if self._polling else min(self._max_polls_per_tick, len(self._polled))):
+            watch = self._polled[0]
+            if watch.next_poll > now:
+                # the queue is in poll order, nothing else is due
+                break
+            self._polled.rotate(-1)
+            watch.next_poll = now + self._poll_interval
+            due.append((watch.path, watch.files))
+        if due:
+            if self._pool is None:
+                self._polled_stamps(_stamp_all(due))
+            else:
+                self._polling = True
+                self._poll_batches += 1
+                self._pool.submit(("lut_watch", self._poll_batches), lambda: _stamp_all(due),
+                                  self._poll_done)
+
+        for i in range(min(self._max_changes_per_tick, len(self._changed))):
+            path = self._changed.popitem(last=False)[0]
+            if path not in self._watches:
+                continue
+            try:
+                self._callback(path)
+            except Exception:
+                logger.exception("Handling the change of %s failed", path)
+
+    def __len__(self):
+        return len(self._watches)
+
+    def _take_baseline(self, watch):
+        """
+        Records the current state of a watched directory, for the next polls
+        to compare to, without reporting it as a change.
+        """
+        if self._pool is None:
+            watch.stamp = _stamp(watch.path, watch.files)
+            return
+        # until the pool is done with it, the first poll result is taken as the baseline
+        watch.stamp = None
+        path, files = watch.path, watch.files
+        self._pool.submit(("lut_watch", path, files), lambda: [(path, files, _stamp(path, files))],
+                          self._polled_stamps)
+
+    def _polled_stamps(self, stamps):
+        """
+        Compares the stamps taken by a poll to the recorded ones, on the main
+        thread. stamps is None if the poll timed out.
+
+        :param stamps: list of (directory, files, stamp) tuples
+        """
+        for path, files, stamp in stamps or ():
+            watch = self._watches.get(path)
+            if watch is None or watch.files != files:
+                # no longer watched, or watched for other files since
+                continue
+            if watch.stamp is None:
+                watch.stamp = stamp
+            elif stamp != watch.stamp:
+                watch.stamp = stamp
+                self._changed[path] = True
+
+    def _poll_done(self, stamps):
+        self._polling = False
+        self._polled_stamps(stamps)
+
+    def _is_remote(self, path):
+        for mount_point, fs_type in self._mounts:
+            if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+                return fs_type in _REMOTE_FILE_SYSTEMS
+        return False
+
+    def _start(self):
+        if QtCore is None:
+            return
+        if self._timer is None:
+            self._timer = QtCore.QTimer()
+            self._timer.setInterval(int(self._tick_interval * 1000))
+            self._timer.timeout.connect(self.poll)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _stop(self):
+        if self._timer is not None:
+            self._timer.stop()
@@ -0,0 +1,273 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+
+logger = logging.getLogger("romeo.perf_trace")
+
+# upper bounds of the histogram buckets, in milliseconds
+_BUCKETS_MS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0)
+
+
+class Histogram(object):
+    """
+    Distribution of the durations recorded for a phase, in fixed
+    logarithmic buckets.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # one more bucket than bounds, for everything above the last one
+        self.buckets = [0] * (len(_BUCKETS_MS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(_BUCKETS_MS, seconds * 1000.0)] += 1
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound, in seconds, of the bucket holding the given
+        fraction of the recorded durations. The maximum for the last bucket.
+        """
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                if index < len(_BUCKETS_MS):
+                    return min(_BUCKETS_MS[index] / 1000.0, self.max)
+                break
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "max_seconds": self.max,
+            "buckets_ms": dict(zip([str(bound) for bound in _BUCKETS_MS] + ["inf"], self.buckets)),
+        }
+
+
+class _NullSpan(object):
+    """
+    What PerfTrace.span() hands out while tracing is disabled, so the
+    instrumented code only pays for a method call.
+    """
+
+    source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, trace, phase, source, filesystem):
+        self._trace = trace
+        self.phase = phase
+        self.source = source
+        self.filesystem = filesystem
+        self.parent = None
+        self.start = 0.0
+        # phase -> seconds spent in the nested spans, for the top level span
+        self.phases = None
+
+    def __enter__(self):
+        self._trace._push(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._trace._pop(self, time.time() - self.start)
+        return False
+
+
+class PerfTrace(object):
+    """
+    Lightweight timing of the phases of the source setup. Phases are timed
+    with nested spans:
+
+        with trace.span("source_setup", source=group) as span:
+            with trace.span("resolve_lut", filesystem=True):
+                ...
+
+    Durations are aggregated into a histogram per phase and a total per
+    source for the session, and every top level span is appended as a JSON
+    line to a rotating log file. While disabled, span() returns a shared
+    no-op context manager.
+    """
+
+    def __init__(self, enabled=False, log_path=None, max_bytes=5 * 1024 * 1024, backup_count=3):
+        """
+        :param enabled: whether spans are timed at all
+        :param log_path: JSON lines file the top level spans are written to, None to not write any
+        :param max_bytes: size the log file is rotated at
+        :param backup_count: number of rotated log files to keep
+        """
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._export = None
+        if enabled and log_path:
+            # only imported when tracing, it is slow to import and the mode is loaded at startup
+            import logging.handlers
+            self._export = logging.getLogger("romeo.perf_trace.export")
+            self._export.propagate = False
+            self._export.setLevel(logging.INFO)
+            if not self._export.handlers:
+                handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes,
+                                                               backupCount=backup_count)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._export.addHandler(handler)
+        self.reset()
+
+    def reset(self):
+        """
+        Starts a new session, dropping the aggregated timings.
+        """
+        with self._lock:
+            # phase -> Histogram
+            self.histograms = {}
+            # source -> seconds spent in the top level spans for it
+            self.sources = {}
+            # seconds spent in file system spans, not counting nested ones twice
+            self.filesystem_seconds = 0.0
+
+    def span(self, phase, source=None, filesystem=False):
+        """
+        Returns a context manager timing a phase. Its source attribute can be
+        set once the source being worked on is known.
+
+        :param phase: name of the phase, eg. resolve_lut
+        :param source: what the phase is working on, eg. a media path
+        :param filesystem: whether the phase is spent on the file system
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, phase, source, filesystem)
+
+    def _push(self, span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        if stack:
+            span.parent = stack[-1]
+        else:
+            span.phases = {}
+        stack.append(span)
+
+    def _pop(self, span, seconds):
+        stack = self._local.stack
+        stack.pop()
+        root = stack[0] if stack else span
+        if root is not span:
+            root.phases[span.phase] = root.phases.get(span.phase, 0.0) + seconds
+            if root.source is None and span.source is not None:
+                root.source = span.source
+        # nested file system spans are already accounted for by their parent
+        parent = span.parent
+        in_filesystem = False
+        while parent is not None:
+            if parent.filesystem:
+                in_filesystem = True
+                break
+            parent = parent.parent
+        with self._lock:
+            histogram = self.histograms.get(span.phase)
+            if histogram is None:
+                histogram = self.histograms[span.phase] = Histogram()
+            histogram.add(seconds)
+            if span.filesystem and not in_filesystem:
+                self.filesystem_seconds += seconds
+            if root is span and span.source is not None:
+                self.sources[span.source] = self.sources.get(span.source, 0.0) + seconds
+        if root is span and self._export is not None:
+            try:
+                self._export.info(json.dumps({
+                    "time": span.start,
+                    "phase": span.phase,
+                    "source": span.source,
+                    "seconds": seconds,
+                    "phases": span.phases,
+                }, sort_keys=True))
+            except Exception:
+                logger.exception("Failed to export the timing of %s", span.phase)
+
+    def end_session(self):
+        """
+        Writes the histograms of the session to the log file, if there is
+        one, and starts a new session.
+        """
+        if self._export is not None and self.histograms:
+            with self._lock:
+                summary = {
+                    "time": time.time(),
+                    "phase": "session",
+                    "filesystem_seconds": self.filesystem_seconds,
+                    "sources": len(self.sources),
+                    "histograms": dict((phase, histogram.as_dict())
+                                       for phase, histogram in self.histograms.items()),
+                }
+            try:
+                self._export.info(json.dumps(summary, sort_keys=True))
+            except Exception:
+                logger.exception("Failed to export the session timings")
+        self.reset()
+
+    def slowest_sources(self, count=5):
+        """
+        Returns the (source, seconds) pairs of the sources that took the
+        longest to set up in the session, slowest first.
+        """
+        with self._lock:
+            items = list(self.sources.items())
+        items.sort(key=lambda item: item[1], reverse=True)
+        return items[:count]
+
+    def report(self, count=5):
+        """
+        Returns a short human readable summary of the session timings.
+
+        :param count: number of slowest sources to list
+        """
+        if not self.enabled:
+            return "Romeo performance tracing is disabled"
+        lines = ["File system: %.3fs" % self.filesystem_seconds]
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True)
+        for phase, histogram in histograms:
+            lines.append("%s: %d calls, %.3fs total, p90 %.1fms, max %.1fms" % (
+                phase, histogram.count, histogram.total,
+                histogram.percentile(0.9) * 1000.0, histogram.max * 1000.0))
+        slowest = self.slowest_sources(count)
+        if slowest:
+            lines.append("Slowest sources:")
+            for source, seconds in slowest:
+                lines.append("  %.3fs %s" % (seconds, os.path.basename(str(source)) or source))
+        return "\n".join(lines)
@@ -10,99 +10,291 @@
 
 import sys
 import os
+import atexit
+import logging
+import tempfile
+import threading
 from xml.etree import ElementTree
 
+try:
+    import fcntl
+except ImportError:
+    # no advisory locking on Windows, the atomic rename still prevents torn reads
+    fcntl = None
+
+
+logger = logging.getLogger("romeo.preferences")
+
+_TEXT_TYPE = type(u"")
+
+# marks a key deleted but not yet flushed
+_DELETED = object()
+
+
+def app_support_dir(project):
+    """
+    Returns the directory the source setup of a project keeps its files in,
+    under RV's first support path, creating it if needed.
+
+    :param project: name of the project, eg. romeo
+    """
+    app_support = os.getenv("TWK_APP_SUPPORT_PATH")
+    if ":" in app_support:
+        app_support = app_support.split(":")[0]
+    elif ";" in app_support:
+        app_support = app_support.split(";")[0]
+    support_dir = os.path.join(app_support, "SupportFiles", "%s_source_setup" % project)
+    if not os.path.exists(support_dir):
+        os.makedirs(support_dir)
+    return support_dir
+
 
 class Preferences(object):
-    """ 
-    This class manages preferences with a cached xml file
     """
-    
-    def __init__(self, project):
+    This class manages preferences with a cached xml file.
+
+    The file can be shared by several RV and rvio processes. Changes are
+    written behind, on idle or at exit, merged with what the other processes
+    wrote in the meantime under an advisory lock, and swapped in with an
+    atomic rename so readers never see a partly written file. The file is
+    only read again when it changes.
+    """
+
+    def __init__(self, project, schedule=None):
         """
         Initializes the preference class.
-        
+
         :param project: name of the project we're saving these prefs for
+        :param schedule: callable taking a function to run once the caller is idle,
+                         eg. on the next event loop tick. Changes are only written
+                         at exit or by flush() if None
         """
         self._xml_path = None
         self._preferences = {}
-        
+        # changes not written yet, key -> value or _DELETED
+        self._pending = {}
+        self._schedule = schedule
+        self._flush_scheduled = False
+        # (mtime, size, inode) of the file when we last read or wrote it
+        self._stamp = None
+        self._lock = threading.Lock()
+
         # Since we don't want to rely on toolkit for our source setup, instead access a
         # cached pycrypto file
-        app_support = os.getenv("TWK_APP_SUPPORT_PATH")
-        if ":" in app_support:
-            app_support = app_support.split(":")[0]
-        elif ";" in app_support:
-            app_support = app_support.split(";")[0]
-        self._xml_path = os.path.join(app_support, "SupportFiles", "%s_source_setup" % project)
-        if not os.path.exists(self._xml_path):
-            os.makedirs(self._xml_path)
-        self._xml_path = os.path.join(self._xml_path, "color_prefs.xml")
-        if os.path.exists(self._xml_path):
-            self._read_xml_preferences()
+        self.support_dir = app_support_dir(project)
+        self._xml_path = os.path.join(self.support_dir, "color_prefs.xml")
+        self._lock_path = self._xml_path + ".lock"
+        self._reload()
+        atexit.register(self.flush)
 
 
     def retrieve(self, key):
         """
         Retrieves the key given from the stored prefs.
-        
+
         :param key: String such as 'lut_path' that indicates what pref the script needs
         """
+        with self._lock:
+            value = self._pending.get(key)
+            if value is not None:
+                return None if value is _DELETED else value
+        self._reload()
         return self._preferences.get(key)
 
 
     def store(self, key, value):
         """
-        Save the value of the given key to the cache file.
-        
+        Save the value of the given key to the cache file. The file is only
+        written once the caller is idle.
+
         :param key: String such as 'lut_path' that indicates what pref the script wants to store
         :param value: value to be saved
         """
-        # Write out a pycrypto xml file to the cache_location saving the given key/value pair
-        # we only want to rewrite the creds if they are different than before
-        new_preferences = {}
-        if isinstance(value, unicode):
+        if isinstance(value, _TEXT_TYPE) and not isinstance(value, str):
             value = value.encode("ascii", "ignore")
-        if self._preferences.get(key) != value:
-            new_preferences[key] = value
-        if new_preferences:
-            # if we have new_preferences, update the preferences dictionary and write to the prefs file
-            self._preferences.update(new_preferences)
-            self._write_xml_preferences(self._preferences)
+        # we only want to rewrite the prefs if they are different than before
+        if self.retrieve(key) == value:
+            return
+        with self._lock:
+            self._pending[key] = value
+        self._schedule_flush()
 
 
     def delete(self, key):
         """
         Remove the preferences of the given key from the cache file.
-        
+
         :param key: String such as 'lut_path' that indicates which prefs the script wants to delete
         """
         # if the key isn't in the cached data, no need to delete
-        if self._preferences.get(key):
-            del self._preferences[key]
-            self._write_xml_preferences()
+        if self.retrieve(key) is None:
+            return
+        with self._lock:
+            self._pending[key] = _DELETED
+        self._schedule_flush()
+
+
+    def keys(self):
+        """
+        Returns the keys of the stored prefs, including the ones not written yet.
+        """
+        self._reload()
+        with self._lock:
+            keys = set(self._preferences)
+            for key, value in self._pending.items():
+                if value is _DELETED:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return sorted(keys)
+
+
+    def flush(self):
+        """
+        Writes the pending changes, merged with the current contents of the
+        file. Safe to call at any time, does nothing if nothing changed.
+        """
+        with self._lock:
+            self._flush_scheduled = False
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = {}
+        try:
+            with FileLock(self._lock_path):
+                # another process may have written since we last read the file
+                preferences, stamp = self._read_xml_preferences()
+                for key, value in pending.items():
+                    if value is _DELETED:
+                        preferences.pop(key, None)
+                    else:
+                        preferences[key] = value
+                stamp = self._write_xml_preferences(preferences)
+        except (IOError, OSError):
+            logger.exception("Unable to write the preferences to %s", self._xml_path)
+            with self._lock:
+                # keep the changes around for the next attempt, unless they were superseded
+                for key, value in pending.items():
+                    self._pending.setdefault(key, value)
+            return
+        with self._lock:
+            self._preferences = preferences
+            self._stamp = stamp
+
+
+    def _schedule_flush(self):
+        if self._schedule is None:
+            return
+        with self._lock:
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._schedule(self.flush)
+
+
+    def _reload(self):
+        """
+        Reads the file again if it changed since we last read or wrote it.
+        """
+        stamp = self._file_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return
+        try:
+            preferences, stamp = self._read_xml_preferences()
+        except (IOError, OSError, SyntaxError):
+            # ElementTree raises a SyntaxError subclass for malformed files
+            logger.exception("Unable to read the preferences from %s", self._xml_path)
+            return
+        with self._lock:
+            self._preferences = preferences
+            self._stamp = stamp
+
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self._xml_path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
 
 
     def _read_xml_preferences(self):
-        print self._xml_path
-        with open(self._xml_path, "r") as xml_handle:
+        """
+        Returns the preferences in the file, and the stamp of the file that
+        was read. The file is always replaced as a whole, so it can be read
+        without locking.
+        """
+        preferences = {}
+        try:
+            xml_handle = open(self._xml_path, "rb")
+        except IOError:
+            # nothing has been stored yet
+            return preferences, None
+        with xml_handle:
+            st = os.fstat(xml_handle.fileno())
             tree = ElementTree.parse(xml_handle)
-            for node in tree.iter():
-                self._preferences[node.tag] = node.text
-
-
-    def _write_xml_preferences(self, new_preferences={}):
-        export_preferences = {}
-        keys = self._preferences.keys()
-        keys.extend(new_preferences.keys())  
-        for key in keys:
-            if key in new_preferences.keys():
-                export_preferences[str(key)] = new_preferences.get(key)
-            else:
-                export_preferences[str(key)] = self._preferences.get(key)
-        with open(self._xml_path, "w") as xml_handle:
-            root = ElementTree.Element("root")
-            for key, val in export_preferences.iteritems():
-                ElementTree.SubElement(root, key).text = val
-            tree = ElementTree.ElementTree(root)
-            tree.write(xml_handle)
+        for node in tree.getroot():
+            preferences[node.tag] = node.text
+        return preferences, (st.st_mtime, st.st_size, st.st_ino)
+
+
+    def _write_xml_preferences(self, preferences):
+        """
+        Replaces the file with the given preferences and returns the stamp
+        of the new file.
+        """
+        root = ElementTree.Element("root")
+        for key in sorted(preferences):
+            ElementTree.SubElement(root, str(key)).text = preferences[key]
+        fd, tmp_path = tempfile.mkstemp(dir=self.support_dir, prefix=".color_prefs", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as xml_handle:
+                ElementTree.ElementTree(root).write(xml_handle)
+                xml_handle.flush()
+                os.fsync(xml_handle.fileno())
+            st = os.stat(tmp_path)
+            _replace(tmp_path, self._xml_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _replace(src, dst):
+    """
+    Renames src over dst atomically where the platform allows it.
+    """
+    if sys.platform != "win32":
+        os.rename(src, dst)
+    elif hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        # python 2 on Windows can't rename over an existing file
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class FileLock(object):
+    """
+    Exclusive advisory lock on a file, held for the duration of a with
+    block. A no-op where fcntl isn't available.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._handle = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._handle = open(self._path, "a")
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._handle is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            self._handle.close()
+            self._handle = None
+        return False
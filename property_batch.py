@@ -0,0 +1,118 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import collections
+
+from rv import commands
+
+from resolver_pool import call_soon
+
+
+class PropertyBatch(object):
+    """
+    Collects the final desired value of RV node properties and writes them
+    in one go, skipping the ones that already hold that value. Setting the
+    same property several times before flushing only keeps the last value.
+    """
+
+    # counters shared by every batch, for monitoring
+    writes = 0
+    skipped = 0
+
+    def __init__(self):
+        # property -> (getter, setter, values), in the order they were first set
+        self._values = collections.OrderedDict()
+
+    def set_int(self, prop, values):
+        """
+        :param prop: full property name, eg. sourceGroup000000_tolinPipeline_0.node.active
+        :param values: list of ints
+        """
+        self._values[prop] = (commands.getIntProperty, commands.setIntProperty, list(values))
+
+    def set_float(self, prop, values):
+        """
+        :param prop: full property name
+        :param values: list of floats
+        """
+        self._values[prop] = (commands.getFloatProperty, commands.setFloatProperty, list(values))
+
+    def set_string(self, prop, values):
+        """
+        :param prop: full property name
+        :param values: list of strings
+        """
+        self._values[prop] = (commands.getStringProperty, commands.setStringProperty, list(values))
+
+    def flush(self):
+        """
+        Writes every property whose current value differs from the desired
+        one. Returns the number of properties written.
+        """
+        written = 0
+        for prop, (getter, setter, values) in self._values.items():
+            try:
+                current = list(getter(prop))
+            except Exception:
+                # the property doesn't exist yet, setting it will create it
+                current = None
+            if current == values:
+                PropertyBatch.skipped += 1
+                continue
+            setter(prop, values, True)
+            written += 1
+        PropertyBatch.writes += written
+        self._values.clear()
+        return written
+
+    def __len__(self):
+        return len(self._values)
+
+
+_lut_update_pending = [False]
+_lut_update_trace = [None]
+
+
+def _update_lut():
+    if not _lut_update_pending[0]:
+        # already done by flush_lut_update
+        return
+    _lut_update_pending[0] = False
+    trace = _lut_update_trace[0]
+    _lut_update_trace[0] = None
+    if trace is None:
+        commands.updateLUT()
+        return
+    with trace.span("update_lut"):
+        commands.updateLUT()
+
+
+def request_lut_update(trace=None):
+    """
+    Schedules a single commands.updateLUT() for the end of the current event
+    loop tick, however many LUTs are read in the meantime. Without Qt the
+    update happens right away.
+
+    :param trace: optional PerfTrace the update is timed with
+    """
+    if _lut_update_pending[0]:
+        return
+    _lut_update_pending[0] = True
+    _lut_update_trace[0] = trace
+    call_soon(_update_lut)
+
+
+def flush_lut_update():
+    """
+    Does the updateLUT() requested since the last one right away, eg. before
+    rvio renders its first frame, rather than at the end of the event loop
+    tick.
+    """
+    _update_lut()
@@ -0,0 +1,237 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import time
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    from PySide2 import QtCore
+except ImportError:
+    try:
+        from PySide import QtCore
+    except ImportError:
+        QtCore = None
+
+
+logger = logging.getLogger("romeo.resolver_pool")
+
+
+def call_soon(func):
+    """
+    Runs func on the main thread once the current event loop tick is over,
+    or right away if Qt isn't available. Must be called on the main thread.
+
+    :param func: callable taking no arguments
+    """
+    if QtCore is None:
+        func()
+    else:
+        QtCore.QTimer.singleShot(0, func)
+
+
+class MainThreadQueue(object):
+    """
+    Hands callables over from worker threads to RV's main thread. The queue
+    is drained by a Qt timer, which only runs while there is something
+    waiting to be picked up.
+    """
+
+    def __init__(self, interval=50):
+        """
+        Has to be created on the main thread.
+
+        :param interval: polling interval in milliseconds while work is pending
+        """
+        self._queue = queue.Queue()
+        self._idle_callbacks = []
+        self._timer = QtCore.QTimer()
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self._drain)
+
+    @staticmethod
+    def available():
+        """
+        Whether we can get back to the main thread at all. Without Qt, callers
+        have to stick to doing their work synchronously.
+        """
+        return QtCore is not None
+
+    def post(self, func, *args):
+        """
+        Schedules func(*args) to run on the main thread. Safe to call from any
+        thread.
+        """
+        self._queue.put((func, args))
+
+    def add_poll_callback(self, func):
+        """
+        Registers a callable that is run on the main thread every time the
+        queue is drained, eg. to check for timeouts.
+
+        :param func: callable taking no arguments
+        """
+        self._idle_callbacks.append(func)
+
+    def start(self):
+        """
+        Makes sure the timer is running. Must be called on the main thread.
+        """
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def stop(self):
+        """
+        Stops the timer. Must be called on the main thread.
+        """
+        self._timer.stop()
+
+    def _drain(self):
+        while True:
+            try:
+                func, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Main thread callback %r failed.", func)
+        for func in self._idle_callbacks:
+            try:
+                func()
+            except Exception:
+                logger.exception("Main thread poll callback %r failed.", func)
+
+
+class _Job(object):
+    """
+    A single lookup, along with every caller waiting on its result.
+    """
+    __slots__ = ("key", "func", "callbacks", "started", "done")
+
+    def __init__(self, key, func):
+        self.key = key
+        self.func = func
+        self.callbacks = []
+        self.started = None
+        self.done = False
+
+
+class ResolverPool(object):
+    """
+    Bounded pool of worker threads running file system lookups off the main
+    thread. Requests for the same key are coalesced into a single lookup and
+    every callback is run on the main thread once the result is in.
+
+    If a lookup takes longer than the timeout, its callbacks get None and a
+    replacement worker is started so that a hung filer can't use up the whole
+    pool. The late result is dropped when it eventually arrives.
+    """
+
+    def __init__(self, size=4, timeout=30.0):
+        """
+        Has to be created on the main thread.
+
+        :param size: number of worker threads
+        :param timeout: seconds a single lookup may take, None to wait forever
+        """
+        self._size = size
+        self._timeout = timeout
+        self._requests = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._main_thread = MainThreadQueue()
+        self._main_thread.add_poll_callback(self._check_timeouts)
+        for i in range(size):
+            self._start_worker()
+
+    def submit(self, key, func, callback):
+        """
+        Runs func() on a worker thread and calls callback(result) on the main
+        thread. If a lookup for key is already in flight, callback is attached
+        to it instead of starting a new one.
+
+        :param key: hashable identifying the lookup, eg. the shot color directory
+        :param func: callable taking no arguments doing the actual lookup
+        :param callback: callable taking the result, run on the main thread
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                job = _Job(key, func)
+                self._jobs[key] = job
+                self._requests.put(job)
+            job.callbacks.append(callback)
+        self._main_thread.start()
+
+    def pending(self):
+        """
+        Number of lookups queued or in flight.
+        """
+        with self._lock:
+            return len(self._jobs)
+
+    def _start_worker(self):
+        with self._lock:
+            self._workers += 1
+        worker = threading.Thread(target=self._work, name="romeo-lut-resolver")
+        worker.daemon = True
+        worker.start()
+
+    def _work(self):
+        while True:
+            job = self._requests.get()
+            job.started = time.time()
+            try:
+                result = job.func()
+            except Exception:
+                logger.exception("LUT lookup for %s failed.", job.key)
+                result = None
+            self._main_thread.post(self._finish, job, result)
+            with self._lock:
+                # if a replacement was started while we were stuck, bow out
+                if self._workers > self._size:
+                    self._workers -= 1
+                    return
+
+    def _finish(self, job, result):
+        with self._lock:
+            if job.done:
+                return
+            job.done = True
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+        for callback in job.callbacks:
+            try:
+                callback(result)
+            except Exception:
+                logger.exception("LUT lookup callback for %s failed.", job.key)
+
+    def _check_timeouts(self):
+        timed_out = []
+        with self._lock:
+            if self._timeout is not None:
+                now = time.time()
+                for job in self._jobs.values():
+                    if job.started is not None and now - job.started > self._timeout:
+                        timed_out.append(job)
+            idle = not self._jobs
+        for job in timed_out:
+            logger.warning("LUT lookup for %s timed out after %.1f seconds.", job.key, self._timeout)
+            self._finish(job, None)
+            self._start_worker()
+        if idle:
+            self._main_thread.stop()
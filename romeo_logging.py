@@ -0,0 +1,262 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+# every module of the plugin logs under this logger
+PACKAGE_LOGGER = "romeo"
+
+_STOP = object()
+
+_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+# the background writer of the package logger, set up once per process
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class RateLimiter(object):
+    """
+    Lets at most burst records with the same message through per interval,
+    from a given level up. The message is the unformatted template, so
+    "No CC files found in: %s" counts as one message whatever the directory.
+    Suppressed records are counted and summarized in a single record once
+    the interval is over.
+    """
+
+    # windows kept around at most, expired ones are dropped past that
+    max_windows = 1000
+
+    def __init__(self, burst=5, interval=60.0, level=logging.WARNING):
+        """
+        :param burst: number of records with the same message let through per interval
+        :param interval: length of the interval, in seconds
+        :param level: records below this level are never limited
+        """
+        self.burst = burst
+        self.interval = interval
+        self.level = level
+        self._lock = threading.Lock()
+        # (logger name, message) -> [window start, records seen, first suppressed record]
+        self._windows = {}
+        self.suppressed = 0
+
+    def admit(self, record):
+        """
+        Returns the records to write for a new record: nothing if it is
+        suppressed, the record itself otherwise, preceded by the summary of
+        the previous interval if anything was suppressed in it.
+        """
+        if record.levelno < self.level:
+            return (record,)
+        key = (record.name, record.msg)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and record.created - window[0] < self.interval:
+                window[1] += 1
+                if window[1] <= self.burst:
+                    return (record,)
+                self.suppressed += 1
+                if window[2] is None:
+                    window[2] = record
+                return ()
+            self._windows[key] = [record.created, 1, None]
+            if len(self._windows) > self.max_windows:
+                self._drop_expired(record.created)
+        if window is not None and window[2] is not None:
+            return (self._summary(window), record)
+        return (record,)
+
+    def expired(self, now=None):
+        """
+        Returns the summaries of the intervals that are over, and forgets them.
+        """
+        now = time.time() if now is None else now
+        summaries = []
+        with self._lock:
+            for key, window in list(self._windows.items()):
+                if now - window[0] >= self.interval:
+                    del self._windows[key]
+                    if window[2] is not None:
+                        summaries.append(self._summary(window))
+        return summaries
+
+    def _drop_expired(self, now):
+        for key, window in list(self._windows.items()):
+            if now - window[0] >= self.interval and window[2] is None:
+                del self._windows[key]
+
+    def _summary(self, window):
+        first = window[2]
+        summary = logging.LogRecord(first.name, first.levelno, first.pathname, first.lineno,
+                                    "Suppressed %d more messages like this one in %gs: %s",
+                                    (window[1] - self.burst, self.interval, first.getMessage()), None)
+        summary.source = getattr(first, "source", None)
+        return summary
+
+
+class _QueueHandler(logging.Handler):
+    """
+    Hands records over to the background writer. Unlike the standard
+    QueueHandler, records aren't formatted on the way, that is left to the
+    writer thread.
+    """
+
+    def __init__(self, records, limiter):
+        logging.Handler.__init__(self)
+        self._records = records
+        self._limiter = limiter
+
+    def emit(self, record):
+        for admitted in self._limiter.admit(record):
+            self._records.put(admitted)
+
+
+class _Writer(object):
+    """
+    Background thread formatting and writing the records of the package
+    logger, so that the source setup never waits on the terminal.
+    """
+
+    def __init__(self, target, limiter):
+        self.target = target
+        self.limiter = limiter
+        self.records = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="romeo-log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                record = self.records.get(timeout=self.limiter.interval)
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if record is not None:
+                self._write(record)
+            for summary in self.limiter.expired():
+                self._write(summary)
+        for summary in self.limiter.expired(float("inf")):
+            self._write(summary)
+
+    def _write(self, record):
+        try:
+            self.target.handle(record)
+        except Exception:
+            self.target.handleError(record)
+
+    def stop(self, timeout=2.0):
+        """
+        Writes what is left in the queue and stops the thread.
+        """
+        self.records.put(_STOP)
+        self._thread.join(timeout)
+
+
+class _SourceFormatter(logging.Formatter):
+    """
+    Text formatter showing the source a record is about, if any.
+    """
+
+    def format(self, record):
+        record.source = getattr(record, "source", None) or "-"
+        return logging.Formatter.format(self, record)
+
+
+class _JsonFormatter(logging.Formatter):
+    """
+    Formats records as JSON lines, one field per bit of structure.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "source": getattr(record, "source", None),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure(level=None, log_format=None, stream=None, burst=5, interval=60.0):
+    """
+    Sets up the package logger to write through a background thread, once
+    per process, no matter how many times the mode is created. Returns the
+    package logger.
+
+    Records passed a source, eg. logger.warning(msg, extra={"source": path}),
+    carry it as a field of their own.
+
+    :param level: level name, defaults to $IH_ROMEO_LOG_LEVEL, or info
+    :param log_format: text or json, defaults to $IH_ROMEO_LOG_FORMAT, or text
+    :param stream: stream to write to, stderr by default
+    :param burst: number of identical warnings let through per interval
+    :param interval: seconds over which identical warnings are counted
+    """
+    global _writer
+    package_logger = logging.getLogger(PACKAGE_LOGGER)
+    with _writer_lock:
+        if _writer is None:
+            log_format = log_format or os.environ.get("IH_ROMEO_LOG_FORMAT", "text")
+            target = logging.StreamHandler(stream or sys.stderr)
+            if log_format == "json":
+                target.setFormatter(_JsonFormatter())
+            else:
+                target.setFormatter(_SourceFormatter("%(levelname)s romeo [%(source)s] %(message)s"))
+            limiter = RateLimiter(burst, interval)
+            _writer = _Writer(target, limiter)
+            package_logger.addHandler(_QueueHandler(_writer.records, limiter))
+            # the records are written once, not again by whatever the root logger has
+            package_logger.propagate = False
+            atexit.register(_writer.stop)
+            set_level(level or os.environ.get("IH_ROMEO_LOG_LEVEL", "info"))
+        elif level:
+            set_level(level)
+    return package_logger
+
+
+def set_level(level):
+    """
+    Sets the level of the package logger.
+
+    :param level: level name, eg. info
+    """
+    logging.getLogger(PACKAGE_LOGGER).setLevel(_LEVELS.get(str(level).lower(), logging.INFO))
+
+
+def suppressed():
+    """
+    Returns the number of records the rate limiter dropped so far.
+    """
+    if _writer is None:
+        return 0
+    return _writer.limiter.suppressed
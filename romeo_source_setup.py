@@ -8,17 +8,29 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-import sys
-import glob
 import os
-import re
+import json
+import time
 import logging
 import xml.dom.minidom
-import ConfigParser
 
 from rv import rvtypes, rvui, commands, extra_commands, runtime
 
-from preferences import Preferences
+from preferences import Preferences, app_support_dir
+from dir_snapshot import DirectorySnapshotCache
+from lut_index import LutIndex
+from show_config import ShowConfig
+from resolver_pool import MainThreadQueue, ResolverPool, call_soon
+from lut_mirror import LutMirror
+from property_batch import PropertyBatch, request_lut_update, flush_lut_update
+from lut_fingerprint import LutFingerprints
+from perf_trace import PerfTrace
+from source_ranges import SourceRangeIndex
+from bounded_cache import LruDict
+from lut_watcher import LutWatcher
+from lut_prefetch import LutPrefetcher
+from lut_resolver_service import ResolverClient, ResolverUnavailable, default_socket_path
+from romeo_logging import configure as configure_logging, set_level as set_log_level
 
 
 def group_member_of_type(node, member_type):
@@ -34,6 +46,26 @@ def group_member_of_type(node, member_type):
     return None
 
 
+def command_line_option(flag, variable):
+    """
+    Returns an option given to RV or rvio with -flags flag=value, or else
+    from an environment variable, None if neither is set.
+
+    :param flag: name of the -flags option
+    :param variable: name of the environment variable
+    """
+    return commands.commandLineFlag(flag, None) or os.environ.get(variable) or None
+
+
+def batch_mode():
+    """
+    Whether the mode runs in rvio or another headless session, ie. RV was
+    given -flags romeo_batch=1 or IH_ROMEO_BATCH is set. There is nobody to
+    answer a dialog then, nor any hotkey to bind.
+    """
+    return command_line_option("romeo_batch", "IH_ROMEO_BATCH") not in (None, "0")
+
+
 class RomeoSourceSetup(rvtypes.MinorMode):
     """
     Configures custom RV settings for Level Up for mattes, CDLs, linearization, and luts.
@@ -41,38 +73,110 @@ class RomeoSourceSetup(rvtypes.MinorMode):
     See ticket # for full description.
     """
 
+    # sources whose nodes and frame range are kept at most, the least recently used
+    # ones are looked up in the graph again if they are needed
+    max_cached_sources = 10000
+
     def __init__(self):
         rvtypes.MinorMode.__init__(self)
         self._look_lut_path = None
-        self._look_lut_dict = {}
         # Since we want the matte to stay on for all frames regardless of file type, we manage
         # the matte state with a global variable
         # since we're doing the slate management as a custom thing, we need to store whether
         # the slate is currently on or off, but at the beginning we assume that the slate is on
         self._slate_on = True
         self._handles_on = True
+        # in batch mode (rvio), the show comes from the command line or the environment
+        # only, there are no hotkeys or menus, and the look LUTs are all applied
+        # before the first frame is rendered
+        self._batch = batch_mode()
 
-        self.init("Romeo Source Setup", None,
-                  [("after-session-read", self._set_display_to_no_correction, ""),
-                   ("source-group-complete", self.source_setup_romeo, "Color Management"),
-                   ("key-down--f6", self.toggle_wipes, "Over Mode and Wipes on/off")],
-                  [("Color", [("Romeo Shot LUT", self.toggle_look, "alt meta l", self.look_menu_state)])],
-                  # defines custom menu item for matte
+        bindings = [("after-session-read", self._session_read, ""),
+                    ("graph-new-node", self._node_created, ""),
+                    ("source-group-complete", self.source_setup_romeo, "Color Management"),
+                    ("before-source-delete", self._source_removed, "Release Romeo source state"),
+                    ("after-clear-session", self._session_cleared, "Release Romeo session state"),
+                    ("frame-changed", self._frame_changed, ""),
+                    ("after-graph-view-change", self._view_changed, ""),
+                    ("graph-state-change", self._graph_state_changed, "")]
+        menu = None
+        if not self._batch:
+            bindings.append(("key-down--f6", self.toggle_wipes, "Over Mode and Wipes on/off"))
+            # defines custom menu item for matte
+            menu = [("Color", [("Romeo Shot LUT", self.toggle_look, "alt meta l", self.look_menu_state)])]
+        self.init("Romeo Source Setup", None, bindings, menu,
                   "source_setup", 1)  # 1 will put this after the default "source_setup"
 
-        self._logger = logging.getLogger()
-        self._logger.addHandler(logging.StreamHandler())
-        self._logger.setLevel(logging.INFO)
-        self._show_cfg = ConfigParser.ConfigParser()
-        self._show_cfg.read(self._retrieve_cfg_path())
-        self._shot_regexp = re.compile(self._show_cfg.get(self._show_code, 'shot_regexp'))
-        self._sequence_regexp = re.compile(self._show_cfg.get(self._show_code, 'sequence_regexp'))
-        self._production_root = self._show_cfg.get('production_root', sys.platform)
-        self._inhouse_root = self._show_cfg.get('show_root', sys.platform)
-        self._shot_dir_format = self._show_cfg.get(self._show_code, 'shot_dir_format')
-        self._sequence_dir_format = self._show_cfg.get(self._show_code, 'seq_dir_format')
-        self._mainplate_regexp = re.compile(self._show_cfg.get(self._show_code, 'mainplate_regexp'))
-        self._shot_color_dir = self._show_cfg.get(self._show_code, 'cdl_dir_format').format(pathsep = os.path.sep)
+        # the plugin logs under the romeo package logger, whose records are written
+        # by a background thread. Creating the mode again doesn't add a handler
+        configure_logging()
+        self._logger = logging.getLogger("romeo.source_setup")
+        # the show config, the preferences and everything depending on them are only
+        # set up once the first EXR or DPX source shows up (see _setup_show), so that
+        # sessions without any don't pay for them
+        self._prefs = None
+        self._show_code = None
+        self._show_config = None
+        self._lut_index = None
+        self._color_dir_cache = None
+        self._lut_mirror = None
+        self._lut_fingerprints = None
+        self._resolver_pool = None
+        self._lut_watcher = None
+        self._lut_prefetcher = None
+        self._resolver_client = None
+        self._resolver_main_thread_timeout = None
+        # media path -> (look LUT, baked LUT) resolved up front for a batch job
+        self._job_luts = {}
+
+        # timing of the phases of the source setup, off unless IH_ROMEO_PERF_TRACE
+        # is set in the environment or perf_trace is set for the show
+        self._perf_trace = PerfTrace(False)
+        if os.environ.get('IH_ROMEO_PERF_TRACE'):
+            self._perf_trace = PerfTrace(True, os.path.join(app_support_dir("romeo"), "perf_trace.jsonl"))
+
+        # token of the most recent lookup submitted for each look node, so that a
+        # stale result never overwrites a newer one
+        self._pending_looks = {}
+        # look nodes currently holding a baked LUT
+        self._baked_looks = set()
+        # frame range of the media of every source, for the slate and handles toggles
+        self._source_range_index = SourceRangeIndex(self.max_cached_sources)
+        # source group -> {node type: node} for the look pipeline nodes we set up
+        self._pipeline_nodes = LruDict(self.max_cached_sources)
+        # (file source, node type) -> node of that type for the source, so menu
+        # redraws don't walk the graph. Dropped when a look pipeline changes
+        self._current_nodes = LruDict(1000)
+        # color directory -> {look node: (alexa node, file name)} of the sources whose
+        # look LUT gets reloaded when something is published into that directory
+        self._watched_looks = {}
+        # look node -> color directory it is watched under
+        self._look_color_dirs = {}
+        # look node -> (alexa node, file name) of the sources whose look LUT the
+        # prefetcher stages once the playhead gets close, and whether the sources
+        # were added, removed or reordered since it was told where they are
+        self._deferred_looks = {}
+        self._prefetch_timeline_dirty = True
+        self._prefetch_scheduled = False
+        # look node -> (alexa node, file name) of the sources waiting to be resolved
+        # by the resolver service, all in one request once the event loop is idle
+        self._queued_looks = {}
+        self._queued_flush_scheduled = False
+        # RVDisplayColor nodes already set to No Correction, None until the session
+        # has been scanned for them, and the ones created or changed since then
+        self._display_nodes = None
+        self._drifted_displays = set()
+        self._writing_displays = False
+        # display property writes made and skipped, for monitoring
+        self.display_writes = 0
+        self.display_writes_avoided = 0
+        # look LUTs read or copied into a look node this session, and the ones
+        # skipped because the node already held a LUT with the same contents
+        self.lut_loads = 0
+        self.lut_loads_avoided = 0
+
+        if self._batch:
+            return
 
         # since alt-f is already bound in presentation_mode, we need to unbind it first before ours will work
         commands.unbind("presentation_control", "global", "key-down--alt--f")
@@ -81,6 +185,122 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         commands.bind("default", "global", "key-down--alt--f", self.toggle_media, "Swap Shotgun Format Media")
         commands.bind("default", "global", "key-down--alt--s", self.toggle_slate, "Slate on/off")
         commands.bind("default", "global", "key-down--alt--h", self.toggle_handles, "Handles on/off")
+        commands.bind("default", "global", "key-down--alt--p", self.show_perf_report, "Romeo performance report")
+
+    def _setup_show(self):
+        """
+        Reads the preferences and the show config, and sets up everything
+        that depends on them, the first time it is needed. The show config
+        is loaded from a profile cached by path and mtime, so the ini file is
+        only parsed again once it changes.
+        """
+        if self._show_config is not None:
+            return
+        # preference changes are written once the event loop is idle
+        self._prefs = Preferences("romeo", call_soon)
+        cfg_path = self._retrieve_cfg_path()
+        self._show_config = ShowConfig.load(cfg_path, self._show_code,
+                                            os.path.join(self._prefs.support_dir, "profiles"))
+        # IH_ROMEO_LOG_LEVEL wins over the show's log_level
+        if not os.environ.get('IH_ROMEO_LOG_LEVEL') and self._show_option('log_level', None):
+            set_log_level(self._show_option('log_level', None))
+
+        if not self._perf_trace.enabled and self._show_option('perf_trace', 0, int):
+            self._perf_trace = PerfTrace(
+                True,
+                os.path.join(self._prefs.support_dir, "perf_trace.jsonl"),
+                self._show_option('perf_trace_max_bytes', 5 * 1024 * 1024, int)
+            )
+
+        # snapshots of the shot color directories, keyed by the resolved directory
+        # and revalidated against the directory mtime. If a prebuilt index is
+        # available, up to date entries are taken from it without listing anything
+        self._lut_index = LutIndex.open_existing(self._show_option('lut_index_path', None))
+        self._color_dir_cache = DirectorySnapshotCache(self._show_config.choose_lut, self._lut_index)
+
+        # local copies of the look LUT files, so readLUT doesn't go back to the filer
+        # every time a session is reloaded. Set lut_mirror_max_bytes to 0 to disable
+        lut_mirror_max_bytes = self._show_option('lut_mirror_max_bytes', 256 * 1024 * 1024, int)
+        if lut_mirror_max_bytes > 0:
+            self._lut_mirror = LutMirror(os.path.join(self._prefs.support_dir, "lut_cache"), lut_mirror_max_bytes)
+
+        # each look node records the fingerprint of the LUT it holds, and a LUT with
+        # the same contents isn't read into it again, eg. when the session is read
+        # again or color republishes an identical file. The fingerprints come from
+        # the LUT mirror, or are taken on the resolver pool, so resolving LUTs on the
+        # main thread without the mirror doesn't use them. Set lut_fingerprint to 0 to disable
+        if self._show_option('lut_fingerprint', 1, int):
+            self._lut_fingerprints = LutFingerprints()
+
+        if self._batch:
+            # rvio renders as soon as the sources are set up, so the look LUTs are
+            # applied right away rather than in the background or ahead of the playhead
+            self._load_job_luts()
+        # optionally resolve look LUTs on a pool of worker threads so a slow filer
+        # doesn't block the UI while a session loads
+        elif self._show_option('lut_resolver_mode', 'sync') == 'async':
+            if MainThreadQueue.available():
+                self._resolver_pool = ResolverPool(
+                    self._show_option('lut_resolver_threads', 4, int),
+                    self._show_option('lut_resolver_timeout', 30.0, float) or None
+                )
+            else:
+                self._logger.warning('Qt is not available, resolving look LUTs synchronously.')
+
+        # resolve look LUTs through the resolver service of the workstation
+        # (lut_resolver_service.py), which shares its caches with the other RV and
+        # rvio processes. LUTs are resolved in process while it isn't running
+        if self._show_option('lut_resolver_daemon', 0, int):
+            if ResolverClient.available():
+                self._resolver_client = ResolverClient(
+                    self._show_option('lut_resolver_socket', default_socket_path()),
+                    self._show_option('lut_resolver_timeout', 30.0, float)
+                )
+                # the main thread only waits this long for the service before resolving the
+                # LUTs itself, so a stuck service doesn't freeze the UI
+                self._resolver_main_thread_timeout = self._show_option(
+                    'lut_resolver_main_thread_timeout', 0.25, float)
+            else:
+                self._logger.warning('No Unix domain sockets, not using the LUT resolver service.')
+
+        # reload the look LUTs of the shots in the session when color publishes new ones.
+        # The color directories are stat'ed on a worker thread, on the resolver pool if
+        # there is one. Set lut_watch to 0 to disable
+        if self._show_option('lut_watch', 1, int) and not self._batch:
+            if LutWatcher.available():
+                watch_pool = self._resolver_pool or ResolverPool(
+                    1, self._show_option('lut_resolver_timeout', 30.0, float) or None)
+                self._lut_watcher = LutWatcher(self._color_dir_changed,
+                                               self._show_option('lut_watch_poll_interval', 30.0, float),
+                                               pool=watch_pool)
+            else:
+                self._logger.warning('Qt is not available, not watching for new look LUTs.')
+
+        # only resolve and read the look LUTs of the sources under and just ahead of
+        # the playhead, rather than all of them while the session loads. Set
+        # lut_prefetch to 1 to enable
+        if self._show_option('lut_prefetch', 0, int) and not self._batch:
+            self._lut_prefetcher = LutPrefetcher(
+                self._show_option('lut_prefetch_seconds', 10.0, float),
+                self._show_option('lut_prefetch_concurrency', 2, int)
+            )
+
+    def _load_job_luts(self):
+        """
+        Reads the look LUTs rvio_batch.py resolved for the whole job, from the
+        JSON file given with -flags romeo_lut_manifest=path or
+        IH_ROMEO_LUT_MANIFEST, so the rvio processes don't each go to the filer.
+        """
+        manifest = command_line_option("romeo_lut_manifest", "IH_ROMEO_LUT_MANIFEST")
+        if not manifest:
+            return
+        try:
+            with open(manifest) as handle:
+                job_luts = json.load(handle)
+        except (IOError, ValueError) as e:
+            self._logger.warning("Could not read the LUT manifest %s, resolving LUTs per source: %s", manifest, e)
+            return
+        self._job_luts = dict((file_name, tuple(look_luts)) for file_name, look_luts in job_luts.items())
 
     def source_setup_romeo(self, event, noColorChanges=False):
         """
@@ -97,65 +317,738 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         #  backs will occur.
 
         event.reject()
+
+        with self._perf_trace.span("source_setup") as span:
+            with self._perf_trace.span("group_lookup"):
+                args             = event.contents().split(";;")
+                group            = args[0]
+                action           = args[-1]
+                file_source      = group_member_of_type(group, "RVFileSource")
+                image_source     = group_member_of_type(group, "RVImageSource")
+                source           = file_source if image_source == None else image_source
+                lin_pipe_node    = group_member_of_type(group, "RVLinearizePipelineGroup")
+                lin_node         = group_member_of_type(lin_pipe_node, "RVLinearize")
+                look_pipe_node   = group_member_of_type(group, "RVLookPipelineGroup") 
+                file_names       = commands.getStringProperty("%s.media.movie" % source)
+            span.source = file_names[0] if file_names else group
+
+            with self._perf_trace.span("source_range"):
+                self._add_source_range(source, file_names)
+
+            # make sure our Display is forced to "No Correction"
+            with self._perf_trace.span("display"):
+                self._set_display_to_no_correction(event)
+
+            # Modify the Look Pipeline to account for both EXR and QT handling. We put the
+            # EXR nodes in the QT pipe and vice versa because there are menu items that depend
+            # on the nodes existing that will throw errors if they don't exist.  So we just
+            # manage which nodes are active for the particular source types rather than
+            # keeping them out of the pipe. The pipeline has to be set right away, since the
+            # nodes we look up below only exist once it is.
+            with self._perf_trace.span("pipeline"):
+                batch = PropertyBatch()
+                batch.set_string(
+                    "%s.pipeline.nodes" % look_pipe_node, 
+                    ["LinearToAlexaLogC", "RVLookLUT", "LinearToRec709"]
+                )
+                batch.flush()
+                alexa_node = group_member_of_type(look_pipe_node, "LinearToAlexaLogC")
+                look_node = group_member_of_type(look_pipe_node, "RVLookLUT")
+                rec709_node = group_member_of_type(look_pipe_node, "LinearToRec709")
+                self._pipeline_nodes[group] = {
+                    "RVImageSource" if image_source else "RVFileSource": source,
+                    "LinearToAlexaLogC": alexa_node,
+                    "RVLookLUT": look_node,
+                    "LinearToRec709": rec709_node,
+                }
+                self._current_nodes.clear()
+
+            # every file of the source shares the same nodes, so only the last EXR
+            # needs its look LUT read, and only the final value of each property
+            # needs to be written
+            exr_files = [file_name for file_name in file_names
+                         if os.path.splitext(file_name)[-1].lower() in [".exr", ".dpx"]]
+
+            for file_name in file_names:
+                # if the file is an exr or dpx, handle it accordingly,
+                # anything else we don't need to monkey with aside from
+                # making sure we force it to sRGB to account for
+                # "No Correction" in the display profile
+                if os.path.splitext(file_name)[-1].lower() in [".exr", ".dpx"]:
+                    # now disable our LinearToSRGB node since that's only
+                    # in the pipeline for non-EXR files
+                    batch.set_int("%s.node.active" % rec709_node, [0])
+                    self.do_exr_linearization(lin_node, batch)
+                    if file_name != exr_files[-1]:
+                        continue
+                    with self._perf_trace.span("show_setup"):
+                        self._setup_show()
+                    if self._lut_prefetcher is not None:
+                        self._defer_look_setup(look_node, alexa_node, file_name, batch)
+                    elif self._resolver_client is not None and not self._batch:
+                        self._queue_look_setup(look_node, alexa_node, file_name, batch)
+                    elif self._resolver_pool:
+                        self._submit_look_setup(look_node, alexa_node, file_name, batch)
+                    else:
+                        # the color directory snapshots are cached, so this only
+                        # goes back to the file system for a single stat when the
+                        # directory hasn't changed
+                        lcl_look_luts = self._retrieve_look_luts(file_name)
+                        self._apply_look(look_node, alexa_node, lcl_look_luts, batch)
+                        self._watch_look(look_node, alexa_node, file_name, lcl_look_luts)
+                else:
+                    # if we're not dealing with an EXR just make sure we
+                    # convert to sRGB to account for the forced display
+                    # profile
+                    batch.set_int("%s.node.active" % alexa_node, [0])
+                    batch.set_int("%s.lut.active" % look_node, [0])
+                    batch.set_int("%s.node.active" % rec709_node, [0])
+                    self._unwatch_look(look_node)
+                    self._forget_deferred_look(look_node)
+                    self._queued_looks.pop(look_node, None)
+                    self._pending_looks.pop(look_node, None)
+            with self._perf_trace.span("property_writes"):
+                batch.flush()
+            # only once the source's own property writes, which turn the look node off, are done
+            if look_node in self._deferred_looks:
+                self._schedule_prefetch()
+            elif look_node in self._queued_looks:
+                self._schedule_queued_looks()
+            if self._batch:
+                flush_lut_update()
+                
+    def _add_source_range(self, source, file_names):
+        """
+        Records the frame range of a new source in the source range index.
         
-        args             = event.contents().split(";;")
-        group            = args[0]
-        action           = args[-1]
-        file_source      = group_member_of_type(group, "RVFileSource")
-        image_source     = group_member_of_type(group, "RVImageSource")
-        source           = file_source if image_source == None else image_source
-        lin_pipe_node    = group_member_of_type(group, "RVLinearizePipelineGroup")
-        lin_node         = group_member_of_type(lin_pipe_node, "RVLinearize")
-        look_pipe_node   = group_member_of_type(group, "RVLookPipelineGroup") 
-        file_names       = commands.getStringProperty("%s.media.movie" % source)
-        
-        # make sure our Display is forced to "No Correction"
-        self._set_display_to_no_correction(event)
+        :param source: RVFileSource or RVImageSource node
+        :param file_names: media paths of the source
+        """
+        if not file_names:
+            return
+        try:
+            media_info = commands.sourceMediaInfo(source, None)
+        except Exception:
+            # the toggles look it up in commands.sources() later on
+            self._source_range_index.remove(source)
+            return
+        self._source_range_index.add(source, file_names[0], media_info['startFrame'], media_info['endFrame'])
+
+    def _submit_look_setup(self, look_node, alexa_node, file_name, batch=None):
+        """
+        Resolves the look LUT for a file on the resolver pool and applies it
+        back on the main thread. The look node stays inactive until then.
+        
+        :param look_node: RVLookLUT node for the source
+        :param alexa_node: LinearToAlexaLogC node for the source
+        :param str file_name: path of file being currently examined
+        :param batch: PropertyBatch collecting the source's property writes, None
+                      if the look node is already inactive
+        """
+        if batch is not None:
+            batch.set_int("%s.lut.active" % look_node, [0])
+        # lookups are coalesced per shot color directory, since all the
+        # files of a shot resolve to the same LUT anyway
+        key = self._retrieve_shot_color_dir(file_name) or file_name
+        token = object()
+        self._pending_looks[look_node] = token
+
+        def apply_look(result):
+            if self._pending_looks.get(look_node) is not token:
+                return
+            del self._pending_looks[look_node]
+            if self._lut_prefetcher is not None:
+                self._lut_prefetcher.staged(look_node)
+            look_luts, prepared = result or (None, None)
+            self._apply_look(look_node, alexa_node, look_luts, prepared=prepared)
+            self._watch_look(look_node, alexa_node, file_name, look_luts)
+
+        self._resolver_pool.submit(key, lambda: self._prepare_look_luts(file_name), apply_look)
+
+    def _defer_look_setup(self, look_node, alexa_node, file_name, batch):
+        """
+        Leaves the look LUT of a source for the prefetcher to stage once the
+        playhead gets close to it. The look node stays inactive until then.
         
-        # Modify the Look Pipeline to account for both EXR and QT handling. We put the
-        # EXR nodes in the QT pipe and vice versa because there are menu items that depend
-        # on the nodes existing that will throw errors if they don't exist.  So we just
-        # manage which nodes are active for the particular source types rather than
-        # keeping them out of the pipe.
-        commands.setStringProperty(
-            "%s.pipeline.nodes" % look_pipe_node, 
-            ["LinearToAlexaLogC", "RVLookLUT", "LinearToRec709"],
-            True
-        )
-        alexa_node = group_member_of_type(look_pipe_node, "LinearToAlexaLogC")
-        look_node = group_member_of_type(look_pipe_node, "RVLookLUT")
-        rec709_node = group_member_of_type(look_pipe_node, "LinearToRec709")
-        
-        for file_name in file_names:
-            # if the file is an exr or dpx, handle it accordingly,
-            # anything else we don't need to monkey with aside from
-            # making sure we force it to sRGB to account for
-            # "No Correction" in the display profile
-            if os.path.splitext(file_name)[-1].lower() in [".exr", ".dpx"]:
-                # check prefs to see if there's a saved directory to 
-                # look for shot cdls
-                # Use a dictionary instead of a string
-                lcl_file_base = os.path.basename(file_name).split('.')[0]
-                lcl_lut_path = None
+        :param look_node: RVLookLUT node for the source
+        :param alexa_node: LinearToAlexaLogC node for the source
+        :param str file_name: path of file being currently examined
+        :param batch: PropertyBatch collecting the source's property writes
+        """
+        batch.set_int("%s.lut.active" % look_node, [0])
+        # a lookup still running for the previous media of the source is stale
+        self._pending_looks.pop(look_node, None)
+        self._deferred_looks[look_node] = (alexa_node, file_name)
+        self._lut_prefetcher.add(look_node)
+        self._prefetch_timeline_dirty = True
+
+    def _queue_look_setup(self, look_node, alexa_node, file_name, batch):
+        """
+        Queues the look LUT of a source for the resolver service. The sources
+        set up in the same event loop tick, eg. all the ones of a session
+        being loaded, are resolved in a single request. The look node stays
+        inactive until then.
+        
+        :param look_node: RVLookLUT node for the source
+        :param alexa_node: LinearToAlexaLogC node for the source
+        :param str file_name: path of file being currently examined
+        :param batch: PropertyBatch collecting the source's property writes
+        """
+        batch.set_int("%s.lut.active" % look_node, [0])
+        self._pending_looks.pop(look_node, None)
+        self._queued_looks[look_node] = (alexa_node, file_name)
+
+    def _schedule_queued_looks(self):
+        """
+        Resolves the queued look LUTs once the event loop is idle.
+        """
+        if self._queued_flush_scheduled:
+            return
+        self._queued_flush_scheduled = True
+        call_soon(self._flush_queued_looks)
+
+    def _flush_queued_looks(self):
+        """
+        Resolves the queued look LUTs in one request to the resolver service,
+        on the resolver pool if there is one, and applies them.
+        """
+        self._queued_flush_scheduled = False
+        queued = self._queued_looks
+        self._queued_looks = {}
+        if not queued:
+            return
+        file_names = sorted(set(file_name for alexa_node, file_name in queued.values()))
+        token = object()
+        for look_node in queued:
+            self._pending_looks[look_node] = token
+
+        def apply_looks(results):
+            by_file = dict(zip(file_names, results or [(None, None)] * len(file_names)))
+            batch = PropertyBatch()
+            for look_node, (alexa_node, file_name) in queued.items():
+                if self._pending_looks.get(look_node) is not token:
+                    # deleted, or set up again since
+                    continue
+                del self._pending_looks[look_node]
+                look_luts, prepared = by_file[file_name]
+                self._apply_look(look_node, alexa_node, look_luts, batch, prepared)
+                self._watch_look(look_node, alexa_node, file_name, look_luts)
+            batch.flush()
+
+        if self._resolver_pool:
+            self._resolver_pool.submit(token, lambda: self._prepare_look_luts_many(file_names), apply_looks)
+        else:
+            apply_looks([(look_luts, None) for look_luts in
+                         self._retrieve_look_luts_many(file_names, self._resolver_main_thread_timeout)])
+
+    def _forget_deferred_look(self, look_node):
+        """
+        Drops a source from the prefetcher, eg. when it stops showing an EXR.
+        
+        :param look_node: RVLookLUT node for the source
+        """
+        if self._lut_prefetcher is None:
+            return
+        self._deferred_looks.pop(look_node, None)
+        self._pending_looks.pop(look_node, None)
+        self._lut_prefetcher.discard(look_node)
+        self._prefetch_timeline_dirty = True
+
+    def _stage_look(self, look_node):
+        """
+        Resolves and reads the look LUT of a source left to the prefetcher,
+        on the resolver pool if there is one.
+        
+        :param look_node: RVLookLUT node for the source
+        """
+        deferred = self._deferred_looks.pop(look_node, None)
+        if deferred is None:
+            # already being staged
+            return
+        alexa_node, file_name = deferred
+        if self._resolver_pool:
+            self._submit_look_setup(look_node, alexa_node, file_name)
+            return
+        with self._perf_trace.span("lut_prefetch", source=file_name):
+            look_luts = self._retrieve_look_luts(file_name, self._resolver_main_thread_timeout)
+            self._lut_prefetcher.staged(look_node)
+            self._apply_look(look_node, alexa_node, look_luts)
+            self._watch_look(look_node, alexa_node, file_name, look_luts)
+
+    def _schedule_prefetch(self):
+        """
+        Runs the prefetcher once the event loop is idle, so sources loaded
+        under the playhead get their look LUT without waiting for the frame
+        to change. A whole session loading only schedules it once.
+        """
+        if self._prefetch_scheduled:
+            return
+        self._prefetch_scheduled = True
+
+        def prefetch():
+            self._prefetch_scheduled = False
+            # the playhead didn't move, the sources under it can't be misses
+            self._prefetch_looks(count_misses=False)
+
+        call_soon(prefetch)
+
+    def _prefetch_looks(self, count_misses=True):
+        """
+        Stages the deferred look LUTs of the sources under the playhead right
+        away, and those of the sources coming up within lut_prefetch_seconds
+        ahead of it, lut_prefetch_concurrency at a time. Without the resolver
+        pool, that is the number staged at most on each frame change.
+        
+        :param count_misses: whether sources reached before being staged count as misses
+        """
+        if self._lut_prefetcher is None or not len(self._lut_prefetcher):
+            return
+        if self._prefetch_timeline_dirty:
+            self._update_prefetch_timeline()
+        frame = commands.frame()
+        for look_node in self._lut_prefetcher.arrive(frame, count_misses):
+            # the playhead got there first
+            self._lut_prefetcher.start(look_node)
+            self._stage_look(look_node)
+        for look_node in self._lut_prefetcher.next_batch(frame, commands.fps()):
+            self._stage_look(look_node)
+
+    def _update_prefetch_timeline(self):
+        """
+        Tells the prefetcher where the sources of the current view are on the
+        timeline. A sequence plays them at the frames its EDL gives them, any
+        other view shows them at their own frames, from the cut in to the cut
+        out the slate and handles toggles set.
+        """
+        self._prefetch_timeline_dirty = False
+        view_node = commands.viewNode()
+        if view_node in self._pipeline_nodes or commands.nodeType(view_node) == "RVSourceGroup":
+            source_groups = [view_node]
+        else:
+            source_groups = commands.nodeConnections(view_node, False)[0]
+        # (first frame, last frame) of the media each input plays, and its look node
+        inputs = []
+        for source_group in source_groups:
+            nodes = self._source_nodes(source_group)
+            source = nodes and (nodes.get("RVFileSource") or nodes.get("RVImageSource"))
+            entry = self._source_range_index.get(source) if source else None
+            if entry is None:
+                inputs.append(None)
+                continue
+            # the cut is unbounded (+/- max int) until the slate or handles are toggled
+            cut_in = max(commands.getIntProperty("%s.cut.in" % source)[0], entry.start)
+            cut_out = min(commands.getIntProperty("%s.cut.out" % source)[0], entry.end)
+            inputs.append((cut_in, max(cut_out, cut_in), nodes["RVLookLUT"]))
+        if commands.nodeType(view_node) == "RVSequenceGroup":
+            entries = self._sequence_timeline(view_node, inputs)
+        else:
+            entries = [entry for entry in inputs if entry is not None]
+        self._lut_prefetcher.set_timeline(entries)
+
+    def _sequence_timeline(self, sequence_group, inputs):
+        """
+        Returns the (first frame, last frame, look node) entries of the
+        sources of a sequence, at the global frames of its EDL.
+        
+        :param sequence_group: RVSequenceGroup node being viewed
+        :param inputs: (cut in, cut out, look node) of each input of the sequence, None if not ours
+        """
+        sequence_node = group_member_of_type(sequence_group, "RVSequence")
+        if sequence_node is None or not commands.propertyExists("%s.edl.frame" % sequence_node):
+            # no EDL to go by, the inputs play one after the other from frame 1
+            entries = []
+            position = 1
+            for entry in inputs:
+                if entry is not None:
+                    length = entry[1] - entry[0] + 1
+                    entries.append((position, position + length - 1, entry[2]))
+                    position += length
+            return entries
+        frames = commands.getIntProperty("%s.edl.frame" % sequence_node)
+        sources = commands.getIntProperty("%s.edl.source" % sequence_node)
+        entries = []
+        # the last edit only marks the end of the sequence
+        for index in range(min(len(frames) - 1, len(sources))):
+            source_index = sources[index]
+            if 0 <= source_index < len(inputs) and inputs[source_index] is not None:
+                entries.append((frames[index], max(frames[index + 1] - 1, frames[index]),
+                                inputs[source_index][2]))
+        return entries
+
+    def _source_nodes(self, source_group):
+        """
+        Returns {node type: node} for the source and look pipeline nodes of a
+        source group, like source_setup_romeo records them, looking them up in
+        the graph again if they were evicted. None if it has no look pipeline.
+
+        :param source_group: RVSourceGroup node
+        """
+        nodes = self._pipeline_nodes.get(source_group)
+        if nodes is not None:
+            return nodes
+        look_pipe_node = group_member_of_type(source_group, "RVLookPipelineGroup")
+        look_node = group_member_of_type(look_pipe_node, "RVLookLUT") if look_pipe_node else None
+        if look_node is None:
+            return None
+        image_source = group_member_of_type(source_group, "RVImageSource")
+        nodes = {
+            "RVImageSource" if image_source else "RVFileSource":
+                image_source or group_member_of_type(source_group, "RVFileSource"),
+            "LinearToAlexaLogC": group_member_of_type(look_pipe_node, "LinearToAlexaLogC"),
+            "RVLookLUT": look_node,
+            "LinearToRec709": group_member_of_type(look_pipe_node, "LinearToRec709"),
+        }
+        self._pipeline_nodes[source_group] = nodes
+        return nodes
+
+    def prefetch_stats(self):
+        """
+        Returns the hit, miss and prefetch counters of the look LUT
+        prefetcher, for monitoring. None if the prefetcher is disabled.
+        """
+        if self._lut_prefetcher is None:
+            return None
+        return self._lut_prefetcher.stats()
+
+    def _watch_look(self, look_node, alexa_node, file_name, look_luts):
+        """
+        Registers a source with the LUT watcher, so its look LUT is reloaded
+        when a new one is published into its shot color directory.
+        
+        :param look_node: RVLookLUT node for the source
+        :param alexa_node: LinearToAlexaLogC node for the source
+        :param str file_name: path of the file the look LUT was picked for
+        :param look_luts: (look LUT path, baked LUT path) tuple the source got, or None
+        """
+        if self._lut_watcher is None:
+            return
+        entity = self._show_config.classify(file_name)
+        if entity is None:
+            return
+        color_dir = self._show_config.color_dir_for(entity[3])
+        if self._look_color_dirs.get(look_node) != color_dir:
+            self._unwatch_look(look_node)
+        self._watched_looks.setdefault(color_dir, {})[look_node] = (alexa_node, file_name)
+        self._look_color_dirs[look_node] = color_dir
+        self._lut_watcher.watch(color_dir, [path for path in (look_luts or ()) if path])
+
+    def _unwatch_look(self, look_node):
+        """
+        Stops reloading the look LUT of a source, and stops watching its
+        color directory once no other source needs it.
+        
+        :param look_node: RVLookLUT node for the source
+        """
+        color_dir = self._look_color_dirs.pop(look_node, None)
+        if color_dir is None:
+            return
+        looks = self._watched_looks.get(color_dir, {})
+        looks.pop(look_node, None)
+        if not looks:
+            self._watched_looks.pop(color_dir, None)
+            if self._lut_watcher is not None:
+                self._lut_watcher.unwatch(color_dir)
+
+    def _color_dir_changed(self, color_dir):
+        """
+        Called by the LUT watcher when something was published into a shot
+        color directory. Picks the look LUT again and reloads it into the look
+        nodes of the sources of that shot, and only those.
+        
+        :param color_dir: shot color directory that changed
+        """
+        looks = self._watched_looks.get(color_dir)
+        if not looks:
+            return
+        self._color_dir_cache.invalidate(color_dir)
+        file_name = list(looks.values())[0][1]
+        if self._resolver_client is not None:
+            try:
+                self._resolver_client.invalidate(self._show_config.cfg_path, self._show_code, color_dir,
+                                                 self._resolver_main_thread_timeout)
+            except ResolverUnavailable:
+                pass
+
+        def reload_looks(result):
+            look_luts, prepared = result or (None, None)
+            if look_luts is None:
+                # the lookup failed or timed out, rather than finding no LUT
+                self._logger.warning('Unable to pick the look LUT again from %s, keeping the current one',
+                                     color_dir)
+                return
+            looks = self._watched_looks.get(color_dir, {})
+            self._logger.info('Reloading the look LUT of %d sources from %s', len(looks), color_dir)
+            with self._perf_trace.span("lut_reload", source=color_dir):
+                batch = PropertyBatch()
+                for look_node, (alexa_node, file_name) in list(looks.items()):
+                    if not commands.nodeExists(look_node):
+                        self._unwatch_look(look_node)
+                        continue
+                    look_on = commands.getIntProperty("%s.lut.active" % look_node)[0]
+                    self._apply_look(look_node, alexa_node, look_luts, batch, prepared)
+                    if not look_on or not any(look_luts):
+                        # the LUT was turned off with toggle_look, leave it off, and the
+                        # old LUT doesn't stay on once the directory has none
+                        batch.set_int("%s.lut.active" % look_node, [0])
+                batch.flush()
+            if looks and self._lut_watcher is not None:
+                self._lut_watcher.watch(color_dir, [path for path in look_luts if path])
+
+        if self._resolver_pool:
+            # a key of its own, so the reload isn't attached to a setup lookup of the
+            # same directory started before the publish
+            self._resolver_pool.submit(("reload", color_dir), lambda: self._prepare_look_luts(file_name),
+                                       reload_looks)
+        else:
+            reload_looks((self._retrieve_look_luts(file_name, self._resolver_main_thread_timeout), None))
+
+    def _retrieve_look_luts(self, file_name, timeout=None):
+        """
+        Returns the look LUT of a file along with its baked version, the
+        latter being None if there isn't an up to date one.
+        
+        :param str file_name: path of file being currently examined
+        :param timeout: seconds to wait for the resolver service, None for lut_resolver_timeout
+        """
+        return self._retrieve_look_luts_many([file_name], timeout)[0]
+
+    def _retrieve_look_luts_many(self, file_names, timeout=None):
+        """
+        Returns the look LUTs of several files like _retrieve_look_luts, in a
+        single round trip when the resolver service is used. They are resolved
+        in process if the service doesn't answer within the timeout.
+        
+        :param file_names: paths of the files being examined
+        :param timeout: seconds to wait for the resolver service, None for lut_resolver_timeout
+        """
+        if self._job_luts and all(file_name in self._job_luts for file_name in file_names):
+            return [self._job_luts[file_name] for file_name in file_names]
+        results = None
+        if self._resolver_client is not None:
+            with self._perf_trace.span("resolve_lut_service", source=file_names[0]):
                 try:
-                    lcl_lut_path = self._look_lut_dict[lcl_file_base]
-                except KeyError:
-                    lcl_lut_path = self._retrieve_csp_path(file_name)
-                    self._look_lut_dict[lcl_file_base] = lcl_lut_path
-
-                # now disable our LinearToSRGB node since that's only
-                # in the pipeline for non-EXR files
-                commands.setIntProperty("%s.node.active" % rec709_node, [0], True)
-                self.do_exr_linearization(lin_node)
-                self.do_exr_look_setup(look_node, lcl_lut_path)
-            else:
-                # if we're not dealing with an EXR just make sure we
-                # convert to sRGB to account for the forced display
-                # profile
-                commands.setIntProperty("%s.node.active" % alexa_node, [0], True)
-                commands.setIntProperty("%s.lut.active" % look_node, [0], True)
-                commands.setIntProperty("%s.node.active" % rec709_node, [0], True)
-                
+                    results = self._resolver_client.resolve_many(self._show_config.cfg_path, self._show_code,
+                                                                  file_names, timeout)
+                except ResolverUnavailable:
+                    # the client logs why, and won't try again for a while
+                    pass
+        if results is None:
+            results = [self._resolve_look_luts(file_name) for file_name in file_names]
+        return results
+
+    def _prepare_look_luts(self, file_name):
+        """
+        Returns the look LUTs of a file like _retrieve_look_luts, along with
+        the LUT to read prepared, see _prepare_look_luts_many.
+        
+        :param str file_name: path of file being currently examined
+        """
+        return self._prepare_look_luts_many([file_name])[0]
+
+    def _prepare_look_luts_many(self, file_names):
+        """
+        Returns a (look LUTs, prepared LUT) pair for each of several files,
+        the look LUTs as _retrieve_look_luts_many returns them and the LUT to
+        read as _prepare_lut returns it. Runs on the resolver pool, so that
+        the main thread doesn't copy or hash the LUTs off the filer.
+        
+        :param file_names: paths of the files being examined
+        """
+        prepared = {}
+        results = []
+        for look_luts in self._retrieve_look_luts_many(file_names):
+            look_path, baked_path = look_luts or (None, None)
+            lut_path = baked_path or look_path
+            if lut_path and lut_path not in prepared:
+                prepared[lut_path] = self._prepare_lut(lut_path, True)
+            results.append((look_luts, prepared.get(lut_path)))
+        return results
+
+    def _resolve_look_luts(self, file_name):
+        """
+        Resolves the look LUTs of a file in process, see _retrieve_look_luts.
+        
+        :param str file_name: path of file being currently examined
+        """
+        with self._perf_trace.span("resolve_lut", source=file_name, filesystem=True):
+            look_path = self._retrieve_csp_path(file_name)
+            return look_path, self._retrieve_baked_lut(look_path)
+
+    def _retrieve_baked_lut(self, look_path):
+        """
+        Looks up the LUT lut_bake.py baked out of a look LUT in the index. The
+        bake is only used if it was made from the current version of the LUT.
+        
+        :param look_path: path of the look LUT
+        """
+        if not look_path or self._lut_index is None or not self._show_option('use_baked_luts', 1, int):
+            return None
+        baked = self._lut_index.lookup_baked(look_path)
+        if baked is None:
+            return None
+        try:
+            look_mtime = os.stat(look_path).st_mtime
+        except OSError:
+            return None
+        if baked.lut_mtime != look_mtime:
+            self._logger.info('Ignoring stale baked LUT %s', baked.baked_path, extra={'source': look_path})
+            return None
+        return baked.baked_path
+
+    def _apply_look(self, look_node, alexa_node, look_luts, batch=None, prepared=None):
+        """
+        Loads the look LUT of a source, preferring its baked version. A baked
+        LUT already does the LogC encode, so the LinearToAlexaLogC node is
+        turned off for it, and back on once the source gets a regular LUT.
+        
+        :param look_node: RVLookLUT node for the source
+        :param alexa_node: LinearToAlexaLogC node for the source
+        :param look_luts: (look LUT path, baked LUT path) tuple, or None
+        :param batch: PropertyBatch to add the writes to, written right away if None
+        :param prepared: the LUT to read as _prepare_lut returned it, None to prepare it here
+        """
+        look_path, baked_path = look_luts or (None, None)
+        lcl_batch = batch if batch is not None else PropertyBatch()
+        if baked_path:
+            lcl_batch.set_int("%s.node.active" % alexa_node, [0])
+            self._baked_looks.add(look_node)
+            self.do_exr_look_setup(look_node, baked_path, lcl_batch, prepared)
+        else:
+            if look_node in self._baked_looks:
+                lcl_batch.set_int("%s.node.active" % alexa_node, [1])
+                self._baked_looks.discard(look_node)
+            self.do_exr_look_setup(look_node, look_path, lcl_batch, prepared)
+        if batch is None:
+            lcl_batch.flush()
+
+    def _show_option(self, option, default, convert=str):
+        """
+        Returns an optional setting from the show section of the config
+        file, or the default if the show doesn't set it.
+        
+        :param str option: name of the option in the show section
+        :param default: value to use when the option isn't set
+        :param convert: callable used to convert the string value
+        """
+        self._setup_show()
+        return self._show_config.option(option, default, convert)
+
+    def _source_removed(self, event):
+        """
+        Releases everything we keep around for a source that is about to
+        be deleted.
+        
+        :param event: event passed in from RV, its contents is the source node
+        """
+        event.reject()
+        self._source_range_index.remove(event.contents())
+        self._current_nodes.clear()
+        source_group = commands.nodeGroup(event.contents())
+        look_node = self._pipeline_nodes.pop(source_group, {}).get("RVLookLUT")
+        if look_node is None:
+            look_pipe_node = group_member_of_type(source_group, "RVLookPipelineGroup")
+            if look_pipe_node is None:
+                return
+            look_node = group_member_of_type(look_pipe_node, "RVLookLUT")
+        self._baked_looks.discard(look_node)
+        self._unwatch_look(look_node)
+        self._forget_deferred_look(look_node)
+        self._queued_looks.pop(look_node, None)
+        self._pending_looks.pop(look_node, None)
+
+    def _session_cleared(self, event):
+        """
+        Releases everything we keep around for the sources of the session.
+        
+        :param event: event passed in from RV
+        """
+        event.reject()
+        self._perf_trace.end_session()
+        self._baked_looks.clear()
+        self._source_range_index.clear()
+        self._pipeline_nodes.clear()
+        self._current_nodes.clear()
+        self._display_nodes = None
+        self._drifted_displays.clear()
+        self._watched_looks.clear()
+        self._look_color_dirs.clear()
+        if self._lut_watcher is not None:
+            self._lut_watcher.clear()
+        self._deferred_looks.clear()
+        self._queued_looks.clear()
+        self._pending_looks.clear()
+        self.lut_loads = 0
+        self.lut_loads_avoided = 0
+        self._prefetch_timeline_dirty = True
+        if self._lut_prefetcher is not None:
+            self._lut_prefetcher.clear()
+
+    def _frame_changed(self, event):
+        """
+        Stages the look LUTs of the sources coming up.
+        
+        :param event: event passed in from RV
+        """
+        event.reject()
+        self._prefetch_looks()
+
+    def _view_changed(self, event):
+        """
+        Lays the sources of the new view out for the prefetcher.
+        
+        :param event: event passed in from RV
+        """
+        event.reject()
+        self._prefetch_timeline_dirty = True
+        # the sources the new view shows had no chance to be staged
+        self._prefetch_looks(count_misses=False)
+
+    def _graph_state_changed(self, event):
+        """
+        Forgets which nodes belong to the sources once the nodes of a
+        pipeline change, and where the sources are once the EDL of a sequence
+        does. Any other property, eg. a LUT turned on or off like toggle_look
+        does, leaves them as they are.
+        
+        :param event: event passed in from RV, its contents is the property that changed
+        """
+        event.reject()
+        prop = event.contents()
+        if self._current_nodes and prop.endswith(".pipeline.nodes"):
+            self._current_nodes.clear()
+        if prop.endswith(".edl.frame"):
+            # a sequence was edited, its sources moved on the timeline
+            self._prefetch_timeline_dirty = True
+        if self._display_nodes and not self._writing_displays and \
+                (prop.endswith(".color.sRGB") or prop.endswith(".color.Rec709")):
+            # someone changed a display we've set up, it gets set back with the next source
+            display_node = prop.split(".", 1)[0]
+            if display_node in self._display_nodes:
+                self._drifted_displays.add(display_node)
+
+    def _node_created(self, event):
+        """
+        Keeps track of the display nodes created after the session was scanned.
+        
+        :param event: event passed in from RV, its contents is the new node
+        """
+        event.reject()
+        if self._display_nodes is None:
+            return
+        node = event.contents()
+        if commands.nodeExists(node) and commands.nodeType(node) == "RVDisplayColor":
+            self._drifted_displays.add(node)
+
+    def _session_read(self, event):
+        """
+        Sets every display of the newly read session to No Correction.
+        
+        :param event: event passed in from RV
+        """
+        event.reject()
+        self._display_nodes = None
+        self._set_display_to_no_correction(event)
+
     def _set_display_to_no_correction(self, event):
         """
         Makes sure we have No Correction set in the View menu by
@@ -163,37 +1056,59 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         
         This is less confusing for users than setting up a display
         profile, so we do this here.
+        
+        Every display node is only set up once, after that only the ones
+        created or changed since the last call are looked at.
         """
-        display_nodes = commands.nodesOfType("RVDisplayColor")
+        if self._display_nodes is None:
+            self._display_nodes = set(commands.nodesOfType("RVDisplayColor"))
+            display_nodes = list(self._display_nodes)
+            self._drifted_displays.clear()
+        else:
+            display_nodes = [display_node for display_node in self._drifted_displays
+                             if commands.nodeExists(display_node)]
+            self._display_nodes.update(display_nodes)
+            self._drifted_displays.clear()
+        # the displays we already know to be set up don't need anything
+        self.display_writes_avoided += 2 * (len(self._display_nodes) - len(display_nodes))
+        if not display_nodes:
+            return
+        batch = PropertyBatch()
         for display_node in display_nodes:
-            commands.setIntProperty("%s.color.sRGB" % display_node, [0], True)
-            commands.setIntProperty("%s.color.Rec709" % display_node, [0], True)
+            batch.set_int("%s.color.sRGB" % display_node, [0])
+            batch.set_int("%s.color.Rec709" % display_node, [0])
+        self._writing_displays = True
+        try:
+            written = batch.flush()
+        finally:
+            self._writing_displays = False
+        self.display_writes += written
+        self.display_writes_avoided += 2 * len(display_nodes) - written
                 
     def _retrieve_cfg_path(self):
         """
-        Obtains a saved path from Preferences or asks the user which
-        path should be used and saves it for future use.
+        Obtains a saved path from Preferences, or from the environment, or
+        asks the user which path should be used, and saves it for future use.
         """
-        prefs = Preferences("romeo")
+        if self._batch:
+            return self._retrieve_batch_cfg_path()
+        prefs = self._prefs
         show_cfg_file = prefs.retrieve("show_cfg_file")
-        while not show_cfg_file:
+        if not show_cfg_file:
             try:
                 show_cfg_file = os.environ['IH_SHOW_CFG_PATH']
             except KeyError:
                 self._logger.warning('Environment variable IH_SHOW_CFG_PATH is not defined.')
+        while not show_cfg_file or not os.path.exists(show_cfg_file):
+            if show_cfg_file:
+                # if we can't see the path, ask for it again
+                self._logger.warning("Chosen Romeo config file does not exist on disk, choose again.")
             # if there's not a file path set for the file lut,
             # pop up a dialog to ask for one
-            show_cfg_file = commands.openFileDialog(False, False, False, '*', '/Volumes/romeo_inhouse/romeo/SHARED/romeo/lib/')
-            if show_cfg_file and not os.path.exists(show_cfg_file[0]):
-                # if we can't see the path, reset the path so
-                # that we can ask for it again
-                self._logger.warning("Chosen Romeo config file does not exist on disk, choose again.")
-                show_cfg_file = None
-            else:
-                # otherwise store the preference so we don't
-                # have to find the path again next time
-                prefs.store("show_cfg_file", show_cfg_file[0])
-                shot_cdl_path = show_cfg_file[0]
+            chosen = commands.openFileDialog(False, False, False, '*', '/Volumes/romeo_inhouse/romeo/SHARED/romeo/lib/')
+            show_cfg_file = chosen[0] if chosen else None
+        # store the preference so we don't have to find the path again next time
+        prefs.store("show_cfg_file", show_cfg_file)
         show_code = prefs.retrieve("show_code")
         while not show_code:
             # get the show code if it exists in the environment
@@ -206,100 +1121,84 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         self._show_code = show_code
         return show_cfg_file
     
-    def _retrieve_csp_path(self, file_name):
+    def _retrieve_batch_cfg_path(self):
         """
-        Checks the file system for a shot cdl, raises warnings if not
-        found.
+        Obtains the show config and show code in batch mode, from -flags
+        romeo_show_cfg=path romeo_show_code=code or else the environment,
+        without looking at or storing the preferences of interactive sessions.
+        """
+        show_cfg_file = command_line_option("romeo_show_cfg", "IH_SHOW_CFG_PATH")
+        if not show_cfg_file or not os.path.exists(show_cfg_file):
+            # better no render at all than one without the show's color
+            raise RuntimeError("No Romeo config file to render with: pass -flags romeo_show_cfg=path "
+                               "or set IH_SHOW_CFG_PATH (got %r)" % show_cfg_file)
+        self._show_code = command_line_option("romeo_show_code", "IH_SHOW_CODE")
+        if not self._show_code:
+            self._logger.warning('Environment variable IH_SHOW_CODE is not defined. Hard-coding to romeo...')
+            self._show_code = 'romeo'
+        return show_cfg_file
+
+    def _retrieve_shot_color_dir(self, file_name):
+        """
+        Works out the color directory of the shot or sequence a file belongs
+        to, without touching the file system.
         
         :param str file_name: path of file being currently examined
         """
+        self._setup_show()
         # if we don't have a shot name, no need to set up a cdl
         if not file_name:
             self._logger.warning("Method argument file_name is set to None.")
             return
-        if not os.path.exists(os.path.dirname(file_name)):
-            self._logger.warning("Not sure how this happened, but looks like we were called with a file_name parameter that doesn't exist.")
-            self._logger.warning("Unable to find %s on filesystem."%file_name)
-            return
-
-        # are we on the In-house shot tree?
-        lcl_show_root = self._production_root
-        if file_name.startswith(self._inhouse_root):
-            lcl_show_root = self._inhouse_root
 
-        # basename of file
-        lcl_file_base = os.path.basename(file_name)
-        lcl_shot = None
-        lcl_sequence = None
-        lcl_entity_dir = None
         # Are we a shot, sequence, or nothing at all?
-        shot_match = self._shot_regexp.search(lcl_file_base)
-        sequence_match = self._sequence_regexp.search(lcl_file_base)
-        if shot_match:
-            lcl_shot = shot_match.groupdict()['shot']
-            lcl_sequence = shot_match.groupdict()['sequence']
-            lcl_entity_dir = self._shot_dir_format.format(show_root = lcl_show_root, pathsep = os.path.sep, sequence = lcl_sequence, shot = lcl_shot)
-        else:
-            if sequence_match:
-                lcl_shot = 'SHARED'
-                lcl_sequence = sequence_match.groupdict()['sequence']
-                lcl_entity_dir = self._shot_dir_format.format(show_root=lcl_show_root, pathsep=os.path.sep,
-                                                              sequence=lcl_sequence, shot=lcl_shot)
-            else:
-                self._logger.warning('File name %s does not match the pattern for either a sequence or a shot.' % lcl_file_base)
-                return
+        with self._perf_trace.span("classify"):
+            entity = self._show_config.classify(file_name)
+        if entity is None:
+            self._logger.warning('File name %s does not match the pattern for either a sequence or a shot.',
+                                 os.path.basename(file_name), extra={'source': file_name})
+            return
+        shot_root_dir = entity[3]
+        self._logger.debug('Entity root directory: %s', shot_root_dir, extra={'source': file_name})
+        shot_color_dir = self._show_config.color_dir_for(shot_root_dir)
+        self._logger.debug('Entity color directory: %s', shot_color_dir, extra={'source': file_name})
+        return shot_color_dir
 
-        shot_root_dir = lcl_entity_dir
-        self._logger.info('Entity root directory: %s'%shot_root_dir)
-        shot_color_dir = os.path.join(shot_root_dir, self._shot_color_dir)
-        self._logger.info('Entity color directory: %s'%shot_color_dir)
-        if not os.path.exists(shot_color_dir):
-            self._logger.warning('Entity color directory %s does not exist.'%shot_color_dir)
+    def _retrieve_csp_path(self, file_name):
+        """
+        Checks the file system for a shot cdl, raises warnings if not
+        found. The listing of the shot color directory is cached and only
+        refreshed when the directory's mtime changes.
+        
+        :param str file_name: path of file being currently examined
+        """
+        self._setup_show()
+        with self._perf_trace.span("media_dir", filesystem=True):
+            media_dir_exists = not file_name or os.path.exists(os.path.dirname(file_name))
+        if not media_dir_exists:
+            self._logger.warning("Unable to find the directory of %s on filesystem.", file_name,
+                                 extra={'source': file_name})
             return
-        if not os.path.isdir(shot_color_dir):
-            self._logger.warning('Entity color directory %s is not a directory.'%shot_color_dir)
+        shot_color_dir = self._retrieve_shot_color_dir(file_name)
+        if not shot_color_dir:
             return
 
+        with self._perf_trace.span("color_dir", filesystem=True):
+            snapshot = self._color_dir_cache.get(shot_color_dir)
+        if snapshot is None:
+            self._logger.warning('Entity color directory %s does not exist or is not a directory.', shot_color_dir,
+                                 extra={'source': file_name})
+            return
 
-        # check to see if there's a shot CDL file that can be applied by looking
-        # for a parent directory named after the shot and checking for a cc file
-        cc_files = glob.glob(os.path.join(shot_color_dir, '*'))
-        csp_files = []
-        cube_files = []
-        for file_name in cc_files:
-            if os.path.splitext(file_name)[-1].lower() == '.cube':
-                cube_files.append(file_name)
-            elif os.path.splitext(file_name)[-1].lower() == '.csp':
-                csp_files.append(file_name)
-                    
         # if we didn't find a cdl file, warn the user and disable the node
-        if len(csp_files) == 0 and len(cube_files) == 0:
-            self._logger.warning("No CC files found in: %s, disabling per shot LUT" % shot_color_dir)
+        if not snapshot.choice:
+            self._logger.warning("No CC files found in: %s, disabling per shot LUT", shot_color_dir,
+                                 extra={'source': file_name})
             return
-        
-        # on the off chance there's more than one cdl sort by modified time so we use
-        # the latest
-        csp_files.sort(key=lambda x: os.stat(x).st_mtime, reverse=True)
-        cube_files.sort(key=lambda x: os.stat(x).st_mtime, reverse=True)
-        likely_lut = None
-        # for csp_file in csp_files:
-        #     if self._mainplate_regexp.search(csp_file):
-        #         likely_lut = csp_file
-        #         break
-        if not likely_lut and len(csp_files) > 0:
-            likely_lut = csp_files[0]
-
-        if not likely_lut:
-            for cube_file in cube_files:
-                if self._mainplate_regexp.search(cube_file):
-                    likely_lut = cube_file
-                    break
-        if not likely_lut and len(cube_files) > 0:
-            likely_lut = cube_files[0]
-
-        self._logger.info('Likely LUT file: %s'%likely_lut)
-        return likely_lut
-    
+
+        self._logger.debug('Likely LUT file: %s', snapshot.choice, extra={'source': file_name})
+        return snapshot.choice
+
     def _get_node_for_source(self, node_type):
         """
         Finds the node of the given type for the currently viewed
@@ -307,18 +1206,28 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         
         :param str node_type: RV node type, eg. RVColor, RVCDL
         """
-        # first find the source for the frame we're currently viewing
-        frame = commands.frame()
-        # file_source = None
-        for source in extra_commands.nodesInEvalPath(frame, "RVFileSource", None):
-            file_source = source
-            continue
+        # first find the source for the frame we're currently viewing, RV knows
+        # which sources of the view are under the playhead without walking the graph
+        file_source = None
+        for source in commands.sourcesAtFrame(commands.frame()):
+            if commands.nodeType(source) == "RVFileSource":
+                file_source = source
+        if file_source is None:
+            return None
+        key = (file_source, node_type)
+        if key in self._current_nodes:
+            return self._current_nodes[key]
 
         source_group = commands.nodeGroup(file_source)
         
-        # now find the node of the given type for that source
-        pipe_node  = group_member_of_type(source_group, "RVLookPipelineGroup")
-        return group_member_of_type(pipe_node, node_type)
+        # now find the node of the given type for that source, source_setup_romeo
+        # already knows the nodes of the sources it has set up
+        node = self._pipeline_nodes.get(source_group, {}).get(node_type)
+        if node is None:
+            pipe_node  = group_member_of_type(source_group, "RVLookPipelineGroup")
+            node = group_member_of_type(pipe_node, node_type)
+        self._current_nodes[key] = node
+        return node
 
     ###################
     #
@@ -326,7 +1235,7 @@ class RomeoSourceSetup(rvtypes.MinorMode):
     #
     ###################
 
-    def do_exr_linearization(self, lin_node):
+    def do_exr_linearization(self, lin_node, batch=None):
         """
         Makes sure the linearization setting is turned OFF.  In order
         to make sure that happens correctly, we need to set more than
@@ -335,47 +1244,192 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         should be sufficient for all edge cases.
         
         :param lin_node: RVLinearize node for the source
+        :param batch: PropertyBatch to add the writes to, written right away if None
         """
-        self._logger.info("Set linearize node to 'No Linearization'")
-        commands.setIntProperty("%s.color.logtype" % lin_node, [0], True)
-        commands.setIntProperty("%s.color.sRGB2linear" % lin_node, [0], True)
+        self._logger.debug("Set linearize node %s to 'No Linearization'", lin_node)
+        lcl_batch = batch if batch is not None else PropertyBatch()
+        lcl_batch.set_int("%s.color.logtype" % lin_node, [0])
+        lcl_batch.set_int("%s.color.sRGB2linear" % lin_node, [0])
+        if batch is None:
+            lcl_batch.flush()
 
-    def do_exr_look_setup(self, look_node, look_path):
+    def _prepare_lut(self, look_path, hash_lut=False):
+        """
+        Works out where readLUT reads a look LUT from, and what identifies its
+        contents. Returns a (local path, fingerprint) pair, the fingerprint
+        being None if it isn't known. None if the LUT doesn't exist. A mirror
+        miss copies the whole LUT off the filer, so this runs on the resolver
+        pool when there is one.
+        
+        :param look_path: path of the look LUT
+        :param hash_lut: whether to hash the LUT when the mirror is off, rather
+                         than only take its cached fingerprint
+        """
+        with self._perf_trace.span("lut_mirror", filesystem=True):
+            if self._lut_mirror:
+                # read the LUT from its local copy rather than straight off the filer,
+                # the copies are named after their contents so the path identifies them
+                local_path = self._lut_mirror.local_path(look_path)
+                if not local_path:
+                    return None
+            else:
+                try:
+                    st = os.stat(look_path)
+                except OSError:
+                    return None
+                local_path = look_path
+        fingerprint = None
+        if self._lut_fingerprints is not None:
+            if self._lut_mirror:
+                # the copies are named after the sha1 of their contents
+                fingerprint = self._lut_mirror.fingerprint(local_path)
+            elif hash_lut:
+                fingerprint = self._lut_fingerprints.fingerprint(local_path)
+            else:
+                # on the main thread, the LUT isn't read off the filer here and then
+                # once more by readLUT
+                fingerprint = self._lut_fingerprints.cached(local_path, st)
+        return local_path, fingerprint
+
+    def do_exr_look_setup(self, look_node, look_path, batch=None, prepared=None):
         """
         Takes the shot-specific csp (or cube) file that was previously located and applies it.
+        The LUT upload is deferred to a single updateLUT call at the end of the event loop
+        tick, shared by every source set up in the meantime.
         
         :param look_node: RVLookLUT node
         :param look_path: string, containing path to look LUT file
+        :param batch: PropertyBatch to add the writes to, written right away if None
+        :param prepared: the LUT to read as _prepare_lut returned it on the resolver pool,
+                         None to prepare it here
         """
         # if the file isn't bundled with the RV package, we can't do anything, so exit
         if not look_path:
-            self._logger.warning("Look LUT parameter is None!")
+            self._logger.warning("Look LUT parameter is None!", extra={'source': look_node})
             return
-        if not os.path.exists(look_path):
-            self._logger.warning("Look LUT not found at: %s" % look_path)
+        if prepared is None:
+            prepared = self._prepare_lut(look_path)
+        if prepared is None:
+            self._logger.warning("Look LUT not found at: %s", look_path, extra={'source': look_node})
             return
-        commands.readLUT(look_path, look_node)
-        commands.setIntProperty("%s.lut.active" % look_node, [1], True)
-        commands.updateLUT()
-        self._logger.info("Loaded Look LUT: %s" % look_path)
+        local_path, fingerprint = prepared
+        lcl_batch = batch if batch is not None else PropertyBatch()
+        if fingerprint and fingerprint == self._lut_fingerprint(look_node):
+            # the node already holds this LUT, and so does the GPU
+            self.lut_loads_avoided += 1
+            lcl_batch.set_int("%s.lut.active" % look_node, [1])
+            if batch is None:
+                lcl_batch.flush()
+            self._logger.debug("Look LUT already loaded: %s", look_path, extra={'source': look_node})
+            return
+        with self._perf_trace.span("read_lut", filesystem=True):
+            commands.readLUT(local_path, look_node)
+        self.lut_loads += 1
+        if fingerprint:
+            fingerprint_prop = "%s.romeo.lutFingerprint" % look_node
+            if not commands.propertyExists(fingerprint_prop):
+                commands.newProperty(fingerprint_prop, commands.StringType, 1)
+            lcl_batch.set_string(fingerprint_prop, [fingerprint])
+        lcl_batch.set_int("%s.lut.active" % look_node, [1])
+        if batch is None:
+            lcl_batch.flush()
+        request_lut_update(self._perf_trace)
+        self._logger.info("Loaded Look LUT: %s", look_path, extra={'source': look_node})
+
+    def _lut_fingerprint(self, look_node):
+        """
+        Returns the fingerprint of the LUT a look node holds, as recorded when
+        it was read in, None if it hasn't been recorded.
+
+        :param look_node: RVLookLUT node
+        """
+        fingerprint_prop = "%s.romeo.lutFingerprint" % look_node
+        if not commands.propertyExists(fingerprint_prop):
+            return None
+        fingerprint = commands.getStringProperty(fingerprint_prop)
+        return fingerprint[0] if fingerprint else None
         
+    def lut_cache_stats(self):
+        """
+        Returns the hit, miss and eviction counters of the local LUT mirror,
+        for monitoring. None if the mirror is disabled.
+        """
+        if not self._lut_mirror:
+            return None
+        return self._lut_mirror.stats()
+
+    def cache_stats(self):
+        """
+        Returns the size of everything the mode keeps around, for monitoring
+        sessions that stay open for days. Bounded caches report their number
+        of entries, bound and evictions, per-source state its number of
+        entries, which drops as sources are deleted.
+        """
+        stats = {
+            "pipeline_nodes": self._pipeline_nodes.stats(),
+            "current_nodes": self._current_nodes.stats(),
+            "source_ranges": self._source_range_index.stats(),
+        }
+        if self._show_config is not None:
+            stats["classified_sequences"] = self._show_config.classifier.stats()
+        if self._color_dir_cache is not None:
+            stats["color_dirs"] = self._color_dir_cache.stats()
+        if self._lut_fingerprints is not None:
+            stats["lut_fingerprints"] = self._lut_fingerprints.stats()
+        for name, state in (("pending_looks", self._pending_looks),
+                            ("baked_looks", self._baked_looks),
+                            ("watched_looks", self._look_color_dirs),
+                            ("deferred_looks", self._deferred_looks),
+                            ("queued_looks", self._queued_looks),
+                            ("job_luts", self._job_luts)):
+            stats[name] = {"entries": len(state)}
+        if self._lut_watcher is not None:
+            stats["lut_watches"] = {"entries": len(self._lut_watcher)}
+        if self._lut_prefetcher is not None:
+            stats["prefetch_sources"] = {"entries": len(self._lut_prefetcher)}
+        return stats
+
+    def show_perf_report(self, event):
+        """
+        Displays the total file system time and the slowest sources of the
+        session, as timed by the performance trace.
+        """
+        report = self._perf_trace.report()
+        stats = self.prefetch_stats()
+        if stats is not None:
+            report += "\nLUT prefetch: %(hits)d hits, %(misses)d misses, %(prefetched)d prefetched, " \
+                      "%(pending)d pending" % stats
+        if self._lut_fingerprints is not None:
+            report += "\nLook LUTs: %d loaded, %d already loaded" % (self.lut_loads, self.lut_loads_avoided)
+        extra_commands.displayFeedback(report, 10.0)
+
     def toggle_look(self, event):
         """
         If the LookLUT is currently on, turn it off, and vice versa.
         Display feedback so the user knows what's happening.
         """
-        # since the CDL should be enabled or disabled for a single
-        # source rather than on the session as a whole, reference the
-        # currently viewed node to toggle
-        look_node = self._get_node_for_source("RVLookLUT")
+        with self._perf_trace.span("toggle_look"):
+            # since the CDL should be enabled or disabled for a single
+            # source rather than on the session as a whole, reference the
+            # currently viewed node to toggle
+            look_node = self._get_node_for_source("RVLookLUT")
+            if look_node is None:
+                extra_commands.displayFeedback("No Romeo Shot LUT for this source", 5.0)
+                return
+            if look_node in self._deferred_looks:
+                # the prefetcher hasn't got to it yet, which also turns it on
+                self._lut_prefetcher.start(look_node)
+                self._stage_look(look_node)
+                extra_commands.displayFeedback("Loading Romeo Shot LUT", 5.0)
+                return
 
-        look_on = commands.getIntProperty("%s.lut.active" % look_node)[0]
-        if look_on:
-            commands.setIntProperty("%s.lut.active" % look_node, [0], True)
-            extra_commands.displayFeedback("Romeo Shot LUT is OFF", 5.0)
-        else:
-            commands.setIntProperty("%s.lut.active" % look_node, [1], True)
-            extra_commands.displayFeedback("Romeo Shot LUT is ON", 5.0)
+            look_on = commands.getIntProperty("%s.lut.active" % look_node)[0]
+            if look_on:
+                commands.setIntProperty("%s.lut.active" % look_node, [0], True)
+                extra_commands.displayFeedback("Romeo Shot LUT is OFF", 5.0)
+            else:
+                commands.setIntProperty("%s.lut.active" % look_node, [1], True)
+                extra_commands.displayFeedback("Romeo Shot LUT is ON", 5.0)
 
     def look_menu_state(self):
         """
@@ -385,6 +1439,8 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         # source rather than on the session as a whole, reference the
         # currently viewed node to toggle
         look_node = self._get_node_for_source("RVLookLUT")
+        if look_node is None:
+            return commands.UncheckedMenuState
         
         look_on = commands.getIntProperty("%s.lut.active" % look_node)[0]
         if look_on:
@@ -402,114 +1458,174 @@ class RomeoSourceSetup(rvtypes.MinorMode):
         If there is multiple media sources, then toggle both over mode and wipes on/off, otherwise
         default back to standard wipe toggling behavior.
         """
-        if len(commands.sources()) > 1:
-            wipe_shown = runtime.eval("rvui.wipeShown();", ["rvui"])
-            wipe_shown = int(str(wipe_shown))
-            # if Wipes are on, turn them off and vice versa
-            if wipe_shown == commands.CheckedMenuState:
-                # turn wipes off
-                runtime.eval("rvui.toggleWipe();", ["rvui"])
-                # make sure we're in "Sequence" mode
-                commands.setViewNode("defaultSequence")
-                extra_commands.displayFeedback("Wipes OFF", 5.0)
+        with self._perf_trace.span("toggle_wipes"):
+            if len(commands.sources()) > 1:
+                wipe_shown = runtime.eval("rvui.wipeShown();", ["rvui"])
+                wipe_shown = int(str(wipe_shown))
+                # if Wipes are on, turn them off and vice versa
+                if wipe_shown == commands.CheckedMenuState:
+                    # turn wipes off
+                    runtime.eval("rvui.toggleWipe();", ["rvui"])
+                    # make sure we're in "Sequence" mode
+                    commands.setViewNode("defaultSequence")
+                    extra_commands.displayFeedback("Wipes OFF", 5.0)
+                else:
+                    # make sure we're in "Over" mode
+                    commands.setViewNode("defaultStack")
+                    # turn wipes on
+                    runtime.eval("rvui.toggleWipe();", ["rvui"])
+                    extra_commands.displayFeedback("Wipes ON", 5.0)
             else:
-                # make sure we're in "Over" mode
-                commands.setViewNode("defaultStack")
-                # turn wipes on
-                runtime.eval("rvui.toggleWipe();", ["rvui"])
-                extra_commands.displayFeedback("Wipes ON", 5.0)
-        else:
-            extra_commands.displayFeedback("Can't wipe, only one source", 5.0)
+                extra_commands.displayFeedback("Can't wipe, only one source", 5.0)
             
     def toggle_media(self, var):
         """
-        Swap between Shotgun format media (frames/movie). Also
-        handles the case where we're not looking at Shotgun media, by
-        bailing out gracefully.
+        Swap between Shotgun format media (frames/movie), for every Shotgun
+        source of the current view at once. Also handles the case where we're
+        not looking at Shotgun media, by bailing out gracefully.
         """
-        source_node = commands.closestNodesOfType("RVFileSource")[0]
-        try:
-            media_type = commands.getStringProperty("%s.tracking.mediaType" % source_node)[0]
-        except:
-            # if the previous command throws an exception, we aren't
-            # looking at Shotgun sources
-            pass
-        else:
-            mu = """
-                require shotgun_mode;
-                shotgun_mode.theMode().swapMediaFromInfo("%s", "%s");
-            """
-            if str(media_type.lower()) == "dnxhd":
-                runtime.eval(mu % ("Frames", source_node), ["shotgun_mode"])
-            else:
-                runtime.eval(mu % ("DNXHD", source_node), ["shotgun_mode"])
-                
-            # recheck our current media_type since it's possible the
-            # media type doesn't exist and therefore wouldn't have
-            # changed
-            media_type = commands.getStringProperty("%s.tracking.mediaType" % source_node)[0]
-            if str(media_type).lower() == "frames":
-                # make sure our alexa node is active
-                commands.setIntProperty("#LinearToAlexaLogC.node.active", [1], True)
+        with self._perf_trace.span("toggle_media"):
+            start = time.time()
+            source_nodes = [source_node for source_node in commands.closestNodesOfType("RVFileSource")
+                            if commands.propertyExists("%s.tracking.mediaType" % source_node)]
+            if not source_nodes:
+                # we aren't looking at Shotgun sources
+                return
+            # every source goes the same way, decided by the first one
+            media_type = commands.getStringProperty("%s.tracking.mediaType" % source_nodes[0])[0]
+            if str(media_type).lower() == "dnxhd":
+                swap_to = "Frames"
             else:
-                # make sure our alexa node is not active
-                commands.setIntProperty("#LinearToAlexaLogC.node.active", [0], True)
+                swap_to = "DNXHD"
+            # a single Mu evaluation for all the sources, rather than one per source
+            mu = ["require shotgun_mode;", "{", "let mode = shotgun_mode.theMode();"]
+            for source_node in source_nodes:
+                mu.append('mode.swapMediaFromInfo("%s", "%s");' % (swap_to, source_node))
+            mu.append("}")
+            runtime.eval("\n".join(mu), ["shotgun_mode"])
+
+            # recheck the media type of each source since it's possible the
+            # media type doesn't exist for some of them and therefore wouldn't
+            # have changed
+            batch = PropertyBatch()
+            unchanged = 0
+            for source_node in source_nodes:
+                media_type = commands.getStringProperty("%s.tracking.mediaType" % source_node)[0]
+                if str(media_type).lower() != swap_to.lower():
+                    unchanged += 1
+                # the nodes of sources evicted from the cache are looked up in the graph again
+                nodes = self._source_nodes(commands.nodeGroup(source_node))
+                alexa_node = nodes.get("LinearToAlexaLogC") if nodes else None
+                if alexa_node is None:
+                    continue
+                # frames need the alexa node, unless their look LUT is baked and
+                # already does the LogC encode
+                look_node = nodes["RVLookLUT"]
+                alexa_on = str(media_type).lower() == "frames" and look_node not in self._baked_looks
+                batch.set_int("%s.node.active" % alexa_node, [1 if alexa_on else 0])
+            batch.flush()
+
+            elapsed = time.time() - start
+            self._logger.info("Swapped %d sources to %s in %.2f seconds", len(source_nodes), swap_to, elapsed)
             # and display some feedback so the user knows what's happening
-            extra_commands.displayFeedback("View %s" % media_type.upper(), 5.0)
+            feedback = "View %s, %d sources in %.2fs" % (swap_to.upper(), len(source_nodes), elapsed)
+            if unchanged:
+                feedback += ", %d without %s media" % (unchanged, swap_to.upper())
+            extra_commands.displayFeedback(feedback, 5.0)
             
                 
     def toggle_slate(self, var):
         """
         If the slate is "on", lop off the first frame, otherwise, add it back in
         """
-        source_nodes = commands.closestNodesOfType("RVFileSource")
-        for source_node in source_nodes:
-            source_path = commands.getStringProperty("%s.media.movie" % source_node)[0]
-            start_frame = 0
-            for source in commands.sources():
-                if source[0] == source_path:
-                    start_frame = int(source[1])
-                    break
+        with self._perf_trace.span("toggle_slate"):
+            source_nodes = commands.closestNodesOfType("RVFileSource")
+            batch = PropertyBatch()
+            for source_node, start_frame, end_frame in self._source_ranges(source_nodes):
+                if self._slate_on:
+                    batch.set_int("%s.cut.in" % source_node, [start_frame + 1])
+                else:
+                    batch.set_int("%s.cut.in" % source_node, [start_frame])
+            batch.flush()
+            self._prefetch_timeline_dirty = True
+            # we only want to set the flag and display feedback once, not for each source
             if self._slate_on:
-                commands.setIntProperty("%s.cut.in" % source_node, [start_frame + 1], True)
+                extra_commands.displayFeedback("Slate is OFF", 5.0)
+                self._slate_on = False
             else:
-                commands.setIntProperty("%s.cut.in" % source_node, [start_frame], True)      
-        # we only want to set the flag and display feedback once, not for each source
-        if self._slate_on:
-            extra_commands.displayFeedback("Slate is OFF", 5.0)
-            self._slate_on = False
-        else:
-            extra_commands.displayFeedback("Slate is ON", 5.0)
-            self._slate_on = True
+                extra_commands.displayFeedback("Slate is ON", 5.0)
+                self._slate_on = True
 
     def toggle_handles(self, var):
         """
-        If the handles are "on", lop off 8 at the head and tail, else, add them back in
+        If the handles are "on", lop them off at the head and tail, else, add them back in.
+        The handle length is the show's handle_length option, 8 frames by default.
         """
-        source_nodes = commands.closestNodesOfType("RVFileSource")
-        for source_node in source_nodes:
-            source_path = commands.getStringProperty("%s.media.movie" % source_node)[0]
-            start_frame = 0
-            end_frame = -1
-            for source in commands.sources():
-                if source[0] == source_path:
-                    start_frame = int(source[1])
-                    end_frame = int(source[2])
-                    break
+        with self._perf_trace.span("toggle_handles"):
+            # the show is only set up once an EXR or DPX source needs it, and a hotkey
+            # must not bring up the config file dialog
+            handle_length = 8
+            if self._show_config is not None:
+                handle_length = self._show_option('handle_length', 8, int)
+            source_nodes = commands.closestNodesOfType("RVFileSource")
+            batch = PropertyBatch()
+            for source_node, start_frame, end_frame in self._source_ranges(source_nodes):
+                if self._handles_on:
+                    # the head handles come after the slate frame
+                    batch.set_int("%s.cut.in" % source_node, [start_frame + 1 + handle_length])
+                    batch.set_int("%s.cut.out" % source_node, [end_frame - handle_length])
+                else:
+                    batch.set_int("%s.cut.in" % source_node, [start_frame])
+                    batch.set_int("%s.cut.out" % source_node, [end_frame])
+            batch.flush()
+            self._prefetch_timeline_dirty = True
+
+            # we only want to set the flag and display feedback once, not for each source
             if self._handles_on:
-                commands.setIntProperty("%s.cut.in" % source_node, [start_frame + 9], True)
-                commands.setIntProperty("%s.cut.out" % source_node, [end_frame - 8], True)
+                extra_commands.displayFeedback("Handles are OFF", 5.0)
+                self._handles_on = False
             else:
-                commands.setIntProperty("%s.cut.in" % source_node, [start_frame], True)
-                commands.setIntProperty("%s.cut.out" % source_node, [end_frame], True)
+                extra_commands.displayFeedback("Handles are ON", 5.0)
+                self._handles_on = True
 
-        # we only want to set the flag and display feedback once, not for each source
-        if self._handles_on:
-            extra_commands.displayFeedback("Handles are OFF", 5.0)
-            self._handles_on = False
-        else:
-            extra_commands.displayFeedback("Handles are ON", 5.0)
-            self._handles_on = True
+    def _source_ranges(self, source_nodes):
+        """
+        Returns a (source node, start frame, end frame) tuple for each of the
+        given source nodes, from the session's source range index. Sources the
+        index doesn't know about yet are looked up in commands.sources() in a
+        single pass. The range is (0, -1) for sources that can't be found.
+        
+        :param source_nodes: list of RVFileSource nodes
+        """
+        missing = [source_node for source_node in source_nodes
+                   if self._source_range_index.get(source_node) is None]
+        if missing:
+            self._index_source_ranges(missing)
+        ranges = []
+        for source_node in source_nodes:
+            entry = self._source_range_index.get(source_node)
+            if entry is None:
+                ranges.append((source_node, 0, -1))
+            else:
+                ranges.append((source_node, entry.start, entry.end))
+        return ranges
+
+    def _index_source_ranges(self, source_nodes):
+        """
+        Adds sources to the source range index, matching their media to the
+        ranges of commands.sources() like the toggles used to.
+        
+        :param source_nodes: list of RVFileSource nodes
+        """
+        session_ranges = {}
+        for source in commands.sources():
+            # the first source showing a media path wins
+            session_ranges.setdefault(source[0], (int(source[1]), int(source[2])))
+        for source_node in source_nodes:
+            source_path = commands.getStringProperty("%s.media.movie" % source_node)[0]
+            if source_path in session_ranges:
+                start_frame, end_frame = session_ranges[source_path]
+                self._source_range_index.add(source_node, source_path, start_frame, end_frame)
 
 
 def createMode():
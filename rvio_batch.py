@@ -0,0 +1,266 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Renders review movies of many clips with rvio, the Romeo source setup
+applying the shot LUTs like it does in RV, several rvio processes running
+at once.
+
+    python rvio_batch.py --config /path/to/show.cfg --output-dir /renders clips.txt
+    python rvio_batch.py cut_v012.edl -o /renders --jobs 6 --report render.json -- -outres 1920 1080
+
+Clips are read like lut_prewarm.py reads playlists (.rv sessions saved as
+text, EDLs, or plain lists of media paths). The look LUTs of all the clips
+are resolved up front, into a manifest the rvio processes read rather than
+going to the filer each. The plugin runs in batch mode in them: the show is
+taken from the environment, and nothing waits on a dialog or the event loop.
+
+Arguments after -- are handed to every rvio process. Each clip is reported
+with its render time and frames per second, the frame count being taken from
+the frame range of RV sequence notation, eg. plate.1001-1100#.exr.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from show_config import ShowConfig
+from lut_prewarm import read_playlist
+from lut_resolver_service import ShotLutResolver
+
+
+logger = logging.getLogger("romeo.rvio_batch")
+
+# frame range and padding of RV sequence notation, eg. .1001-1100#. or .1001-1100@@@@.
+_SEQUENCE = re.compile(r"[._](-?\d+)-(-?\d+)(?:x\d+)?(?:#+|@+|%0?\d*d)")
+
+
+def clip_frames(clip):
+    """
+    Returns the number of frames of an image sequence from its RV sequence
+    notation, None for anything else, eg. a movie.
+
+    :param clip: media path
+    """
+    match = _SEQUENCE.search(os.path.basename(clip))
+    if match is None:
+        return None
+    return int(match.group(2)) - int(match.group(1)) + 1
+
+
+def output_path(clip, output_dir, extension):
+    """
+    Returns the movie path a clip is rendered to, named after the clip
+    without its frame range and padding.
+
+    :param clip: media path
+    :param output_dir: directory the movies are written to
+    :param extension: extension of the movies, eg. mov
+    """
+    name = _SEQUENCE.sub("", os.path.basename(clip))
+    name = os.path.splitext(name)[0].rstrip("._")
+    return os.path.join(output_dir, "%s.%s" % (name, extension.lstrip(".")))
+
+
+def resolve_job_luts(show_config, clips, workers=8):
+    """
+    Returns {clip: (look LUT path, baked LUT path)} for the clips with a
+    look LUT, resolved on a pool of threads sharing one resolver.
+
+    :param show_config: ShowConfig of the show
+    :param clips: list of media paths
+    :param workers: number of threads going to the filer at once
+    """
+    resolver = ShotLutResolver(show_config)
+    pool = ThreadPool(max(workers, 1))
+    try:
+        results = pool.map(resolver.resolve, clips)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((clip, look_luts) for clip, look_luts in zip(clips, results) if look_luts[0])
+
+
+class RvioJob(object):
+    """
+    Renders one clip with rvio, recording how long it took and how it went.
+    """
+
+    def __init__(self, rvio, clip, output, rvio_args, env, log_path, timeout=None):
+        self.command = [rvio, clip, "-o", output] + list(rvio_args)
+        self.clip = clip
+        self.output = output
+        self.env = env
+        self.log_path = log_path
+        self.timeout = timeout
+        self.frames = clip_frames(clip)
+        self.seconds = None
+        self.returncode = None
+        self.error = None
+
+    def run(self):
+        start = time.time()
+        try:
+            with open(self.log_path, "w") as log:
+                process = subprocess.Popen(self.command, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+                timer = None
+                if self.timeout:
+                    timer = threading.Timer(self.timeout, process.kill)
+                    timer.start()
+                try:
+                    self.returncode = process.wait()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+        except OSError as e:
+            self.error = "could not run %s: %s" % (self.command[0], e)
+        self.seconds = time.time() - start
+        if self.error is None and self.returncode != 0:
+            self.error = "rvio exited with %s, see %s" % (self.returncode, self.log_path)
+        elif self.error is None and not os.path.exists(self.output):
+            self.error = "rvio didn't write %s, see %s" % (self.output, self.log_path)
+        return self
+
+    @property
+    def fps(self):
+        if not self.frames or not self.seconds or self.error:
+            return None
+        return self.frames / self.seconds
+
+    def result(self):
+        return {
+            "clip": self.clip,
+            "output": self.output,
+            "frames": self.frames,
+            "seconds": self.seconds,
+            "fps": self.fps,
+            "error": self.error,
+        }
+
+
+def render(jobs, concurrency):
+    """
+    Runs rvio jobs, at most concurrency of them at once, logging each one
+    as it finishes. Returns the jobs in the order they were given.
+
+    :param jobs: list of RvioJob
+    :param concurrency: number of rvio processes running at once
+    """
+    pool = ThreadPool(max(concurrency, 1))
+    try:
+        for job in pool.imap_unordered(RvioJob.run, jobs):
+            if job.error:
+                logger.error("Failed %s: %s", job.clip, job.error)
+            elif job.fps:
+                logger.info("Rendered %s: %d frames in %.1fs, %.1f fps", job.clip, job.frames, job.seconds, job.fps)
+            else:
+                logger.info("Rendered %s in %.1fs", job.clip, job.seconds)
+    finally:
+        pool.close()
+        pool.join()
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render review movies of many clips with rvio and the Romeo LUTs.")
+    parser.add_argument("playlists", nargs="+", help=".rv session saved as text, .edl, or list of media paths")
+    parser.add_argument("-o", "--output-dir", required=True, help="directory the movies are written to")
+    parser.add_argument("--config", default=os.environ.get("IH_SHOW_CFG_PATH"),
+                        help="show config file, defaults to $IH_SHOW_CFG_PATH")
+    parser.add_argument("--show", default=os.environ.get("IH_SHOW_CODE", "romeo"),
+                        help="show code, defaults to $IH_SHOW_CODE")
+    parser.add_argument("--rvio", default=os.environ.get("RVIO", "rvio"), help="rvio executable, defaults to $RVIO")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="number of rvio processes running at once")
+    parser.add_argument("--workers", type=int, default=8, help="number of threads resolving the look LUTs")
+    parser.add_argument("--extension", default="mov", help="extension of the movies")
+    parser.add_argument("--timeout", type=float, help="seconds after which a rvio process is killed")
+    parser.add_argument("--report", help="write the results of every clip to this JSON file")
+    parser.add_argument("--strict", action="store_true", help="don't render the clips without a look LUT")
+    argv = list(sys.argv[1:] if argv is None else argv)
+    rvio_args = []
+    if "--" in argv:
+        argv, rvio_args = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.config or not os.path.exists(args.config):
+        parser.error("no show config given, or it doesn't exist: %s" % args.config)
+
+    clips = []
+    seen = set()
+    for playlist in args.playlists:
+        try:
+            playlist_clips = read_playlist(playlist)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+        for clip in playlist_clips:
+            if clip not in seen:
+                seen.add(clip)
+                clips.append(clip)
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    start = time.time()
+    job_luts = resolve_job_luts(ShowConfig(args.config, args.show), clips, args.workers)
+    logger.info("Resolved the look LUTs of %d clips in %.2f seconds.", len(clips), time.time() - start)
+    without_lut = [clip for clip in clips if clip not in job_luts]
+    for clip in without_lut:
+        logger.warning("No look LUT for %s%s", clip, ", skipping it" if args.strict else "")
+    if args.strict:
+        clips = [clip for clip in clips if clip in job_luts]
+
+    handle, manifest = tempfile.mkstemp(prefix="romeo_luts_", suffix=".json", dir=args.output_dir)
+    with os.fdopen(handle, "w") as manifest_file:
+        json.dump(job_luts, manifest_file)
+    env = dict(os.environ)
+    env.update({
+        "IH_ROMEO_BATCH": "1",
+        "IH_SHOW_CFG_PATH": args.config,
+        "IH_SHOW_CODE": args.show,
+        "IH_ROMEO_LUT_MANIFEST": manifest,
+    })
+    jobs = []
+    for clip in clips:
+        output = output_path(clip, args.output_dir, args.extension)
+        jobs.append(RvioJob(args.rvio, clip, output, rvio_args, env, output + ".log", args.timeout))
+
+    start = time.time()
+    try:
+        render(jobs, args.jobs)
+    finally:
+        os.remove(manifest)
+    seconds = time.time() - start
+
+    failed = [job for job in jobs if job.error]
+    frames = sum(job.frames or 0 for job in jobs if not job.error)
+    logger.info("Rendered %d of %d clips in %.1f seconds with %d rvio processes: %d frames, %.1f fps overall.",
+                len(jobs) - len(failed), len(jobs), seconds, args.jobs, frames, frames / seconds if seconds else 0.0)
+    if args.report:
+        with open(args.report, "w") as report:
+            json.dump({
+                "seconds": seconds,
+                "frames": frames,
+                "fps": frames / seconds if seconds else None,
+                "without_lut": without_lut,
+                "clips": [job.result() for job in jobs],
+            }, report, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
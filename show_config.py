@@ -0,0 +1,414 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import sys
+import os
+import re
+import json
+import string
+import hashlib
+import logging
+import tempfile
+
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
+
+from bounded_cache import LruDict
+
+logger = logging.getLogger("romeo.show_config")
+
+# bumped whenever the layout of the cached profiles changes
+_PROFILE_VERSION = 1
+
+# the frame part of an image sequence file name, eg. the 1001-1100# in
+# plate.1001-1100#.exr, plate.1001.exr, plate.%04d.exr or plate.####.exr
+_FRAME_TOKEN = re.compile(r'(?<=\.)(?:\d+(?:-\d+)?(?:[#@]+|%0?\d*d)?|[#@]+|%0?\d*d)(?=\.[^.]*$)')
+_GROUP_NAME = re.compile(r'\(\?P([<=])(\w+)')
+
+# marker for a sequence that hasn't been classified yet, since None means it matched nothing
+_MISSING = object()
+
+
+def read_profile(cfg_path, show_code):
+    """
+    Parses the show config file and returns the profile of a show: the
+    settings of its section along with the show roots for this platform,
+    as plain strings.
+
+    :param cfg_path: path to the show config (ini) file
+    :param show_code: name of the show section, eg. romeo
+    """
+    cfg = ConfigParser.ConfigParser()
+    cfg.read(cfg_path)
+    return {
+        'production_root': cfg.get('production_root', sys.platform),
+        'show_root': cfg.get('show_root', sys.platform),
+        'options': dict(cfg.items(show_code)),
+    }
+
+
+def load_profile(cfg_path, show_code, cache_dir=None):
+    """
+    Returns the profile of a show like read_profile, from a copy cached in
+    cache_dir as long as the config file's mtime and size haven't changed,
+    which saves parsing the ini file.
+
+    :param cfg_path: path to the show config (ini) file
+    :param show_code: name of the show section, eg. romeo
+    :param cache_dir: directory the profiles are cached in, None to not cache them
+    """
+    if not cache_dir:
+        return read_profile(cfg_path, show_code)
+    try:
+        st = os.stat(cfg_path)
+    except OSError:
+        return read_profile(cfg_path, show_code)
+    key = {'version': _PROFILE_VERSION, 'cfg_path': cfg_path, 'show_code': show_code,
+           'platform': sys.platform, 'mtime': st.st_mtime, 'size': st.st_size}
+    name = hashlib.sha1(('%s\0%s' % (cfg_path, show_code)).encode('utf-8')).hexdigest()
+    profile_path = os.path.join(cache_dir, '%s.json' % name)
+    try:
+        with open(profile_path, 'r') as handle:
+            cached = json.load(handle)
+        if cached.get('key') == key:
+            return cached['profile']
+    except (IOError, OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    profile = read_profile(cfg_path, show_code)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write next to the final file and rename, so readers never see half a profile
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as handle:
+            json.dump({'key': key, 'profile': profile}, handle)
+        os.rename(tmp_path, profile_path)
+    except (IOError, OSError):
+        logger.warning('Unable to cache the show profile of %s in %s', cfg_path, cache_dir)
+    return profile
+
+
+def frame_stem(file_base):
+    """
+    Returns a file name with its frame number or frame range replaced by a
+    #, so that every frame of a sequence has the same stem.
+
+    :param str file_base: file name, without its directory
+    """
+    return _FRAME_TOKEN.sub('#', file_base, 1)
+
+
+class FilenameClassifier(object):
+    """
+    Works out which shot or sequence media files belong to, with the shot
+    and sequence patterns of the show combined into a single regexp.
+    Results are memoized per show root and frame sequence, so the frames of
+    a sequence are only matched once. Names whose frame field is matched as
+    part of the shot, eg. ABC.0010.exr, are memoized per name instead.
+    """
+
+    # memoized sequences kept at most, the least recently used ones are dropped first
+    max_entries = 100000
+
+    def __init__(self, show_config):
+        """
+        :param show_config: ShowConfig of the show
+        """
+        self._show_config = show_config
+        self._memo = LruDict(self.max_entries)
+        shot_pattern = show_config.option('shot_regexp', None)
+        sequence_pattern = show_config.option('sequence_regexp', None)
+        try:
+            # the shot pattern wins wherever it matches, the lazy prefix makes
+            # this a search for it first, then for the sequence pattern
+            self._combined = re.compile('^(?:.*?(?:%s)|.*?(?:%s))' % (
+                _GROUP_NAME.sub(r'(?P\1shot_\2', shot_pattern),
+                _GROUP_NAME.sub(r'(?P\1sequence_\2', sequence_pattern)), re.DOTALL)
+        except re.error:
+            # eg. patterns with global inline flags, fall back to matching them one at a time
+            self._combined = None
+
+    def _match(self, file_base):
+        """
+        Returns the (kind, sequence, shot) of a file name, or None, along with
+        the (start, end) span of the file name the patterns matched.
+        """
+        if self._combined is None:
+            shot_match = self._show_config.shot_regexp.search(file_base)
+            if shot_match:
+                groups = shot_match.groupdict()
+                return ('shot', groups['sequence'], groups['shot']), shot_match.span()
+            sequence_match = self._show_config.sequence_regexp.search(file_base)
+            if not sequence_match:
+                return None, None
+            return ('sequence', sequence_match.groupdict()['sequence'], 'SHARED'), sequence_match.span()
+        match = self._combined.match(file_base)
+        if not match:
+            return None, None
+        groups = match.groupdict()
+        prefix = 'shot_' if groups.get('shot_shot') is not None else 'sequence_'
+        spans = [match.span(name) for name in groups if name.startswith(prefix) and groups[name] is not None]
+        span = (min(start for start, end in spans), max(end for start, end in spans)) if spans else None
+        if prefix == 'shot_':
+            return ('shot', groups['shot_sequence'], groups['shot_shot']), span
+        return ('sequence', groups['sequence_sequence'], 'SHARED'), span
+
+    def classify(self, file_name):
+        """
+        Returns a (kind, sequence, shot, entity_dir) tuple, kind being 'shot'
+        or 'sequence', or None if the file name matches neither pattern.
+
+        :param str file_name: path of a media file
+        """
+        show_root = self._show_config.show_root_for(file_name)
+        file_base = os.path.basename(file_name)
+        key = (show_root, frame_stem(file_base))
+        entity = self._memo.get(key, _MISSING)
+        if entity is _MISSING and key[1] != file_base:
+            # names whose frame field is part of the shot are memoized by name
+            entity = self._memo.get((show_root, file_base), _MISSING)
+        if entity is not _MISSING:
+            return entity
+        entity, span = self._match(file_base)
+        frame_token = _FRAME_TOKEN.search(file_base)
+        if span is not None and frame_token is not None and \
+                span[0] < frame_token.end() and frame_token.start() < span[1]:
+            key = (show_root, file_base)
+        if entity is not None:
+            kind, sequence, shot = entity
+            entity_dir = self._show_config.shot_dir_format.format(show_root=show_root, pathsep=os.path.sep,
+                                                                  sequence=sequence, shot=shot)
+            entity = (kind, sequence, shot, entity_dir)
+        self._memo[key] = entity
+        return entity
+
+    def classify_many(self, file_names):
+        """
+        Classifies a batch of media files, eg. the media.movie lists of every
+        source of a session chained together. Returns the classify() results
+        in the same order.
+
+        :param file_names: iterable of media file paths
+        """
+        return [self.classify(file_name) for file_name in file_names]
+
+    def clear(self):
+        self._memo.clear()
+
+    def stats(self):
+        """
+        Returns the number of memoized sequences, the bound and the number of evictions.
+        """
+        return self._memo.stats()
+
+    def __len__(self):
+        return len(self._memo)
+
+
+class ShowConfig(object):
+    """
+    The parts of the Romeo show config file that the source setup needs in
+    order to map media to shot LUTs. This doesn't depend on RV, so that
+    offline tools resolve LUTs exactly like the plugin does.
+
+    The regexps are only compiled the first time they are needed.
+    """
+
+    def __init__(self, cfg_path, show_code, profile=None):
+        """
+        :param cfg_path: path to the show config (ini) file
+        :param show_code: name of the show section, eg. romeo
+        :param profile: show profile returned by load_profile, read from cfg_path if None
+        """
+        self.cfg_path = cfg_path
+        self.show_code = show_code
+        if profile is None:
+            profile = read_profile(cfg_path, show_code)
+        self._options = profile['options']
+        self.production_root = profile['production_root']
+        self.inhouse_root = profile['show_root']
+        self.shot_dir_format = self._options['shot_dir_format']
+        self.sequence_dir_format = self._options['seq_dir_format']
+        self.shot_color_dir = self._options['cdl_dir_format'].format(pathsep=os.path.sep)
+        self._regexps = {}
+        self._classifier = None
+
+    @classmethod
+    def load(cls, cfg_path, show_code, cache_dir=None):
+        """
+        Returns the ShowConfig of a show, going through the profile cache.
+
+        :param cfg_path: path to the show config (ini) file
+        :param show_code: name of the show section, eg. romeo
+        :param cache_dir: directory the profiles are cached in, None to not cache them
+        """
+        return cls(cfg_path, show_code, load_profile(cfg_path, show_code, cache_dir))
+
+    def _regexp(self, option):
+        regexp = self._regexps.get(option)
+        if regexp is None:
+            regexp = self._regexps[option] = re.compile(self._options[option])
+        return regexp
+
+    @property
+    def shot_regexp(self):
+        return self._regexp('shot_regexp')
+
+    @property
+    def sequence_regexp(self):
+        return self._regexp('sequence_regexp')
+
+    @property
+    def mainplate_regexp(self):
+        return self._regexp('mainplate_regexp')
+
+    def option(self, option, default, convert=str):
+        """
+        Returns an optional setting from the show section of the config
+        file, or the default if the show doesn't set it.
+
+        :param str option: name of the option in the show section
+        :param default: value to use when the option isn't set
+        :param convert: callable used to convert the string value
+        """
+        # ConfigParser lower cases option names
+        value = self._options.get(option.lower())
+        if value is None:
+            return default
+        return convert(value)
+
+    def show_root_for(self, file_name):
+        """
+        Returns the show root a file lives under, the in-house tree or
+        production.
+
+        :param str file_name: path of a media file
+        """
+        if file_name.startswith(self.inhouse_root):
+            return self.inhouse_root
+        return self.production_root
+
+    def roots(self):
+        """
+        Returns every show root that shot trees can live under.
+        """
+        return [self.production_root, self.inhouse_root]
+
+    @property
+    def classifier(self):
+        """
+        The FilenameClassifier of the show, created on first use.
+        """
+        if self._classifier is None:
+            self._classifier = FilenameClassifier(self)
+        return self._classifier
+
+    def classify(self, file_name):
+        """
+        Works out which shot or sequence a media file belongs to. Returns a
+        (kind, sequence, shot, entity_dir) tuple, kind being 'shot' or
+        'sequence', or None if the file name matches neither pattern.
+
+        :param str file_name: path of a media file
+        """
+        return self.classifier.classify(file_name)
+
+    def classify_many(self, file_names):
+        """
+        Classifies a batch of media files, see FilenameClassifier.classify_many.
+
+        :param file_names: iterable of media file paths
+        """
+        return self.classifier.classify_many(file_names)
+
+    def color_dir_for(self, entity_dir):
+        """
+        Returns the color directory of a shot or sequence directory.
+
+        :param str entity_dir: shot or sequence directory
+        """
+        return os.path.join(entity_dir, self.shot_color_dir)
+
+    def color_dir_glob(self, show_root):
+        """
+        Returns a glob pattern matching the color directory of every shot and
+        sequence under the given show root.
+
+        :param str show_root: production or in-house show root
+        """
+        entity_glob = self.shot_dir_format.format(show_root=show_root, pathsep=os.path.sep,
+                                                  sequence='*', shot='*')
+        return self.color_dir_for(entity_glob)
+
+    def color_dir_regexp(self, show_root):
+        """
+        Returns a compiled regexp matching the color directories found with
+        color_dir_glob, capturing their sequence and shot.
+
+        :param str show_root: production or in-house show root
+        """
+        pattern = ''
+        for literal, field, spec, conversion in string.Formatter().parse(self.shot_dir_format):
+            pattern += re.escape(literal)
+            if field == 'show_root':
+                pattern += re.escape(show_root)
+            elif field == 'pathsep':
+                pattern += re.escape(os.path.sep)
+            elif field in ('sequence', 'shot'):
+                # a field can show up more than once in the format
+                if '(?P<%s>' % field in pattern:
+                    pattern += '(?P=%s)' % field
+                else:
+                    pattern += '(?P<%s>[^%s]+)' % (field, re.escape(os.path.sep))
+        return re.compile('^' + re.escape(self.color_dir_for('\0')).replace(re.escape('\0'), pattern, 1) + '$')
+
+    def choose_lut(self, snapshot):
+        """
+        Picks the look LUT out of a shot color directory snapshot. CSP files
+        win over cube files, and the most recently modified file wins within
+        each format.
+
+        :param snapshot: DirectorySnapshot of the shot color directory
+        """
+        csp_files = []
+        cube_files = []
+        for entry in snapshot.entries:
+            if os.path.splitext(entry.name)[-1].lower() == '.cube':
+                cube_files.append(entry)
+            elif os.path.splitext(entry.name)[-1].lower() == '.csp':
+                csp_files.append(entry)
+
+        if len(csp_files) == 0 and len(cube_files) == 0:
+            return None
+
+        # on the off chance there's more than one cdl sort by modified time so we use
+        # the latest
+        csp_files.sort(key=lambda x: x.mtime, reverse=True)
+        cube_files.sort(key=lambda x: x.mtime, reverse=True)
+        likely_lut = None
+        # for csp_file in csp_files:
+        #     if self.mainplate_regexp.search(csp_file.path):
+        #         likely_lut = csp_file.path
+        #         break
+        if not likely_lut and len(csp_files) > 0:
+            likely_lut = csp_files[0].path
+
+        if not likely_lut:
+            for cube_file in cube_files:
+                if self.mainplate_regexp.search(cube_file.path):
+                    likely_lut = cube_file.path
+                    break
+        if not likely_lut and len(cube_files) > 0:
+            likely_lut = cube_files[0].path
+
+        return likely_lut
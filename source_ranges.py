@@ -0,0 +1,94 @@
+# Copyright (c) 2017 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import collections
+
+from bounded_cache import LruDict
+
+
+SourceRange = collections.namedtuple("SourceRange", "source_node media_path start end")
+
+
+class SourceRangeIndex(object):
+    """
+    Frame range of the media of every source in the session, kept up to date
+    as sources are added and removed, so that the slate and handles toggles
+    don't have to scan commands.sources() for each source node. Past
+    max_entries sources, the least recently used ones are dropped, and
+    looked up in commands.sources() again if they are needed.
+    """
+
+    def __init__(self, max_entries=10000):
+        """
+        :param max_entries: number of sources kept at most
+        """
+        # source node -> SourceRange
+        self._by_node = LruDict(max_entries, self._forget_path)
+        # media path -> SourceRanges of the sources showing it, in the order they were added
+        self._by_path = {}
+
+    def add(self, source_node, media_path, start, end):
+        """
+        Records the range of a source, replacing what was known about it.
+
+        :param source_node: RVFileSource or RVImageSource node
+        :param media_path: first media path of the source
+        :param start: first frame of the media
+        :param end: last frame of the media
+        """
+        self.remove(source_node)
+        entry = SourceRange(source_node, media_path, int(start), int(end))
+        self._by_node[source_node] = entry
+        self._by_path.setdefault(media_path, []).append(entry)
+        return entry
+
+    def remove(self, source_node):
+        """
+        Forgets a source that is being deleted.
+
+        :param source_node: RVFileSource or RVImageSource node
+        """
+        entry = self._by_node.pop(source_node, None)
+        if entry is not None:
+            self._forget_path(source_node, entry)
+
+    def _forget_path(self, source_node, entry):
+        entries = self._by_path.get(entry.media_path, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            self._by_path.pop(entry.media_path, None)
+
+    def get(self, source_node):
+        """
+        Returns the SourceRange of a source node, None if it isn't known.
+        """
+        return self._by_node.get(source_node)
+
+    def lookup(self, media_path):
+        """
+        Returns the SourceRange of the first source showing a media path,
+        None if there isn't one.
+        """
+        entries = self._by_path.get(media_path)
+        return entries[0] if entries else None
+
+    def clear(self):
+        self._by_node.clear()
+        self._by_path.clear()
+
+    def stats(self):
+        """
+        Returns the number of sources, the bound and the number of evictions.
+        """
+        return self._by_node.stats()
+
+    def __len__(self):
+        return len(self._by_node)